@@ -0,0 +1,172 @@
+"""
+Control de admisión para las peticiones caras (descargas y exportaciones).
+
+Antes de hacer cualquier trabajo se estima el costo de una petición como el
+número de archivos que implica (estaciones × tipos de dato) y:
+  - cada cliente tiene una cubeta de tokens (SMN_CLIENTE_RAFAGA archivos que
+    se reponen a SMN_CLIENTE_TASA por segundo); si no le alcanza, 429 con
+    Retry-After. Una petición más grande que la cubeta solo entra con la
+    cubeta llena y la vacía;
+  - las descargas en curso están acotadas (SMN_DESCARGAS_SIMULTANEAS) con una
+    fila de espera corta (SMN_DESCARGAS_EN_ESPERA, hasta
+    SMN_DESCARGAS_ESPERA_MAX segundos); con la fila llena se rechaza al
+    momento con 503 y Retry-After.
+
+LimiteTasa acota además las peticiones por segundo hacia el SMN (lo usa
+ClienteSMN). Las rutas baratas (/api/estados, /api/estaciones, ...) no pasan
+por aquí.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import anyio
+
+SMN_CLIENTE_RAFAGA = float(os.getenv("SMN_CLIENTE_RAFAGA", "2000"))
+SMN_CLIENTE_TASA = float(os.getenv("SMN_CLIENTE_TASA", "20"))
+SMN_DESCARGAS_SIMULTANEAS = int(os.getenv("SMN_DESCARGAS_SIMULTANEAS", "4"))
+SMN_DESCARGAS_EN_ESPERA = int(os.getenv("SMN_DESCARGAS_EN_ESPERA", "8"))
+SMN_DESCARGAS_ESPERA_MAX = float(os.getenv("SMN_DESCARGAS_ESPERA_MAX", "10"))
+SMN_CONFIAR_PROXY = os.getenv("SMN_CONFIAR_PROXY", "0") == "1"  # usar X-Forwarded-For para identificar al cliente
+
+
+class CubetaTokens:
+    """Cubeta de tokens: `capacidad` como máximo, se repone a `tasa` por segundo."""
+
+    def __init__(self, capacidad, tasa):
+        self.capacidad = capacidad
+        self.tasa = tasa
+        self._tokens = capacidad
+        self._momento = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reponer(self, ahora):
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._momento) * self.tasa)
+        self._momento = ahora
+
+    def tomar(self, costo=1):
+        """Toma `costo` tokens; regresa 0 si alcanzó o los segundos que faltan para que alcance."""
+        costo = min(costo, self.capacidad)
+        with self._lock:
+            self._reponer(time.monotonic())
+            if self._tokens >= costo:
+                self._tokens -= costo
+                return 0.0
+            return (costo - self._tokens) / self.tasa if self.tasa > 0 else math.inf
+
+    def devolver(self, costo):
+        """Regresa tokens de una petición que al final no se hizo."""
+        with self._lock:
+            self._tokens = min(self.capacidad, self._tokens + min(costo, self.capacidad))
+
+    def llena(self):
+        with self._lock:
+            self._reponer(time.monotonic())
+            return self._tokens >= self.capacidad
+
+
+class LimitadorClientes:
+    """Una cubeta por cliente; se olvidan las de los clientes menos recientes que ya se llenaron."""
+
+    def __init__(self, capacidad=SMN_CLIENTE_RAFAGA, tasa=SMN_CLIENTE_TASA, max_clientes=10000):
+        self.capacidad = capacidad
+        self.tasa = tasa
+        self.max_clientes = max_clientes
+        self._cubetas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def admitir(self, cliente, costo):
+        """0 si se admite; si no, los segundos a esperar."""
+        with self._lock:
+            cubeta = self._cubetas.get(cliente)
+            if cubeta is None:
+                cubeta = self._cubetas[cliente] = CubetaTokens(self.capacidad, self.tasa)
+                while len(self._cubetas) > self.max_clientes:
+                    viejo, anterior = next(iter(self._cubetas.items()))
+                    if not anterior.llena():
+                        break
+                    del self._cubetas[viejo]
+            self._cubetas.move_to_end(cliente)
+        return cubeta.tomar(costo)
+
+    def devolver(self, cliente, costo):
+        with self._lock:
+            cubeta = self._cubetas.get(cliente)
+        if cubeta is not None:
+            cubeta.devolver(costo)
+
+
+class LimiteTasa:
+    """Bloquea al hilo que llama hasta que haya cupo: como mucho `por_segundo` en promedio."""
+
+    def __init__(self, por_segundo, rafaga=None):
+        self._cubeta = CubetaTokens(rafaga or max(1.0, por_segundo), por_segundo)
+
+    def esperar(self):
+        while (espera := self._cubeta.tomar(1)) > 0:
+            time.sleep(espera)
+
+
+class CupoLleno(Exception):
+    """No hay lugar para otra descarga; `reintentar` son los segundos sugeridos."""
+
+    def __init__(self, reintentar):
+        super().__init__(f"Reintentar en {reintentar} s")
+        self.reintentar = reintentar
+
+
+class CupoDescargas:
+    """
+    Descargas caras en curso acotadas a `simultaneas`, con hasta `en_espera`
+    esperando a lo más `espera_max` segundos. Se libera con la función que
+    regresa entrar() (las respuestas en flujo la llaman al terminar de enviar).
+    """
+
+    def __init__(self, simultaneas=SMN_DESCARGAS_SIMULTANEAS, en_espera=SMN_DESCARGAS_EN_ESPERA,
+                 espera_max=SMN_DESCARGAS_ESPERA_MAX):
+        self.simultaneas = simultaneas
+        self.en_espera = en_espera
+        self.espera_max = espera_max
+        self._limitador = anyio.CapacityLimiter(simultaneas)
+        self._duracion = 5.0  # promedio móvil de lo que tarda una descarga, para Retry-After
+
+    def reintentar(self):
+        esperando = self._limitador.statistics().tasks_waiting
+        return max(1, math.ceil(self._duracion * (esperando + 1) / self.simultaneas))
+
+    def estado(self):
+        estadisticas = self._limitador.statistics()
+        return {"en_curso": estadisticas.borrowed_tokens, "en_espera": estadisticas.tasks_waiting}
+
+    async def entrar(self):
+        """Espera un lugar y regresa la función para liberarlo; CupoLleno si no lo hay."""
+        if self._limitador.statistics().tasks_waiting >= self.en_espera:
+            raise CupoLleno(self.reintentar())
+        ficha = object()
+        with anyio.move_on_after(self.espera_max):
+            await self._limitador.acquire_on_behalf_of(ficha)
+        if ficha not in self._limitador.statistics().borrowers:
+            raise CupoLleno(self.reintentar())
+
+        inicio = time.monotonic()
+        liberada = False
+
+        def liberar():
+            nonlocal liberada
+            if liberada:
+                return
+            liberada = True
+            self._duracion = 0.8 * self._duracion + 0.2 * (time.monotonic() - inicio)
+            self._limitador.release_on_behalf_of(ficha)
+        return liberar
+
+
+def cliente_de(request):
+    """Identidad del cliente para las cubetas: su IP (o la primera de X-Forwarded-For tras un proxy)."""
+    if SMN_CONFIAR_PROXY:
+        reenviado = request.headers.get("x-forwarded-for", "").split(",")[0].strip()
+        if reenviado:
+            return reenviado
+    return request.client.host if request.client else "desconocido"
@@ -0,0 +1,155 @@
+"""
+Agregados climatológicos (mensuales y anuales) sobre las series diarias.
+
+Las series de todas las estaciones pedidas se concatenan y se reducen en una
+sola pasada con np.*.reduceat: como cada serie viene ordenada por fecha, los
+días de un mismo (estación, periodo) quedan contiguos. Cada resultado se
+guarda en su SerieDiaria, así que se invalida solo cuando cambia el TXT.
+
+Las anomalías se calculan contra las normales (parse_normales_txt): para
+precipitación y evaporación se compara la suma del periodo, para las
+temperaturas la media. Un periodo con menos de SMN_ANOMALIA_COBERTURA de sus
+días del calendario con dato no tiene anomalía (NaN) y se marca como
+incompleto: una suma de pocos días parecería una sequía.
+"""
+import csv
+import io
+import os
+
+import numpy as np
+
+from catalogo import normalizar
+
+SMN_ANOMALIA_COBERTURA = float(os.getenv("SMN_ANOMALIA_COBERTURA", "0.8"))
+
+PERIODOS = {"mensual": "M", "anual": "Y"}
+ESTADISTICAS = ("suma", "media", "maximo", "minimo", "dias_validos", "dias")
+
+# Qué estadística se compara con la normal de cada variable
+VALOR_NORMAL = {"precip": "suma", "evap": "suma", "tmax": "media", "tmin": "media"}
+
+# Títulos de tabla de las normales del SMN (normalizados) -> variable
+TITULOS_NORMALES = (
+    ("temperatura maxima", "tmax"),
+    ("temperatura minima", "tmin"),
+    ("precipitacion", "precip"),
+    ("evaporacion", "evap"),
+)
+
+
+class Agregado:
+    """Estadísticas de una estación por periodo (datetime64[M] o [Y])."""
+
+    __slots__ = ("periodos",) + ESTADISTICAS
+
+    def __init__(self, periodos, **estadisticas):
+        self.periodos = periodos
+        for nombre in ESTADISTICAS:
+            setattr(self, nombre, estadisticas[nombre])
+
+    def rango(self, desde=None, hasta=None):
+        """Copia limitada a desde <= periodo <= hasta (ya en la unidad del periodo)."""
+        i = 0 if desde is None else np.searchsorted(self.periodos, desde, side="left")
+        j = len(self.periodos) if hasta is None else np.searchsorted(self.periodos, hasta, side="right")
+        return Agregado(self.periodos[i:j], **{n: getattr(self, n)[i:j] for n in ESTADISTICAS})
+
+
+def _reducir(series, variable, unidad):
+    """Agregados de varias series en una sola pasada vectorizada."""
+    largos = np.array([len(s) for s in series])
+    if not largos.sum():
+        vacio = np.array([], dtype=f"datetime64[{unidad}]")
+        return [Agregado(vacio, **{n: np.array([]) for n in ESTADISTICAS}) for _ in series]
+
+    periodo = np.concatenate([s.fechas for s in series]).astype(f"datetime64[{unidad}]").astype(np.int64)
+    valores = np.concatenate([s.valores[variable] for s in series]).astype(np.float64)
+    estacion = np.repeat(np.arange(len(series)), largos)
+
+    # Llave (estación, periodo) no decreciente: los grupos son tramos contiguos
+    base = periodo.min()
+    amplitud = periodo.max() - base + 1
+    llave = estacion * amplitud + (periodo - base)
+    inicios = np.concatenate(([0], np.flatnonzero(np.diff(llave)) + 1))
+
+    validos = ~np.isnan(valores)
+    dias_validos = np.add.reduceat(validos.astype(np.int64), inicios)
+    dias = np.diff(np.append(inicios, len(llave)))
+    suma = np.add.reduceat(np.where(validos, valores, 0.0), inicios)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        media = suma / dias_validos
+    maximo = np.maximum.reduceat(np.where(validos, valores, -np.inf), inicios)
+    minimo = np.minimum.reduceat(np.where(validos, valores, np.inf), inicios)
+
+    sin_datos = dias_validos == 0
+    for arr in (suma, media, maximo, minimo):
+        arr[sin_datos] = np.nan
+
+    grupo_estacion = estacion[inicios]
+    periodos = (llave[inicios] - grupo_estacion * amplitud + base).astype(f"datetime64[{unidad}]")
+    cortes = np.searchsorted(grupo_estacion, np.arange(1, len(series)))
+    columnas = {"suma": suma, "media": media, "maximo": maximo, "minimo": minimo,
+                "dias_validos": dias_validos, "dias": dias}
+    partes = {n: np.split(arr, cortes) for n, arr in columnas.items()}
+    return [
+        Agregado(p, **{n: partes[n][i] for n in ESTADISTICAS})
+        for i, p in enumerate(np.split(periodos, cortes))
+    ]
+
+
+def agregar(series, variable, periodo):
+    """
+    Lista de Agregado (uno por serie, en el mismo orden). Solo se calculan, juntas,
+    las series que no tienen ya el resultado guardado.
+    """
+    llave = (variable, periodo)
+    faltantes = [s for s in series if llave not in s.agregados]
+    if faltantes:
+        for s, agregado in zip(faltantes, _reducir(faltantes, variable, PERIODOS[periodo])):
+            s.agregados[llave] = agregado
+    return [s.agregados[llave] for s in series]
+
+
+def normales_mensuales(csv_normales):
+    """
+    {variable: arreglo de 13 valores (ENE..DIC, ANUAL)} con la fila NORMAL de
+    cada tabla del CSV de parse_normales_txt. Los valores ilegibles quedan NaN.
+    """
+    normales = {}
+    variable = None
+    for fila in csv.reader(io.StringIO(csv_normales)):
+        if not fila:
+            continue
+        titulo = normalizar(fila[0])
+        if len(fila) == 2 and not fila[1]:
+            variable = next((v for t, v in TITULOS_NORMALES if titulo.startswith(t)), None)
+        elif variable and titulo == "normal" and variable not in normales:
+            valores = []
+            for celda in fila[1:14]:
+                try:
+                    valores.append(float(celda.replace(",", "")))
+                except ValueError:
+                    valores.append(np.nan)
+            valores += [np.nan] * (13 - len(valores))
+            normales[variable] = np.array(valores)
+    return normales
+
+
+def dias_calendario(periodos):
+    """Días de cada periodo (datetime64[M] o [Y]) según el calendario, haya o no renglón en el TXT."""
+    return ((periodos + 1).astype("datetime64[D]") - periodos.astype("datetime64[D]")).astype(np.int64)
+
+
+def calcular_anomalias(agregado, variable, normal, periodo, cobertura=SMN_ANOMALIA_COBERTURA):
+    """
+    (normal, anomalía, incompleto) por periodo; normal es el arreglo de
+    normales_mensuales. Donde los días válidos no llegan a `cobertura` del
+    periodo la anomalía es NaN e incompleto es True.
+    """
+    if periodo == "mensual":
+        idx = agregado.periodos.astype(np.int64) % 12
+    else:
+        idx = np.full(len(agregado.periodos), 12)
+    referencia = normal[idx]
+    incompleto = agregado.dias_validos < cobertura * dias_calendario(agregado.periodos)
+    anomalia = np.where(incompleto, np.nan, getattr(agregado, VALOR_NORMAL[variable]) - referencia)
+    return referencia, anomalia, incompleto
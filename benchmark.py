@@ -0,0 +1,483 @@
+"""
+Benchmarks de los parsers y de la API contra un corpus de archivos del SMN.
+
+    python benchmark.py corpus                  # genera bench/corpus/ (reproducible)
+    python benchmark.py parsers                 # parsers e iter_kml
+    python benchmark.py endpoints               # arranque y latencias de la API
+    python benchmark.py todo --guardar-base     # todo, y lo guarda como base
+
+El corpus tiene TXT diarios y mensuales chicos, típicos y muy largos, normales
+y extremos, y un KML grande con estaciones cuyas URLs apuntan a esos TXT. Se
+genera con semilla fija, así que dos máquinas miden lo mismo; para medir con
+TXT reales basta con dejarlos en bench/corpus/ con el nombre {tipo}-{tamaño}.txt.
+
+Para los endpoints se levanta la API con uvicorn y un servidor local que hace
+las veces del SMN (con --latencia-smn de retraso por archivo), apuntando
+SMN_BASE_URL, SMN_KML_FILE y SMN_CACHE_DIR a lugares temporales.
+
+Cada corrida se guarda en bench/ultimo.json y se compara con bench/base.json:
+las métricas que empeoran más de --tolerancia se listan como regresiones y el
+proceso termina con código 1.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+BENCH_DIR = BASE_DIR / "bench"
+CORPUS_DIR = BENCH_DIR / "corpus"
+BASE_JSON = BENCH_DIR / "base.json"
+ULTIMO_JSON = BENCH_DIR / "ultimo.json"
+
+SEMILLA = 20251012
+URL_SMN = "https://smn.conagua.gob.mx/tools/RESOURCES"
+
+# Años de historia de cada tamaño del corpus
+ANIOS_DIARIOS = {"chico": 1, "tipico": 30, "largo": 110}
+ANIOS_MENSUALES = {"chico": 5, "tipico": 40, "largo": 100}
+# Proporción de estaciones del KML que apuntan a cada tamaño
+REPARTO_TAMANOS = (("chico", 0.2), ("tipico", 0.7), ("largo", 0.1))
+
+ESTADOS = [
+    "AGUASCALIENTES", "BAJA CALIFORNIA", "BAJA CALIFORNIA SUR", "CAMPECHE", "COAHUILA", "COLIMA",
+    "CHIAPAS", "CHIHUAHUA", "CIUDAD DE MÉXICO", "DURANGO", "GUANAJUATO", "GUERRERO", "HIDALGO",
+    "JALISCO", "MÉXICO", "MICHOACÁN", "MORELOS", "NAYARIT", "NUEVO LEÓN", "OAXACA", "PUEBLA",
+    "QUERÉTARO", "QUINTANA ROO", "SAN LUIS POTOSÍ", "SINALOA", "SONORA", "TABASCO", "TAMAULIPAS",
+    "TLAXCALA", "VERACRUZ", "YUCATÁN", "ZACATECAS",
+]
+MESES = ["ENE", "FEB", "MAR", "ABR", "MAY", "JUN", "JUL", "AGO", "SEP", "OCT", "NOV", "DIC"]
+TABLAS_MENSUALES = [
+    "PRECIPITACIÓN MENSUAL", "PRECIPITACIÓN MÁXIMA DIARIA", "EVAPORACIÓN MENSUAL",
+    "TEMPERATURA MÁXIMA PROMEDIO", "TEMPERATURA MEDIA PROMEDIO", "TEMPERATURA MÍNIMA PROMEDIO",
+    "TEMPERATURA MÁXIMA EXTREMA", "TEMPERATURA MÍNIMA EXTREMA",
+]
+
+ENCABEZADO_TXT = """                 COMISIÓN NACIONAL DEL AGUA
+     COORDINACIÓN GENERAL DEL SERVICIO METEOROLÓGICO NACIONAL
+           BASE DE DATOS CLIMATOLÓGICA NACIONAL
+{titulo}
+
+EMISIÓN         : 12/10/2025
+ESTACIÓN        : 20001
+NOMBRE          : ESTACIÓN DE REFERENCIA
+ESTADO          : OAXACA
+MUNICIPIO       : OAXACA DE JUÁREZ
+SITUACIÓN       : OPERANDO
+CVE-OMM         :
+LATITUD         : 17.0833 °
+LONGITUD        : -96.7167 °
+ALTITUD         : 1,550 msnm
+"""
+
+
+# ---------------------- CORPUS ----------------------
+def _valor(rng, lo, hi, nulos=0.05):
+    return "Nulo" if rng.random() < nulos else f"{rng.uniform(lo, hi):.1f}"
+
+
+def txt_diarios(rng, anios):
+    lineas = [ENCABEZADO_TXT.format(titulo="               (SISTEMA CLICOM)"), "",
+              "FECHA\t\tPRECIP\tEVAP\tTMAX\tTMIN", "\t\t(MM)\t(MM)\t(°C)\t(°C)"]
+    dia = date(2025 - anios, 1, 1)
+    for _ in range(anios * 365):
+        precip = "0" if rng.random() < 0.6 else _valor(rng, 0, 80)
+        fila = [precip, _valor(rng, 0, 12, 0.3), _valor(rng, 15, 38), _valor(rng, -2, 20)]
+        lineas.append(dia.isoformat() + "\t" + "\t".join(fila))
+        dia += timedelta(days=1)
+    return "\n".join(lineas) + "\n"
+
+
+def txt_mensuales(rng, anios):
+    lineas = [ENCABEZADO_TXT.format(titulo="               ESTADÍSTICA MENSUAL"), ""]
+    etiquetas = ["AÑO"] + MESES + ["ACUM", "PROM", "MESES"]
+    for titulo in TABLAS_MENSUALES:
+        lineas += ["", titulo, "".join(f"{e:<8}" for e in etiquetas).rstrip()]
+        for anio in range(2025 - anios, 2025):
+            valores = "".join(f"{_valor(rng, 0, 99):<8}" for _ in MESES)
+            lineas.append(f"{anio:<8}{valores}{_valor(rng, 0, 900, 0):<8}{_valor(rng, 0, 50, 0):<8}12")
+    return "\n".join(lineas) + "\n"
+
+
+def txt_normales(rng):
+    lineas = [ENCABEZADO_TXT.format(titulo=""), "", "NORMALES CLIMATOLÓGICAS 1991-2020", ""]
+    renglones = ["NORMAL", "MÁXIMA MENSUAL", "AÑO DE MÁXIMA", "MÍNIMA MENSUAL", "AÑO DE MÍNIMA", "AÑOS CON DATOS"]
+    for titulo in ["TEMPERATURA MÁXIMA", "TEMPERATURA MEDIA", "TEMPERATURA MÍNIMA", "PRECIPITACIÓN", "EVAPORACIÓN TOTAL"]:
+        lineas += ["", titulo, "\t".join(["MESES"] + MESES + ["ANUAL"])]
+        for renglon in renglones:
+            lineas.append(renglon + "\t" + "\t".join(_valor(rng, 0, 40, 0) for _ in range(13)))
+    return "\n".join(lineas) + "\n"
+
+
+def txt_extremos(rng):
+    lineas = [ENCABEZADO_TXT.format(titulo=""), ""]
+    for titulo in ["TEMPERATURA MÁXIMA (°C)", "TEMPERATURA MÍNIMA (°C)", "PRECIPITACIÓN (mm)"]:
+        lineas += [
+            "", titulo,
+            "MES     Año     Año     Núm     Valor    Fecha   Se ha   Valor  Fecha   Se ha  Valor  Desv",
+            "        Inicio  Final   Años    Máx.     Máx.    Rep.    Mín.   Mín.    Rep.   Medio  Estándar",
+        ]
+        for mes in MESES:
+            lineas.append(
+                f"{mes}     1961    2020    58      {_valor(rng, 20, 45, 0)}     12/03/1998  1   "
+                f"{_valor(rng, -5, 10, 0)}   01/01/1970  2   {_valor(rng, 10, 30, 0)}   {_valor(rng, 0, 4, 0)}"
+            )
+    return "\n".join(lineas) + "\n"
+
+
+def kml_estaciones(rng, total):
+    simple = lambda nombre, valor: f'<SimpleData name="{nombre}">{valor}</SimpleData>'
+    tamanos = [t for t, _ in REPARTO_TAMANOS]
+    pesos = [p for _, p in REPARTO_TAMANOS]
+    partes = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<kml xmlns="http://www.opengis.net/kml/2.2"><Document><Folder><name>estaciones</name>\n']
+    for i in range(total):
+        clave = f"{(i % len(ESTADOS)) + 1:02d}{i:05d}"
+        estado = ESTADOS[i % len(ESTADOS)]
+        tamano = rng.choices(tamanos, pesos)[0]
+        lat, lon = rng.uniform(14.5, 32.5), rng.uniform(-117, -86.8)
+        campos = {
+            "CLAVE": clave, "NOMBRE": f"ESTACIÓN {clave}", "ESTADO": estado,
+            "MUNICIPIO": f"MUNICIPIO {i % 57:02d}", "ORG_CUENCA": "BALSAS", "CUENCA": f"CUENCA {i % 37}",
+            "TIPO_EST": "CLIMATOLÓGICA", "INICIO": "1961-01-01", "MAS_RECIENTE": "2024-12-31",
+            "LATITUD": f"{lat:.4f}", "LONGITUD": f"{lon:.4f}", "ALTITUD": str(rng.randint(0, 3000)),
+            "DIARIOS": f"{URL_SMN}/diarios/{tamano}/{clave}.txt",
+            "MENSUALES": f"{URL_SMN}/mensuales/{tamano}/{clave}.txt",
+            "NORMALES_1961_1990": "",
+            "NORMALES_1971_2000": "",
+            "NORMALES_1981_2010": f"{URL_SMN}/normales/tipico/{clave}.txt" if i % 2 else "",
+            "NORMALES_1991_2020": f"{URL_SMN}/normales/tipico/{clave}.txt",
+            "EXTREMOS": f"{URL_SMN}/extremos/tipico/{clave}.txt",
+            "SITUACION": "OPERANDO" if i % 5 else "SUSPENDIDA",
+        }
+        datos = "".join(simple(k, v) for k, v in campos.items())
+        partes.append(
+            f"<Placemark><name>{clave}</name><ExtendedData><SchemaData schemaUrl=\"#estaciones\">{datos}"
+            f"</SchemaData></ExtendedData><Point><coordinates>{lon:.4f},{lat:.4f},0</coordinates></Point></Placemark>\n"
+        )
+    partes.append("</Folder></Document></kml>\n")
+    return "".join(partes)
+
+
+def generar_corpus(directorio=CORPUS_DIR, estaciones=6000):
+    rng = random.Random(SEMILLA)
+    directorio.mkdir(parents=True, exist_ok=True)
+    archivos = {}
+    for tamano, anios in ANIOS_DIARIOS.items():
+        archivos[f"diarios-{tamano}.txt"] = txt_diarios(rng, anios)
+    for tamano, anios in ANIOS_MENSUALES.items():
+        archivos[f"mensuales-{tamano}.txt"] = txt_mensuales(rng, anios)
+    archivos["normales-tipico.txt"] = txt_normales(rng)
+    archivos["extremos-tipico.txt"] = txt_extremos(rng)
+
+    # Los TXT del SMN vienen en latin-1
+    for nombre, texto in archivos.items():
+        (directorio / nombre).write_text(texto, encoding="latin-1")
+    (directorio / "doc.kml").write_text(kml_estaciones(rng, estaciones), encoding="utf-8")
+    print(f"✅ Corpus en {directorio}: {len(archivos)} TXT y KML con {estaciones} estaciones")
+
+
+def _corpus(directorio):
+    if not (directorio / "doc.kml").exists():
+        generar_corpus(directorio)
+    return directorio
+
+
+# ---------------------- PARSERS ----------------------
+# tipo del archivo del corpus -> tipo que entiende parsear_txt
+TIPO_PARSER = {
+    "diarios": "diarios",
+    "mensuales": "mensuales",
+    "normales": "normales_1991_2020",
+    "extremos": "extremos",
+}
+
+
+def _mejor_tiempo(fn, repeticiones):
+    mejor = float("inf")
+    resultado = None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = fn()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor, resultado
+
+
+def _pico_mb(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def medir_parsers(directorio, repeticiones):
+    from parsers import parsear_texto
+
+    est = {"clave": "20001", "nombre": "ESTACIÓN DE REFERENCIA", "estado": "OAXACA",
+           "municipio": "OAXACA DE JUÁREZ", "situacion": "OPERANDO",
+           "lat": "17.0833", "lon": "-96.7167", "alt": "1550"}
+    metricas = {}
+    for ruta in sorted(directorio.glob("*-*.txt")):
+        tipo = TIPO_PARSER.get(ruta.stem.split("-")[0])
+        if tipo is None:
+            continue
+        texto = ruta.read_text(encoding="latin-1")
+        mb = len(texto.encode("utf-8")) / 1e6
+        correr = lambda: parsear_texto(tipo, texto, est)
+
+        seg, csv = _mejor_tiempo(correr, repeticiones)
+        filas = csv.count("\n")
+        metricas[f"parsers.{ruta.stem}.seg"] = seg
+        metricas[f"parsers.{ruta.stem}.filas_por_s"] = filas / seg
+        metricas[f"parsers.{ruta.stem}.mb_por_s"] = mb / seg
+        metricas[f"parsers.{ruta.stem}.pico_mb"] = _pico_mb(correr)
+
+    # Catálogo: iter_kml sobre el KML grande
+    from kml import iter_kml
+
+    kml = directorio / "doc.kml"
+    correr = lambda: sum(1 for _ in iter_kml(str(kml)))
+    seg, total = _mejor_tiempo(correr, repeticiones)
+    metricas["parsers.kml.seg"] = seg
+    metricas["parsers.kml.estaciones_por_s"] = total / seg
+    metricas["parsers.kml.mb_por_s"] = kml.stat().st_size / 1e6 / seg
+    metricas["parsers.kml.pico_mb"] = _pico_mb(correr)
+    return metricas
+
+
+# ---------------------- ENDPOINTS ----------------------
+def _servidor_smn(directorio, latencia):
+    """SMN simulado: /{...}/{tipo}/{tamaño}/{clave}.txt -> corpus/{tipo}-{tamaño}.txt."""
+
+    class Manejador(SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            partes = path.split("?", 1)[0].strip("/").split("/")
+            if len(partes) < 3:
+                return str(directorio / "no-existe")
+            return str(directorio / f"{partes[-3]}-{partes[-2]}.txt")
+
+        def do_GET(self):
+            time.sleep(latencia)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url, timeout=120):
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as ex:
+        status = ex.code
+    return time.perf_counter() - t0, status
+
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    k = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[k]
+
+
+def medir_arranque(kml, repeticiones):
+    """Segundos para importar main y para tener el catálogo del KML en memoria."""
+    codigo = (
+        "import time; t0 = time.perf_counter(); import main; t1 = time.perf_counter(); "
+        "main.CATALOGO.get(); t2 = time.perf_counter(); print(t1 - t0, t2 - t1)"
+    )
+    entorno = dict(os.environ, SMN_KML_FILE=str(kml))
+    imports, catalogos = [], []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, "-c", codigo], cwd=BASE_DIR, env=entorno,
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        imports.append(float(salida[-2]))
+        catalogos.append(float(salida[-1]))
+    return {"arranque.import_s": min(imports), "arranque.catalogo_s": min(catalogos)}
+
+
+def _rutas_endpoints(claves):
+    """(nombre, [rutas]) a medir; las rutas de una lista se piden en orden y en ciclo."""
+    clave = claves[0]
+    return [
+        ("estados", ["/api/estados"]),
+        ("estaciones_estado", ["/api/estaciones?estado=OAXACA"]),
+        ("estaciones_todas", ["/api/estaciones"]),
+        ("estaciones_radio", ["/api/estaciones/radio?lat=19.4&lon=-99.1&km=150"]),
+        ("estados_geojson", ["/api/estados_geojson"]),
+        ("municipios_geojson_estado", ["/api/municipios_geojson?estado=OAXACA"]),
+        # Frío: cada petición es una estación distinta (descarga + parseo)
+        ("descargar_diarios_frio", [f"/api/descargar_csv?clave={c}&data=DIARIOS" for c in claves[1:]]),
+        ("descargar_diarios_caliente", [f"/api/descargar_csv?clave={clave}&data=DIARIOS"]),
+        ("descargar_mensuales_parquet", [f"/api/descargar_csv?clave={clave}&data=MENSUALES&format=parquet"]),
+        ("series_tmax", [f"/api/series?clave={clave}&variable=tmax"]),
+        ("agregados_mensual", [f"/api/agregados?clave={clave}&variable=tmax&periodo=mensual"]),
+    ]
+
+
+def medir_endpoints(directorio, peticiones, concurrencia, latencia_smn):
+    from kml import iter_kml
+
+    kml = directorio / "doc.kml"
+    claves = [e["clave"] for e in iter_kml(str(kml)) if "/tipico/" in (e.get("diarios") or "")]
+    claves = claves[:peticiones + 1]
+
+    smn = _servidor_smn(directorio, latencia_smn)
+    puerto = _puerto_libre()
+    base = f"http://127.0.0.1:{puerto}"
+    metricas = {}
+
+    with tempfile.TemporaryDirectory(prefix="smn-bench-") as tmp:
+        entorno = dict(
+            os.environ,
+            SMN_BASE_URL=f"http://127.0.0.1:{smn.server_address[1]}",
+            SMN_KML_FILE=str(kml),
+            SMN_CACHE_DIR=tmp,
+            # Todas las peticiones vienen de un solo cliente: se mide el código, no los límites de admisión
+            SMN_MAX_RPS="0",
+            SMN_CLIENTE_RAFAGA="1000000",
+            SMN_CLIENTE_TASA="1000000",
+            SMN_DESCARGAS_SIMULTANEAS=str(max(4, concurrencia)),
+            # Sin recorridos de fondo compitiendo por el SMN, la caché y el pool durante la medición
+            SMN_DISPONIBILIDAD_CICLO="0",
+            SMN_CLIMATOLOGIA_CICLO="0",
+        )
+        t0 = time.perf_counter()
+        api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(puerto), "--log-level", "warning"],
+            cwd=BASE_DIR, env=entorno,
+        )
+        try:
+            # Listo = primera respuesta con el catálogo cargado
+            while True:
+                if api.poll() is not None:
+                    raise RuntimeError("uvicorn terminó antes de responder")
+                try:
+                    if _get(base + "/api/estados", timeout=5)[1] == 200:
+                        break
+                except OSError:
+                    time.sleep(0.05)
+            metricas["arranque.primera_respuesta_s"] = time.perf_counter() - t0
+
+            for nombre, rutas in _rutas_endpoints(claves):
+                frio = len(rutas) > 1
+                if not frio:
+                    _, status = _get(base + rutas[0])  # calentamiento
+                    if status != 200:
+                        print(f"[WARN] {nombre}: HTTP {status}, se omite")
+                        continue
+                urls = [base + rutas[i % len(rutas)] for i in range(peticiones)]
+                with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+                    resultados = list(pool.map(_get, urls))
+                tiempos = [seg * 1000 for seg, status in resultados if status == 200]
+                if len(tiempos) < len(resultados):
+                    print(f"[WARN] {nombre}: {len(resultados) - len(tiempos)} respuestas con error")
+                if not tiempos:
+                    continue
+                for p in (50, 95, 99):
+                    metricas[f"endpoints.{nombre}.p{p}_ms"] = _percentil(tiempos, p)
+        finally:
+            api.terminate()
+            api.wait(timeout=30)
+            smn.shutdown()
+    return metricas
+
+
+# ---------------------- COMPARACIÓN ----------------------
+def mayor_es_mejor(metrica):
+    return metrica.endswith("_por_s")
+
+
+def comparar(actual, base, tolerancia):
+    """Imprime la tabla contra la base y regresa las métricas que empeoraron más de `tolerancia`."""
+    regresiones = []
+    print(f"\n{'métrica':<58}{'base':>12}{'actual':>12}{'cambio':>9}")
+    for metrica in sorted(actual):
+        valor = actual[metrica]
+        anterior = base.get(metrica)
+        if not anterior:
+            print(f"{metrica:<58}{'-':>12}{valor:>12.4g}")
+            continue
+        cambio = (valor - anterior) / anterior
+        peor = -cambio if mayor_es_mejor(metrica) else cambio
+        marca = "  ⚠" if peor > tolerancia else ""
+        print(f"{metrica:<58}{anterior:>12.4g}{valor:>12.4g}{cambio:>+9.1%}{marca}")
+        if peor > tolerancia:
+            regresiones.append(metrica)
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("que", choices=["corpus", "parsers", "endpoints", "todo"])
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--estaciones", type=int, default=6000, help="estaciones del KML sintético")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--peticiones", type=int, default=50, help="peticiones por endpoint")
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--latencia-smn", type=float, default=0.05, help="segundos por archivo del SMN simulado")
+    parser.add_argument("--tolerancia", type=float, default=0.15, help="empeoramiento aceptado (0.15 = 15%%)")
+    parser.add_argument("--base", type=Path, default=BASE_JSON)
+    parser.add_argument("--guardar-base", action="store_true", help="guardar esta corrida como la nueva base")
+    args = parser.parse_args()
+
+    if args.que == "corpus":
+        generar_corpus(args.corpus, args.estaciones)
+        return 0
+
+    directorio = _corpus(args.corpus)
+    metricas = {}
+    if args.que in ("parsers", "todo"):
+        metricas.update(medir_parsers(directorio, args.repeticiones))
+    if args.que in ("endpoints", "todo"):
+        metricas.update(medir_arranque(directorio / "doc.kml", min(args.repeticiones, 3)))
+        metricas.update(medir_endpoints(directorio, args.peticiones, args.concurrencia, args.latencia_smn))
+
+    BENCH_DIR.mkdir(exist_ok=True)
+    ULTIMO_JSON.write_text(json.dumps(metricas, indent=2, sort_keys=True), encoding="utf-8")
+
+    base = json.loads(args.base.read_text(encoding="utf-8")) if args.base.exists() else {}
+    regresiones = comparar(metricas, base, args.tolerancia)
+
+    if args.guardar_base:
+        # Se combinan para que guardar solo "parsers" no borre la base de los endpoints
+        args.base.write_text(json.dumps(dict(base, **metricas), indent=2, sort_keys=True), encoding="utf-8")
+        print(f"\n✅ Base guardada en {args.base}")
+        return 0
+    if regresiones:
+        print(f"\n❌ {len(regresiones)} métricas empeoraron más de {args.tolerancia:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
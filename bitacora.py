@@ -0,0 +1,72 @@
+"""
+Bitácora de la aplicación: logging con niveles bajo el logger "smn".
+
+Cada módulo usa su propio logger hijo (logging.getLogger("smn.cache"), ...) y
+pasa los datos variables como campos: log.warning("...", extra={"clave": c}).
+Los campos salen como llave=valor, o como una línea JSON con
+SMN_LOG_FORMATO=json. SMN_LOG_NIVEL acepta DEBUG, INFO, WARNING, ERROR u OFF;
+con OFF no se formatea nada.
+"""
+import json
+import logging
+import os
+import sys
+
+SMN_LOG_NIVEL = os.getenv("SMN_LOG_NIVEL", "INFO").upper()
+SMN_LOG_FORMATO = os.getenv("SMN_LOG_FORMATO", "texto").lower()
+
+# Atributos propios de LogRecord; lo demás vino en extra=
+_ATRIBUTOS_REGISTRO = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def campos(registro):
+    return {k: v for k, v in vars(registro).items() if k not in _ATRIBUTOS_REGISTRO}
+
+
+def _valor_texto(valor):
+    texto = str(valor)
+    if not texto or any(c in texto for c in ' ="'):
+        return json.dumps(texto, ensure_ascii=False)
+    return texto
+
+
+class FormatoTexto(logging.Formatter):
+    def format(self, registro):
+        linea = f"{self.formatTime(registro)} [{registro.levelname}] {registro.name}: {registro.getMessage()}"
+        extra = campos(registro)
+        if extra:
+            linea += " " + " ".join(f"{k}={_valor_texto(v)}" for k, v in extra.items())
+        if registro.exc_info:
+            linea += "\n" + self.formatException(registro.exc_info)
+        return linea
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, registro):
+        datos = {
+            "ts": self.formatTime(registro),
+            "nivel": registro.levelname,
+            "logger": registro.name,
+            "mensaje": registro.getMessage(),
+            **campos(registro),
+        }
+        if registro.exc_info:
+            datos["error"] = self.formatException(registro.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+def configurar(nivel=SMN_LOG_NIVEL, formato=SMN_LOG_FORMATO):
+    """Configura el logger "smn" (idempotente); se llama una vez al importar main."""
+    raiz = logging.getLogger("smn")
+    raiz.handlers.clear()
+    raiz.propagate = False
+    if nivel == "OFF":
+        raiz.setLevel(logging.CRITICAL + 1)
+        raiz.addHandler(logging.NullHandler())
+        return raiz
+
+    manejador = logging.StreamHandler(sys.stderr)
+    manejador.setFormatter(FormatoJSON() if formato == "json" else FormatoTexto())
+    raiz.addHandler(manejador)
+    raiz.setLevel(nivel)
+    return raiz
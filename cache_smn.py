@@ -0,0 +1,269 @@
+"""
+Caché en disco de los TXT del SMN y de sus CSV ya parseados.
+
+Los contenidos se guardan por hash (sha256) en cache/blobs/ y un índice SQLite
+relaciona cada (clave, tipo) con su TXT crudo, sus validadores HTTP (ETag,
+Last-Modified) y la fecha de EMISIÓN. Cada tipo de dato tiene su propio TTL:
+las normales no cambian, los diarios se revalidan una vez al día. Al vencer el
+TTL se hace un GET condicional; un 304 solo renueva la marca de tiempo.
+
+Los CSV (y sus versiones Parquet/Arrow) se indexan por hash del TXT + tipo +
+variante, así que si el archivo remoto no cambió tampoco se vuelve a parsear.
+El tamaño total se acota con desalojo LRU. Lo que escriben los recorridos en
+segundo plano (en_fondo) entra como lo menos reciente y sus lecturas no lo
+refrescan: se desaloja antes que lo que piden los usuarios, salvo que un
+usuario lo lea después.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from cliente_smn import Respuesta, en_fondo
+from metricas import REGISTRO
+
+# -------- CONFIGURACIÓN --------
+SMN_CACHE_DIR = os.getenv("SMN_CACHE_DIR", str(Path(__file__).resolve().parent / "cache"))
+SMN_CACHE_MAX_MB = int(os.getenv("SMN_CACHE_MAX_MB", "1024"))
+
+DIA = 24 * 3600
+TTL_POR_TIPO = {
+    "diarios": DIA,
+    "mensuales": 7 * DIA,
+    "extremos": 30 * DIA,
+    "normales_1961_1990": None,  # None = no caduca
+    "normales_1971_2000": None,
+    "normales_1981_2010": None,
+    "normales_1991_2020": 30 * DIA,
+}
+TTL_DEFAULT = DIA
+
+# Cambiar al modificar la salida de algún parser para invalidar los CSV guardados
+PARSER_VERSION = "1"
+
+log = logging.getLogger("smn.cache")
+
+CONSULTAS = REGISTRO.contador(
+    "smn_cache_consultas_total", "Consultas a la caché en disco por capa (txt, csv, binario) y resultado",
+    ("capa", "resultado"),
+)
+
+EMISION_RE = re.compile(r"EMISI[ÓO]N\s*:?\s*(\d{2}/\d{2}/\d{4})", re.IGNORECASE)
+
+
+def extraer_emision(texto):
+    m = EMISION_RE.search(texto[:4000])
+    return m.group(1) if m else ""
+
+
+def _header(headers, nombre):
+    nombre = nombre.lower()
+    for k, v in headers.items():
+        if k.lower() == nombre:
+            return v
+    return ""
+
+
+class CacheSMN:
+    def __init__(self, directorio=SMN_CACHE_DIR, max_bytes=SMN_CACHE_MAX_MB * 1024 * 1024, ttl=None):
+        self.dir = Path(directorio)
+        self.blobs = self.dir / "blobs"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = dict(TTL_POR_TIPO, **(ttl or {}))
+        self._local = threading.local()
+        self._lock_desalojo = threading.Lock()
+
+        with self._db() as db:
+            db.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS entradas (
+                    clave TEXT, tipo TEXT, url TEXT, raw_sha TEXT,
+                    etag TEXT, last_modified TEXT, emision TEXT, validado REAL,
+                    PRIMARY KEY (clave, tipo)
+                );
+                CREATE TABLE IF NOT EXISTS parseados (
+                    llave TEXT PRIMARY KEY, csv_sha TEXT
+                );
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha TEXT PRIMARY KEY, size INTEGER, accedido REAL
+                );
+                CREATE INDEX IF NOT EXISTS blobs_accedido ON blobs (accedido);
+            """)
+
+    # ---------------------- almacenamiento ----------------------
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.dir / "indice.sqlite3", timeout=30)
+            self._local.db = db
+        return db
+
+    def _ruta(self, sha):
+        return self.blobs / sha[:2] / sha
+
+    def _leer_blob(self, sha, binario=False):
+        try:
+            data = self._ruta(sha).read_bytes()
+        except FileNotFoundError:
+            return None
+        if not en_fondo():
+            with self._db() as db:
+                db.execute("UPDATE blobs SET accedido = ? WHERE sha = ?", (time.time(), sha))
+        return data if binario else data.decode("utf-8")
+
+    def _escribir_blob(self, contenido):
+        data = contenido if isinstance(contenido, bytes) else contenido.encode("utf-8")
+        sha = hashlib.sha256(data).hexdigest()
+        ruta = self._ruta(sha)
+        if not ruta.exists():
+            ruta.parent.mkdir(exist_ok=True)
+            tmp = ruta.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, ruta)
+        with self._db() as db:
+            if en_fondo():
+                # Baja prioridad: primero en desalojarse, sin degradar un blob que ya usan los usuarios
+                db.execute("INSERT OR IGNORE INTO blobs (sha, size, accedido) VALUES (?, ?, 0)", (sha, len(data)))
+            else:
+                db.execute(
+                    "INSERT OR REPLACE INTO blobs (sha, size, accedido) VALUES (?, ?, ?)",
+                    (sha, len(data), time.time()),
+                )
+        self._desalojar()
+        return sha
+
+    def _desalojar(self):
+        """Borra los blobs menos usados recientemente hasta quedar en 90% del límite."""
+        if not self._lock_desalojo.acquire(blocking=False):
+            return
+        try:
+            db = self._db()
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            objetivo = int(self.max_bytes * 0.9)
+            for sha, size in db.execute("SELECT sha, size FROM blobs ORDER BY accedido").fetchall():
+                if total <= objetivo:
+                    break
+                try:
+                    self._ruta(sha).unlink()
+                except FileNotFoundError:
+                    pass
+                with db:
+                    db.execute("DELETE FROM blobs WHERE sha = ?", (sha,))
+                total -= size
+        finally:
+            self._lock_desalojo.release()
+
+    # ---------------------- TXT crudo ----------------------
+    def sha_vigente(self, clave, tipo):
+        """sha256 del TXT guardado de (clave, tipo) si su TTL no ha vencido; si no, None."""
+        fila = self._db().execute(
+            "SELECT raw_sha, validado FROM entradas WHERE clave = ? AND tipo = ?", (clave, tipo)
+        ).fetchone()
+        if not fila:
+            return None
+        ttl = self.ttl.get(tipo, TTL_DEFAULT)
+        if ttl is not None and time.time() - fila[1] >= ttl:
+            return None
+        return fila[0]
+
+    def obtener_txt(self, clave, tipo, url, cliente):
+        """
+        Regresa una Respuesta con el TXT de (clave, tipo), desde disco si está
+        vigente o tras revalidar contra el SMN. headers["X-Cache"] indica el origen.
+        """
+        db = self._db()
+        fila = db.execute(
+            "SELECT raw_sha, etag, last_modified, validado FROM entradas WHERE clave = ? AND tipo = ?",
+            (clave, tipo),
+        ).fetchone()
+
+        cacheado = None
+        if fila:
+            raw_sha, etag, last_modified, validado = fila
+            cacheado = self._leer_blob(raw_sha)
+
+        if cacheado is not None:
+            ttl = self.ttl.get(tipo, TTL_DEFAULT)
+            if ttl is None or time.time() - validado < ttl:
+                CONSULTAS.inc(capa="txt", resultado="hit")
+                return Respuesta(url=url, status=200, text=cacheado, headers={"X-Cache": "HIT"})
+
+            condicionales = {}
+            if etag:
+                condicionales["If-None-Match"] = etag
+            if last_modified:
+                condicionales["If-Modified-Since"] = last_modified
+            resp = cliente.obtener(url, headers=condicionales)
+
+            if resp.status == 304:
+                with db:
+                    db.execute(
+                        "UPDATE entradas SET validado = ? WHERE clave = ? AND tipo = ?",
+                        (time.time(), clave, tipo),
+                    )
+                CONSULTAS.inc(capa="txt", resultado="revalidado")
+                return Respuesta(url=url, status=200, text=cacheado, headers={"X-Cache": "REVALIDATED"})
+            if not resp.ok:
+                # El SMN falló: mejor servir la copia vencida que nada
+                log.warning("Revalidación fallida, se usa copia en caché", extra={"clave": clave, "tipo": tipo})
+                CONSULTAS.inc(capa="txt", resultado="vencido")
+                return Respuesta(url=url, status=200, text=cacheado, headers={"X-Cache": "STALE"})
+        else:
+            resp = cliente.obtener(url)
+
+        CONSULTAS.inc(capa="txt", resultado="miss")
+        if resp.ok and resp.text.strip():
+            raw_sha = self._escribir_blob(resp.text)
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO entradas VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        clave, tipo, url, raw_sha,
+                        _header(resp.headers, "ETag"),
+                        _header(resp.headers, "Last-Modified"),
+                        extraer_emision(resp.text),
+                        time.time(),
+                    ),
+                )
+            resp.headers["X-Cache"] = "MISS"
+        return resp
+
+    # ---------------------- CSV parseado ----------------------
+    def obtener_csv(self, tipo, texto, parsear, variante=""):
+        """
+        CSV correspondiente a `texto`; solo llama parsear() si ese mismo contenido
+        no se había parseado antes. `variante` distingue salidas que dependen de
+        algo más que el TXT (p. ej. los metadatos del KML en diarios).
+        """
+        return self._obtener_derivado(tipo, texto, parsear, variante, binario=False)
+
+    def obtener_binario(self, tipo, texto, generar, variante):
+        """Como obtener_csv, pero para salidas en bytes (p. ej. Parquet)."""
+        return self._obtener_derivado(tipo, texto, generar, variante, binario=True)
+
+    def _obtener_derivado(self, tipo, texto, generar, variante, binario):
+        h = hashlib.sha256(f"{PARSER_VERSION}|{tipo}|{variante}|".encode("utf-8"))
+        h.update(texto.encode("utf-8"))
+        llave = h.hexdigest()
+
+        capa = "binario" if binario else "csv"
+        fila = self._db().execute("SELECT csv_sha FROM parseados WHERE llave = ?", (llave,)).fetchone()
+        if fila:
+            contenido = self._leer_blob(fila[0], binario)
+            if contenido is not None:
+                CONSULTAS.inc(capa=capa, resultado="hit")
+                return contenido
+
+        CONSULTAS.inc(capa=capa, resultado="miss")
+        contenido = generar()
+        sha = self._escribir_blob(contenido)
+        with self._db() as db:
+            db.execute("INSERT OR REPLACE INTO parseados VALUES (?, ?)", (llave, sha))
+        return contenido
@@ -0,0 +1,50 @@
+"""
+Candados entre procesos sobre un archivo (flock).
+
+Con varios workers de uvicorn/gunicorn cada proceso tiene sus propios hilos;
+lo que debe correr en uno solo (un trabajo de exportación, los recorridos de
+fondo) toma un candado exclusivo. El sistema operativo lo suelta si el
+proceso muere, así que no quedan candados huérfanos.
+
+Sin fcntl (Windows) el candado siempre se concede: se asume un solo proceso.
+"""
+import os
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class Candado:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._fd = None
+
+    def tomar(self):
+        """True si este proceso tiene el candado (sin esperar); False si lo tiene otro."""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.ruta, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+        self._fd = fd
+        return True
+
+    def soltar(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def ocupado(self):
+        """True si otro proceso (u otro Candado de este) lo tiene ahora mismo."""
+        if self._fd is not None:
+            return False
+        if not self.tomar():
+            return True
+        self.soltar()
+        return False
@@ -0,0 +1,207 @@
+"""
+Catálogo de estaciones en memoria con índices por campo.
+
+Cada estación es un objeto con __slots__ (sin dict por instancia) y los textos
+repetidos (estado, municipio, cuenca, ...) se internan, así que el catálogo
+ocupa bastante menos que la lista de dicts original. Los campos de filtro se
+indexan ya normalizados (sin mayúsculas ni acentos), de modo que una consulta
+cuesta O(resultado) y no O(total de estaciones).
+
+Desde el snapshot (CatalogoEstaciones.desde_tabla) el catálogo se queda en las
+columnas Arrow en memory-map: los índices salen de la codificación por
+diccionario de cada columna y cada Estacion se arma al primer acceso a su fila.
+"""
+import json
+import sys
+import unicodedata
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se serializa con json
+    orjson = None
+
+# Orden de campos = orden de las llaves en la respuesta JSON
+CAMPOS = (
+    "clave", "nombre", "estado", "municipio", "organismo", "cuenca", "tipo_est",
+    "inicio", "mas_reciente", "lat", "lon", "alt",
+    "diarios", "mensuales",
+    "normales_1961_1990", "normales_1971_2000", "normales_1981_2010", "normales_1991_2020",
+    "extremos", "situacion",
+)
+CAMPOS_INDEXADOS = ("estado", "municipio", "clave", "situacion", "tipo_est", "cuenca")
+CAMPOS_INTERNADOS = ("estado", "municipio", "organismo", "cuenca", "tipo_est", "situacion")
+
+
+def normalizar(texto):
+    """Minúsculas, sin acentos y con espacios colapsados: 'Nuevo  León ' -> 'nuevo leon'."""
+    if not texto:
+        return ""
+    if texto.isascii():
+        return " ".join(texto.casefold().split())
+    sin_acentos = "".join(
+        c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c)
+    )
+    return " ".join(sin_acentos.casefold().split())
+
+
+class Estacion:
+    __slots__ = CAMPOS
+
+    def __init__(self, datos):
+        for campo in CAMPOS:
+            valor = datos.get(campo)
+            if valor is not None and campo in CAMPOS_INTERNADOS:
+                valor = sys.intern(valor)
+            setattr(self, campo, valor)
+
+    # Compatibilidad con el código que trataba las estaciones como dicts
+    def get(self, campo, default=None):
+        valor = getattr(self, campo, None)
+        return default if valor is None else valor
+
+    def __getitem__(self, campo):
+        return getattr(self, campo)
+
+    def to_dict(self, campos=CAMPOS):
+        return {campo: getattr(self, campo) for campo in campos}
+
+
+class FilasPerezosas:
+    """Secuencia de Estacion sobre una tabla Arrow; cada una se arma al primer acceso a su fila."""
+
+    def __init__(self, tabla):
+        self._columnas = {c: tabla.column(c).combine_chunks() for c in CAMPOS if c in tabla.column_names}
+        self._filas = [None] * tabla.num_rows
+
+    def __len__(self):
+        return len(self._filas)
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return self.tomar(range(*pos.indices(len(self))))
+        return self.tomar([range(len(self._filas))[pos]])[0]
+
+    def __iter__(self):
+        return iter(self.tomar(range(len(self))))
+
+    def tomar(self, posiciones):
+        """Estaciones en esas posiciones; las que faltan se arman juntas (take + to_pylist por columna)."""
+        faltan = [p for p in posiciones if self._filas[p] is None]
+        if faltan:
+            valores = {c: columna.take(faltan).to_numpy(zero_copy_only=False).tolist() for c, columna in self._columnas.items()}
+            for i, pos in enumerate(faltan):
+                self._filas[pos] = Estacion({c: v[i] for c, v in valores.items()})
+        return [self._filas[p] for p in posiciones]
+
+
+def _indice_columna(columna):
+    """{valor normalizado: posiciones} de una columna Arrow; cada valor distinto se normaliza una vez."""
+    codificada = columna.combine_chunks().dictionary_encode()
+    codigos = codificada.indices.fill_null(-1).to_numpy()
+    orden = np.argsort(codigos, kind="stable")
+    cortes = np.searchsorted(codigos[orden], np.arange(len(codificada.dictionary) + 1)).tolist()
+    orden = orden.tolist()
+    indice = {}
+    for i, valor in enumerate(codificada.dictionary.to_numpy(zero_copy_only=False).tolist()):
+        llave = normalizar(valor)
+        if not llave:
+            continue
+        posiciones = tuple(orden[cortes[i]:cortes[i + 1]])
+        previas = indice.get(llave)
+        # Varios valores pueden normalizarse igual ("Oaxaca", "OAXACA"): sus posiciones se juntan en orden
+        indice[llave] = posiciones if previas is None else tuple(sorted(previas + posiciones))
+    return indice
+
+
+class CatalogoEstaciones:
+    def __init__(self, registros, huella=""):
+        """registros: iterable de dicts (puede ser un generador); huella: sha256 del KML de origen."""
+        self.estaciones = tuple(Estacion(r) for r in registros)
+        self.huella = huella
+
+        self._indices = {campo: {} for campo in CAMPOS_INDEXADOS}
+        self._conjuntos = {}  # (campo, llave) -> frozenset, se arma al primer uso
+        for pos, est in enumerate(self.estaciones):
+            for campo in CAMPOS_INDEXADOS:
+                llave = normalizar(getattr(est, campo))
+                if llave:
+                    self._indices[campo].setdefault(llave, []).append(pos)
+        for indice in self._indices.values():
+            for llave, posiciones in indice.items():
+                indice[llave] = tuple(posiciones)
+
+        self.estados = sorted({e.estado.strip().upper() for e in self.estaciones if e.estado})
+
+    @classmethod
+    def desde_tabla(cls, tabla, huella=""):
+        """Catálogo sobre una tabla Arrow (el snapshot) sin armar las estaciones por adelantado."""
+        catalogo = cls((), huella=huella)
+        catalogo.estaciones = FilasPerezosas(tabla)
+        for campo in CAMPOS_INDEXADOS:
+            if campo in tabla.column_names:
+                catalogo._indices[campo] = _indice_columna(tabla.column(campo))
+        if "estado" in tabla.column_names:
+            distintos = tabla.column("estado").unique().to_pylist()
+            catalogo.estados = sorted({e.strip().upper() for e in distintos if e})
+        return catalogo
+
+    def __len__(self):
+        return len(self.estaciones)
+
+    def __iter__(self):
+        return iter(self.estaciones)
+
+    def _conjunto(self, campo, llave):
+        conjunto = self._conjuntos.get((campo, llave))
+        if conjunto is None:
+            conjunto = frozenset(self._indices[campo].get(llave, ()))
+            self._conjuntos[(campo, llave)] = conjunto
+        return conjunto
+
+    def filtrar(self, **filtros):
+        """
+        Estaciones que cumplen todos los filtros (campo=valor, comparados sin
+        acentos ni mayúsculas). Los valores vacíos o None se ignoran.
+        """
+        activos = []
+        for campo, valor in filtros.items():
+            if campo not in self._indices:
+                raise ValueError(f"Campo no indexado: {campo}")
+            if valor:
+                activos.append((campo, normalizar(valor)))
+
+        if not activos:
+            return list(self.estaciones)
+
+        # Se parte del índice más chico y se intersecta con los demás
+        activos.sort(key=lambda f: len(self._indices[f[0]].get(f[1], ())))
+        posiciones = self._indices[activos[0][0]].get(activos[0][1], ())
+        for filtro in activos[1:]:
+            if not posiciones:
+                break
+            otro = self._conjunto(*filtro)
+            posiciones = [p for p in posiciones if p in otro]
+
+        if isinstance(self.estaciones, FilasPerezosas):
+            return self.estaciones.tomar(posiciones)
+        return [self.estaciones[p] for p in posiciones]
+
+
+def json_bytes(contenido):
+    """JSON compacto en UTF-8 (orjson si está instalado)."""
+    if orjson is not None:
+        return orjson.dumps(contenido)
+    return json.dumps(contenido, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def diferencias_catalogo(viejo, nuevo):
+    """Claves agregadas, eliminadas y modificadas entre dos catálogos."""
+    antes = {e.clave: e.to_dict() for e in viejo}
+    despues = {e.clave: e.to_dict() for e in nuevo}
+    return {
+        "agregadas": sorted(despues.keys() - antes.keys(), key=str),
+        "eliminadas": sorted(antes.keys() - despues.keys(), key=str),
+        "modificadas": sorted((c for c in antes.keys() & despues.keys() if antes[c] != despues[c]), key=str),
+    }
@@ -0,0 +1,176 @@
+"""
+Cliente HTTP compartido para descargar los TXT del SMN.
+
+Mantiene conexiones keep-alive en un pool, limita la concurrencia total y por
+host y las peticiones por segundo (SMN_MAX_RPS, 0 = sin límite), reintenta con
+backoff exponencial y aplica timeouts por petición. Todas
+las rutas de descarga (diarios, mensuales, normales y extremos) pasan por aquí.
+
+Los recorridos en segundo plano (disponibilidad, tabla climatológica) corren
+con en_segundo_plano: además del límite general tienen uno propio más bajo
+(SMN_MAX_RPS_FONDO), así que nunca toman más que eso del cupo de las descargas
+de los usuarios. La caché en disco (cache_smn.py) también los distingue.
+
+Para pruebas contra un servidor local basta con definir SMN_BASE_URL
+(p. ej. http://127.0.0.1:8001): el esquema y host de cada URL del KML se
+reemplazan por esa base conservando la ruta.
+"""
+import contextvars
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from admision import LimiteTasa
+
+# -------- CONFIGURACIÓN --------
+SMN_MAX_WORKERS = int(os.getenv("SMN_MAX_WORKERS", "16"))
+SMN_MAX_POR_HOST = int(os.getenv("SMN_MAX_POR_HOST", "8"))
+SMN_TIMEOUT_CONEXION = float(os.getenv("SMN_TIMEOUT_CONEXION", "5"))
+SMN_TIMEOUT_LECTURA = float(os.getenv("SMN_TIMEOUT_LECTURA", "30"))
+SMN_REINTENTOS = int(os.getenv("SMN_REINTENTOS", "3"))
+SMN_BACKOFF = float(os.getenv("SMN_BACKOFF", "0.5"))
+SMN_BASE_URL = os.getenv("SMN_BASE_URL", "")
+SMN_MAX_RPS = float(os.getenv("SMN_MAX_RPS", "20"))
+SMN_MAX_RPS_FONDO = float(os.getenv("SMN_MAX_RPS_FONDO", "5"))  # parte de SMN_MAX_RPS para los recorridos
+
+STATUS_AUSENTE = (404, 410)  # lo único que dice que el SMN no tiene el archivo
+
+_FONDO = contextvars.ContextVar("smn_fondo", default=False)
+
+
+def en_fondo():
+    """True dentro de una función envuelta con en_segundo_plano."""
+    return _FONDO.get()
+
+
+def en_segundo_plano(fn):
+    """fn con sus peticiones al SMN contadas también en el límite de fondo (SMN_MAX_RPS_FONDO)."""
+    def envuelta(*args, **kwargs):
+        token = _FONDO.set(True)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _FONDO.reset(token)
+    return envuelta
+
+
+@dataclass
+class Respuesta:
+    url: str
+    status: int = 0
+    text: str = ""
+    headers: dict = field(default_factory=dict)
+    error: str = ""
+
+    @property
+    def ok(self):
+        return not self.error and self.status == 200
+
+
+class ClienteSMN:
+    def __init__(
+        self,
+        max_workers=SMN_MAX_WORKERS,
+        max_por_host=SMN_MAX_POR_HOST,
+        timeout=(SMN_TIMEOUT_CONEXION, SMN_TIMEOUT_LECTURA),
+        reintentos=SMN_REINTENTOS,
+        backoff=SMN_BACKOFF,
+        base_url=SMN_BASE_URL,
+        max_rps=SMN_MAX_RPS,
+        max_rps_fondo=SMN_MAX_RPS_FONDO,
+    ):
+        self.max_workers = max_workers
+        self.max_por_host = max_por_host
+        self.timeout = timeout
+        self.base_url = base_url.rstrip("/")
+
+        retry = Retry(
+            total=reintentos,
+            connect=reintentos,
+            read=reintentos,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=max(4, max_workers // max(1, max_por_host)),
+            pool_maxsize=max_workers,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="smn-fetch")
+        self._semaforos = defaultdict(lambda: threading.BoundedSemaphore(self.max_por_host))
+        self._lock = threading.Lock()
+        self._tasa = LimiteTasa(max_rps) if max_rps > 0 else None
+        self._tasa_fondo = LimiteTasa(max_rps_fondo) if max_rps_fondo > 0 else None
+
+    def _reescribir(self, url):
+        if not self.base_url:
+            return url
+        base = urlsplit(self.base_url)
+        partes = urlsplit(url)
+        return urlunsplit((base.scheme, base.netloc, base.path + partes.path, partes.query, ""))
+
+    def _semaforo(self, host):
+        with self._lock:
+            return self._semaforos[host]
+
+    def obtener(self, url, headers=None):
+        """GET con límite por host; nunca lanza excepción, el error queda en Respuesta.error."""
+        url = self._reescribir(url.strip())
+        host = urlsplit(url).netloc
+        if self._tasa_fondo is not None and _FONDO.get():
+            self._tasa_fondo.esperar()
+        if self._tasa is not None:
+            self._tasa.esperar()
+        with self._semaforo(host):
+            try:
+                resp = self.session.get(url, headers=headers, timeout=self.timeout)
+            except Exception as ex:
+                return Respuesta(url=url, error=str(ex))
+        return Respuesta(url=url, status=resp.status_code, text=resp.text, headers=dict(resp.headers))
+
+    def mapear(self, fn, items):
+        """
+        Ejecuta fn(item) en el pool y entrega (item, resultado, error) en orden de
+        terminación. Solo hay hasta 2*max_workers tareas pendientes a la vez, así que
+        los resultados no se acumulan si el consumidor es más lento que la red.
+        """
+        items = iter(items)
+        ventana = 2 * self.max_workers
+        pendientes = {}
+
+        def llenar():
+            while len(pendientes) < ventana:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                pendientes[self._executor.submit(fn, item)] = item
+
+        llenar()
+        try:
+            while pendientes:
+                listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                for fut in listos:
+                    item = pendientes.pop(fut)
+                    try:
+                        yield item, fut.result(), None
+                    except Exception as ex:
+                        yield item, None, ex
+                llenar()
+        finally:
+            for fut in pendientes:
+                fut.cancel()
@@ -0,0 +1,448 @@
+"""
+Tabla climatológica de todas las estaciones: normales (los cuatro periodos) y
+valores extremos en una sola tabla tipada estación × mes.
+
+Cada fila es (estación, fuente, variable, estadística) con 13 valores float32:
+ENE..DIC y ANUAL. fuente es "normales_1991_2020", ..., o "extremos"; la
+variable y la estadística son el título de la tabla y el renglón del SMN
+normalizados ("temperatura_maxima", "normal", "maxima_mensual", ...). En
+extremos cada mes da las estadísticas maximo, minimo, medio, desviacion y
+anios, más fecha_maximo/fecha_minimo como días desde 1970-01-01; su ANUAL se
+calcula (el máximo de los máximos, etc.).
+
+Las filas se agrupan por (fuente, variable, estadística), así que una consulta
+("precipitación anual 1991-2020 en Oaxaca", "estaciones que pasaron de 45 °C")
+toma su grupo y filtra, ordena o compara con operaciones de numpy sobre todas
+las estaciones a la vez.
+
+La tabla se llena en segundo plano recorriendo el catálogo (solo se vuelve a
+leer un archivo si cambió su TXT), se publica con un único reemplazo de
+referencia y se guarda en cache/climatologia.arrow para el siguiente arranque.
+SMN_CLIMATOLOGIA_HILOS=0 o SMN_CLIMATOLOGIA_CICLO=0 apagan el recorrido (queda
+la tabla guardada). Con varios workers solo recorre el proceso que tiene
+cache/climatologia.lock; los demás releen el .arrow cuando cambia.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from cache_smn import SMN_CACHE_DIR, PARSER_VERSION
+from candado import Candado
+from catalogo import normalizar
+from columnar import NULOS, bloques_csv
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # sin pyarrow la tabla solo vive en memoria
+    pa = None
+
+SMN_CLIMATOLOGIA_HILOS = int(os.getenv("SMN_CLIMATOLOGIA_HILOS", "2"))
+SMN_CLIMATOLOGIA_CICLO = float(os.getenv("SMN_CLIMATOLOGIA_CICLO", str(6 * 3600)))
+SMN_CLIMATOLOGIA_PUBLICAR_CADA = int(os.getenv("SMN_CLIMATOLOGIA_PUBLICAR_CADA", "500"))
+
+RELEER_CADA = 60  # segundos entre revisiones del .arrow en los procesos que no recorren
+
+FUENTES = ("normales_1961_1990", "normales_1971_2000", "normales_1981_2010", "normales_1991_2020", "extremos")
+COLUMNAS = ("ENE", "FEB", "MAR", "ABR", "MAY", "JUN", "JUL", "AGO", "SEP", "OCT", "NOV", "DIC", "ANUAL")
+ANUAL = 12
+
+# Nombres cortos (los de las series diarias) -> variables de la tabla, en orden de preferencia
+ALIAS_VARIABLES = {
+    "tmax": ("temperatura_maxima",),
+    "tmin": ("temperatura_minima",),
+    "tmed": ("temperatura_media",),
+    "precip": ("precipitacion",),
+    "evap": ("evaporacion_total", "evaporacion"),
+}
+
+# Columnas del CSV de extremos -> estadística, y cómo se obtiene su valor ANUAL
+COLUMNAS_EXTREMOS = (
+    ("valor max.", "maximo", np.nanmax),
+    ("valor min.", "minimo", np.nanmin),
+    ("valor medio", "medio", np.nanmean),
+    ("desv estandar", "desviacion", None),
+    ("num anos", "anios", np.nanmax),
+)
+FECHAS_EXTREMOS = (("fecha max.", "fecha_maximo", "maximo"), ("fecha min.", "fecha_minimo", "minimo"))
+
+log = logging.getLogger("smn.climatologia")
+
+
+# ---------------------- CSV -> FILAS ----------------------
+def nombre_columna(texto):
+    """'TEMPERATURA MÁXIMA (°C)' -> 'temperatura_maxima'."""
+    return re.sub(r"\W+", "_", normalizar(re.sub(r"\(.*?\)", "", texto or ""))).strip("_")
+
+
+def _numero(celda):
+    celda = celda.strip()
+    if celda in NULOS:
+        return np.nan
+    try:
+        return float(celda.replace(",", ""))
+    except ValueError:
+        return np.nan
+
+
+def _dias(celda):
+    """'12/03/1998' -> días desde 1970-01-01 (NaN si no es fecha)."""
+    m = re.fullmatch(r"(\d{2})/(\d{2})/(\d{4})", celda.strip())
+    if not m:
+        return np.nan
+    try:
+        return float(np.datetime64(f"{m.group(3)}-{m.group(2)}-{m.group(1)}", "D").astype(np.int64))
+    except ValueError:
+        return np.nan
+
+
+def filas_climatologia(fuente, csv):
+    """[(variable, estadística, 13 valores)] de un CSV de parse_normales_txt o parse_extremos_txt_fixed."""
+    _, bloques = bloques_csv(csv)
+    filas = []
+    for titulo, encabezado, renglones in bloques:
+        variable = nombre_columna(titulo)
+        if not variable:
+            continue
+        columnas = [normalizar(c) for c in encabezado]
+
+        if fuente != "extremos":
+            # Normales: un renglón por estadística, una columna por mes
+            posiciones = [columnas.index(c.lower()) if c.lower() in columnas else None for c in COLUMNAS]
+            for renglon in renglones:
+                estadistica = nombre_columna(renglon[0])
+                if not estadistica:
+                    continue
+                valores = [_numero(renglon[p]) if p is not None and p < len(renglon) else np.nan for p in posiciones]
+                filas.append((variable, estadistica, valores))
+            continue
+
+        # Extremos: un renglón por mes, una columna por estadística
+        por_mes = {normalizar(r[0]).upper(): r for r in renglones if r}
+        for columna, estadistica, anual in COLUMNAS_EXTREMOS:
+            if columna not in columnas:
+                continue
+            p = columnas.index(columna)
+            valores = [_numero(por_mes[m][p]) if m in por_mes and p < len(por_mes[m]) else np.nan for m in COLUMNAS[:ANUAL]]
+            meses = np.array(valores, dtype=np.float64)
+            valores.append(float(anual(meses)) if anual is not None and not np.isnan(meses).all() else np.nan)
+            filas.append((variable, estadistica, valores))
+
+        # Fechas de los extremos; la ANUAL es la del mes con el extremo del año
+        extremos = {estadistica: valores for v, estadistica, valores in filas if v == variable}
+        for columna, estadistica, de in FECHAS_EXTREMOS:
+            if columna not in columnas or de not in extremos:
+                continue
+            p = columnas.index(columna)
+            valores = [_dias(por_mes[m][p]) if m in por_mes and p < len(por_mes[m]) else np.nan for m in COLUMNAS[:ANUAL]]
+            meses = np.array(extremos[de][:ANUAL], dtype=np.float64)
+            if np.isnan(meses).all():
+                valores.append(np.nan)
+            else:
+                valores.append(valores[int(np.nanargmax(meses) if de == "maximo" else np.nanargmin(meses))])
+            filas.append((variable, estadistica, valores))
+    return filas
+
+
+# ---------------------- TABLA ----------------------
+class TablaClimatologica:
+    """
+    Arreglos paralelos por fila: estación (índice en claves), fuente (índice en
+    FUENTES), variable y estadística (índices en sus vocabularios) y los 13
+    valores. _grupos lleva (fuente, variable, estadística) a sus filas.
+    """
+
+    def __init__(self, claves, estacion, fuente, variable, estadistica, valores, variables, estadisticas):
+        self.claves = claves
+        self.estacion = estacion
+        self.fuente = fuente
+        self.variable = variable
+        self.estadistica = estadistica
+        self.valores = valores
+        self.variables = variables
+        self.estadisticas = estadisticas
+
+        self._posicion = {clave: i for i, clave in enumerate(claves)}
+        self._grupos = {}
+        if len(estacion):
+            orden = np.lexsort((estacion, estadistica, variable, fuente))
+            llave = np.stack([fuente[orden], variable[orden], estadistica[orden]], axis=1).astype(np.int32)
+            cortes = np.flatnonzero(np.any(llave[1:] != llave[:-1], axis=1)) + 1
+            for inicio, fin in zip(np.r_[0, cortes], np.r_[cortes, len(orden)]):
+                f, v, e = llave[inicio]
+                self._grupos[(FUENTES[f], variables[v], estadisticas[e])] = orden[inicio:fin]
+
+    @classmethod
+    def vacia(cls):
+        vacio = np.array([], dtype=np.int16)
+        return cls(np.array([], dtype=object), np.array([], dtype=np.int32), np.array([], dtype=np.int8),
+                   vacio, vacio, np.zeros((0, len(COLUMNAS)), dtype=np.float32), (), ())
+
+    @classmethod
+    def desde_piezas(cls, piezas):
+        """piezas: {(clave, fuente): (sha, variables, estadisticas, valores)} -> tabla."""
+        if not piezas:
+            return cls.vacia()
+        claves = np.array(sorted({clave for clave, _ in piezas}, key=str), dtype=object)
+        posicion = {clave: i for i, clave in enumerate(claves)}
+        llaves = list(piezas)
+        largos = np.array([len(piezas[k][3]) for k in llaves])
+        estacion = np.repeat(np.array([posicion[c] for c, _ in llaves], dtype=np.int32), largos)
+        fuente = np.repeat(np.array([FUENTES.index(f) for _, f in llaves], dtype=np.int8), largos)
+        variables, variable = np.unique(np.concatenate([piezas[k][1] for k in llaves]), return_inverse=True)
+        estadisticas, estadistica = np.unique(np.concatenate([piezas[k][2] for k in llaves]), return_inverse=True)
+        valores = np.concatenate([piezas[k][3] for k in llaves]).astype(np.float32, copy=False)
+        return cls(claves, estacion, fuente, variable.astype(np.int16), estadistica.astype(np.int16),
+                   valores, tuple(variables), tuple(estadisticas))
+
+    def __len__(self):
+        return len(self.estacion)
+
+    def grupos(self, fuente, variable=None):
+        """Variables de `fuente` o, si se da `variable`, sus estadísticas."""
+        if variable is None:
+            return sorted({v for f, v, _ in self._grupos if f == fuente})
+        return sorted({e for f, v, e in self._grupos if f == fuente and v == variable})
+
+    def resolver_variable(self, fuente, nombre):
+        """Nombre de la tabla para `nombre` (alias como tmax o el título normalizado), o None."""
+        disponibles = set(self.grupos(fuente))
+        candidatos = ALIAS_VARIABLES.get(nombre.lower(), (nombre_columna(nombre),))
+        return next((c for c in candidatos if c in disponibles), None)
+
+    def por_estacion(self, fuente, variable, estadistica, mes):
+        """Un valor por estación de la tabla (alineado con claves); NaN si no lo tiene."""
+        salida = np.full(len(self.claves), np.nan, dtype=np.float32)
+        filas = self._grupos.get((fuente, variable, estadistica))
+        if filas is not None:
+            salida[self.estacion[filas]] = self.valores[filas, mes]
+        return salida
+
+    def mascara(self, claves):
+        """Estaciones de la tabla que están en `claves` (None = todas)."""
+        if claves is None:
+            return np.ones(len(self.claves), dtype=bool)
+        mascara = np.zeros(len(self.claves), dtype=bool)
+        mascara[[i for c in claves if (i := self._posicion.get(c)) is not None]] = True
+        return mascara
+
+
+def seleccionar(valores, mascara, mayor_que=None, menor_que=None, descendente=True, limite=None):
+    """Posiciones que pasan los filtros, ordenadas por valor; y cuántas eran en total."""
+    pasa = mascara & ~np.isnan(valores)
+    if mayor_que is not None:
+        pasa &= valores > mayor_que
+    if menor_que is not None:
+        pasa &= valores < menor_que
+    posiciones = np.flatnonzero(pasa)
+    orden = np.argsort(-valores[posiciones] if descendente else valores[posiciones], kind="stable")
+    return posiciones[orden][:limite], len(posiciones)
+
+
+# ---------------------- CONSTRUCCIÓN Y PERSISTENCIA ----------------------
+TABLA_VERSION = "1"
+
+
+class Climatologia:
+    def __init__(
+        self, estaciones, obtener_csv, directorio=SMN_CACHE_DIR,
+        hilos=SMN_CLIMATOLOGIA_HILOS, ciclo=SMN_CLIMATOLOGIA_CICLO, publicar_cada=SMN_CLIMATOLOGIA_PUBLICAR_CADA,
+    ):
+        """
+        estaciones() -> estaciones del catálogo; obtener_csv(est, fuente) ->
+        (sha del TXT, función que da el CSV) o None si el archivo no tiene datos.
+        """
+        self.estaciones = estaciones
+        self.obtener_csv = obtener_csv
+        self.hilos = hilos
+        self.ciclo = ciclo
+        self.publicar_cada = publicar_cada
+        self._ruta = Path(directorio) / "climatologia.arrow"
+        self._ruta.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._piezas = {}  # (clave, fuente) -> (sha, variables, estadisticas, valores)
+        self._tabla = TablaClimatologica.vacia()
+        self.actualizado = None
+        self._detener = threading.Event()
+        self._hilo = None
+        self._candado = Candado(Path(directorio) / "climatologia.lock")
+        self._cargado = None  # (mtime_ns, tamaño) del .arrow que se cargó
+
+    def tabla(self):
+        return self._tabla
+
+    def cobertura(self):
+        tabla = self._tabla
+        return {"estaciones": len(tabla.claves), "filas": len(tabla), "actualizado": self.actualizado}
+
+    # ---------------------- recorrido ----------------------
+    def iniciar(self):
+        """Carga la tabla guardada y, si hay hilos, la mantiene al día; todo fuera del arranque."""
+        if self._hilo is not None:
+            return
+        self._hilo = threading.Thread(target=self._recorrer, name="climatologia", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """
+        Termina el recorrido (antes de cerrar el pool de procesos): lo pendiente
+        ya no se revisa y se espera a que acaben las revisiones en curso.
+        """
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+    def _recorrer(self):
+        try:
+            self._cargar()
+        except Exception:
+            log.exception("No se pudo cargar la tabla climatológica guardada")
+        try:
+            while self.hilos > 0 and self.ciclo > 0 and not self._detener.is_set():
+                if self._candado.tomar():
+                    self._recorrido()
+                    self._detener.wait(self.ciclo)
+                    continue
+                # Otro proceso recorre el catálogo: aquí solo se toma la tabla que guarda
+                try:
+                    self._cargar()
+                except Exception:
+                    log.exception("No se pudo releer la tabla climatológica")
+                self._detener.wait(min(self.ciclo, RELEER_CADA))
+        finally:
+            self._candado.soltar()
+
+    def _recorrido(self):
+        try:
+            tareas = [
+                (est, fuente) for est in self.estaciones() for fuente in FUENTES
+                if (est.get(fuente) or "").strip()
+            ]
+            cambios = 0
+            with ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="climatologia") as pool:
+                for cambio in pool.map(lambda t: self._revisar(*t), tareas):
+                    cambios += cambio
+                    # La primera vez la tabla se va publicando mientras se llena
+                    if cambio and cambios % self.publicar_cada == 0:
+                        self._publicar(guardar=False)
+            if self._detener.is_set():
+                return
+            # Lo que ya no está en el catálogo (o perdió su URL) sale de la tabla
+            vigentes = {(est.get("clave"), fuente) for est, fuente in tareas}
+            with self._lock:
+                viejas = [llave for llave in self._piezas if llave not in vigentes]
+                for llave in viejas:
+                    del self._piezas[llave]
+            cambios += len(viejas)
+            if cambios or self.actualizado is None:
+                self._publicar()
+                log.info("Tabla climatológica actualizada", extra={"cambios": cambios, **self.cobertura()})
+        except Exception:
+            log.exception("Falló el recorrido de la tabla climatológica")
+
+    def _revisar(self, est, fuente):
+        """Actualiza la pieza (estación, fuente); True si cambió."""
+        llave = (est.get("clave"), fuente)
+        if self._detener.is_set():
+            return False
+        try:
+            resultado = self.obtener_csv(est, fuente)
+            if resultado is None:
+                with self._lock:
+                    return self._piezas.pop(llave, None) is not None
+            sha, generar_csv = resultado
+            anterior = self._piezas.get(llave)
+            if anterior is not None and anterior[0] == sha:
+                return False
+            if self._detener.is_set():
+                return False  # sin mandar más parseos al pool que se está cerrando
+            filas = filas_climatologia(fuente, generar_csv())
+            pieza = (
+                sha,
+                np.array([f[0] for f in filas], dtype=object),
+                np.array([f[1] for f in filas], dtype=object),
+                np.array([f[2] for f in filas], dtype=np.float32).reshape(len(filas), len(COLUMNAS)),
+            )
+            with self._lock:
+                self._piezas[llave] = pieza
+            return True
+        except Exception as ex:
+            log.warning("No se pudo leer para la tabla climatológica", extra={
+                "clave": llave[0], "fuente": fuente, "error": str(ex),
+            })
+            return False
+
+    def _publicar(self, guardar=True):
+        with self._lock:
+            piezas = dict(self._piezas)
+        tabla = TablaClimatologica.desde_piezas(piezas)
+        self._tabla = tabla
+        self.actualizado = time.time()
+        if guardar:
+            self._guardar(piezas)
+
+    # ---------------------- disco ----------------------
+    def _guardar(self, piezas):
+        if pa is None:
+            return
+        llaves = list(piezas)
+        largos = [len(piezas[k][3]) for k in llaves]
+        repetir = lambda i: np.repeat(np.array([k[i] for k in llaves], dtype=object), largos)
+        valores = np.concatenate([piezas[k][3] for k in llaves]) if llaves else np.zeros((0, len(COLUMNAS)), np.float32)
+        columnas = {
+            "clave": repetir(0),
+            "fuente": repetir(1),
+            "sha": np.repeat(np.array([piezas[k][0] for k in llaves], dtype=object), largos),
+            "variable": np.concatenate([piezas[k][1] for k in llaves]) if llaves else np.array([], dtype=object),
+            "estadistica": np.concatenate([piezas[k][2] for k in llaves]) if llaves else np.array([], dtype=object),
+        }
+        arreglos = {n: pa.array(v, type=pa.string()).dictionary_encode() for n, v in columnas.items()}
+        arreglos.update({c: pa.array(valores[:, i], type=pa.float32()) for i, c in enumerate(COLUMNAS)})
+        tabla = pa.table(arreglos).replace_schema_metadata(
+            {"parser_version": PARSER_VERSION, "tabla_version": TABLA_VERSION, "actualizado": str(self.actualizado)}
+        )
+        tmp = self._ruta.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with pa.OSFile(str(tmp), "wb") as f, pa.ipc.new_file(f, tabla.schema) as writer:
+            writer.write_table(tabla)
+        os.replace(tmp, self._ruta)
+
+    def _cargar(self):
+        """Carga la tabla guardada si cambió desde la última vez (la reemplaza completa)."""
+        if pa is None:
+            return
+        try:
+            info = os.stat(self._ruta)
+            if (info.st_mtime_ns, info.st_size) == self._cargado:
+                return
+            tabla = pa.ipc.open_file(pa.memory_map(str(self._ruta))).read_all()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return
+        self._cargado = (info.st_mtime_ns, info.st_size)
+        meta = tabla.schema.metadata or {}
+        if (meta.get(b"parser_version", b"").decode() != PARSER_VERSION
+                or meta.get(b"tabla_version", b"").decode() != TABLA_VERSION):
+            return
+
+        texto = {n: tabla.column(n).to_numpy(zero_copy_only=False).astype(object)
+                 for n in ("clave", "fuente", "sha", "variable", "estadistica")}
+        valores = np.stack([tabla.column(c).to_numpy() for c in COLUMNAS], axis=1) if len(tabla) else None
+        # Las filas de cada (clave, fuente) se escribieron contiguas
+        piezas = {}
+        if len(tabla):
+            cambia = (texto["clave"][1:] != texto["clave"][:-1]) | (texto["fuente"][1:] != texto["fuente"][:-1])
+            cortes = np.flatnonzero(cambia) + 1
+            for inicio, fin in zip(np.r_[0, cortes], np.r_[cortes, len(tabla)]):
+                piezas[(texto["clave"][inicio], texto["fuente"][inicio])] = (
+                    texto["sha"][inicio], texto["variable"][inicio:fin],
+                    texto["estadistica"][inicio:fin], valores[inicio:fin],
+                )
+        with self._lock:
+            self._piezas = piezas
+        self._tabla = TablaClimatologica.desde_piezas(piezas)
+        self.actualizado = float(meta.get(b"actualizado", b"0") or 0)
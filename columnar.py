@@ -0,0 +1,134 @@
+"""
+Conversión de los CSV del SMN a Parquet y Arrow.
+
+Los parsers producen un CSV con filas de metadatos (EMISIÓN, LATITUD, ...)
+seguidas de una o más tablas con título. Aquí los metadatos pasan a los
+metadatos del esquema y las tablas se unen en una sola tabla tipada: cada
+columna se convierte a entero, float32 o fecha cuando todos sus valores lo
+permiten ("Nulo" y vacío cuentan como nulos). Si el archivo tiene varias tablas
+(p. ej. precipitación y temperaturas en mensuales) se agrega la columna "tabla"
+con el título de cada una.
+"""
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # sin pyarrow solo se ofrece CSV
+    pa = None
+
+FORMATOS = {
+    "csv": (".csv", "text/csv; charset=utf-8"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.file"),
+}
+NULOS = {"", "Nulo", "NULO", "nulo"}
+COMPRESION = "zstd"
+
+
+def bloques_csv(texto):
+    """
+    (metadatos, bloques) de un CSV de los parsers. metadatos es un dict con las
+    filas llave/valor del inicio; cada bloque es (título o "", encabezado, filas).
+    """
+    metadatos = {}
+    bloques = []
+    titulo, encabezado, filas = "", None, []
+    en_metadatos = True
+
+    for fila in csv.reader(io.StringIO(texto)):
+        if not fila or not any(c.strip() for c in fila):
+            if encabezado is not None:
+                bloques.append((titulo, encabezado, filas))
+            titulo, encabezado, filas = "", None, []
+            en_metadatos = False
+            continue
+        if en_metadatos:
+            metadatos[fila[0]] = fila[1] if len(fila) > 1 else ""
+        elif encabezado is None and len(fila) == 2 and not fila[1]:
+            titulo = fila[0]
+        elif encabezado is None:
+            encabezado = fila
+        else:
+            filas.append(fila)
+
+    if encabezado is not None:
+        bloques.append((titulo, encabezado, filas))
+    return metadatos, bloques
+
+
+def _nombres_unicos(encabezado):
+    vistos = {}
+    nombres = []
+    for col in encabezado:
+        col = col or "columna"
+        vistos[col] = vistos.get(col, 0) + 1
+        nombres.append(col if vistos[col] == 1 else f"{col}_{vistos[col]}")
+    return nombres
+
+
+def _tipar(serie):
+    """Columna de texto -> int32, float32, fecha o texto, lo más estrecho que acepte todos los valores."""
+    nulos = serie.isin(NULOS) | serie.isna()
+    valores = serie[~nulos]
+    if valores.empty:
+        return pd.Series(np.full(len(serie), np.nan, dtype=np.float32), index=serie.index)
+
+    numeros = pd.to_numeric(valores, errors="coerce")
+    if numeros.notna().all():
+        # Enteros solo si están escritos sin punto decimal ("12", no "12.0")
+        enteros = not valores.astype(str).str.contains(r"[.eE]").any()
+        if enteros and numeros.abs().max() < 2 ** 31:
+            return pd.to_numeric(serie.mask(nulos), errors="coerce").astype("Int32")
+        return pd.to_numeric(serie.mask(nulos), errors="coerce").astype(np.float32)
+
+    for formato in ("%Y-%m-%d", "%d/%m/%Y"):
+        fechas = pd.to_datetime(valores, format=formato, errors="coerce")
+        if fechas.notna().all():
+            return pd.to_datetime(serie.mask(nulos), format=formato, errors="coerce").dt.date
+    return serie.mask(nulos)
+
+
+def tabla_tipada(texto, **metadatos_extra):
+    """pyarrow.Table con todas las tablas del CSV y los metadatos en el esquema."""
+    metadatos, bloques = bloques_csv(texto)
+    partes = []
+    for titulo, encabezado, filas in bloques:
+        nombres = _nombres_unicos(encabezado)
+        ancho = len(nombres)
+        df = pd.DataFrame([(f + [""] * ancho)[:ancho] for f in filas], columns=nombres, dtype=object)
+        if len(bloques) > 1 or titulo:
+            df.insert(0, "tabla", titulo)
+        partes.append(df)
+
+    df = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
+    for col in df.columns:
+        if col == "tabla":
+            df[col] = df[col].astype("category")
+        else:
+            df[col] = _tipar(df[col].astype(object))
+
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    meta = {k: v for k, v in metadatos.items() if k}
+    meta.update(metadatos_extra)
+    return tabla.replace_schema_metadata({k: str(v) for k, v in meta.items()})
+
+
+def serializar(texto, formato, **metadatos_extra):
+    """Bytes del CSV convertido a "parquet" o "arrow" (comprimido con zstd)."""
+    if pa is None:
+        raise RuntimeError("Se necesita pyarrow para los formatos parquet y arrow")
+    tabla = tabla_tipada(texto, **metadatos_extra)
+    buffer = io.BytesIO()
+    if formato == "parquet":
+        pq.write_table(tabla, buffer, compression=COMPRESION)
+    else:
+        opciones = pa.ipc.IpcWriteOptions(compression=COMPRESION)
+        with pa.ipc.new_file(buffer, tabla.schema, options=opciones) as writer:
+            writer.write_table(tabla)
+    return buffer.getvalue()
@@ -1,5 +1,8 @@
 import geopandas as gpd
 
+from geo_cache import serializar_features
+from kml import SNAPSHOT, parse_kml
+
 # --- Estados ---
 gdf_estados = gpd.read_file("data/Estados/Estados.shp")
 gdf_estados.to_file("static/estados.geojson", driver="GeoJSON")
@@ -9,3 +12,14 @@ gdf_municipios = gpd.read_file("data/Municipios/Municipios.shp")
 gdf_municipios.to_file("static/municipios.geojson", driver="GeoJSON")
 
 print("✅ Archivos GeoJSON creados en la carpeta static/")
+
+# --- Snapshot binario para el arranque de la API (main.py lo abre con memory-map) ---
+estados_4326 = gdf_estados.to_crs(epsg=4326)
+municipios_4326 = gdf_municipios.to_crs(epsg=4326)
+SNAPSHOT.construir(
+    parse_kml(),
+    {"estados": estados_4326, "municipios": municipios_4326},
+    {"estados": serializar_features(estados_4326), "municipios": serializar_features(municipios_4326)},
+)
+
+print("✅ Snapshot creado en data/snapshot/")
@@ -0,0 +1,360 @@
+"""
+Índice de disponibilidad de datos por estación y tipo.
+
+Para cada (clave, tipo) guarda si el archivo del SMN tiene datos, la primera y
+la última fecha, el número de registros (días en diarios, años en mensuales,
+renglones en normales y extremos) y el porcentaje de valores faltantes. Con
+eso /api/estaciones filtra por años de historia o actividad reciente y las
+exportaciones descartan de antemano los archivos que se sabe que no existen.
+
+El índice se llena de dos formas:
+  - un recorrido en segundo plano del catálogo (SMN_DISPONIBILIDAD_HILOS hilos)
+    que cada SMN_DISPONIBILIDAD_CICLO segundos revisa las entradas sin datos o
+    más viejas que SMN_DISPONIBILIDAD_TTL. Cualquiera de los dos en 0 lo apaga.
+    Con varios workers solo recorre el proceso que tiene
+    cache/disponibilidad.lock; los demás releen la base cada RELEER_CADA
+    segundos y toman el relevo si ese proceso muere;
+  - lo que ven las descargas normales: un archivo ausente se anota al momento y
+    uno nuevo o cambiado se resume en segundo plano (a lo más
+    SMN_DISPONIBILIDAD_COLA en espera; lo que no cabe lo alcanza el recorrido).
+
+Las entradas viven en cache/disponibilidad.sqlite3 y en un dict en memoria.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cache_smn import SMN_CACHE_DIR
+from candado import Candado
+from cliente_smn import STATUS_AUSENTE
+from columnar import NULOS, bloques_csv
+from parsers import parse_diarios, parse_mensual, parsear_txt
+
+SMN_DISPONIBILIDAD_HILOS = int(os.getenv("SMN_DISPONIBILIDAD_HILOS", "2"))
+SMN_DISPONIBILIDAD_TTL = float(os.getenv("SMN_DISPONIBILIDAD_TTL", str(7 * 24 * 3600)))
+SMN_DISPONIBILIDAD_CICLO = float(os.getenv("SMN_DISPONIBILIDAD_CICLO", "3600"))
+SMN_DISPONIBILIDAD_COLA = int(os.getenv("SMN_DISPONIBILIDAD_COLA", "32"))  # TXT esperando resumen
+
+MESES = ("ENE", "FEB", "MAR", "ABR", "MAY", "JUN", "JUL", "AGO", "SEP", "OCT", "NOV", "DIC")
+CAMPOS = ("existe", "primera", "ultima", "registros", "pct_faltante", "actualizado")
+RELEER_CADA = 60  # segundos entre relecturas de la base en los procesos que no recorren
+FILTRABLES = ("existe", "primera", "ultima")  # lo que usa cumple()
+
+log = logging.getLogger("smn.disponibilidad")
+
+
+# ---------------------- RESUMEN DE UN TXT ----------------------
+def _porcentaje(faltantes, total):
+    return round(100.0 * faltantes / total, 2) if total else 100.0
+
+
+def resumen_disponibilidad(tipo, texto):
+    """
+    {existe, primera, ultima, registros, pct_faltante} de un TXT del SMN.
+    Función pura para el pool de procesos; las fechas van como AAAA-MM-DD.
+    """
+    lines = texto.splitlines()
+    primera = ultima = None
+
+    if tipo == "diarios":
+        df = parse_diarios(lines, {})[1]
+        df = df[df["fecha"].notna()]
+        valores = df.drop(columns="fecha").to_numpy(dtype=np.float32)
+        registros = len(df)
+        faltante = _porcentaje(int(np.isnan(valores).sum()), valores.size)
+        if registros:
+            primera = df["fecha"].min().date().isoformat()
+            ultima = df["fecha"].max().date().isoformat()
+
+    elif tipo == "mensuales":
+        anios, celdas, vacias = set(), 0, 0
+        for _, tabla in parse_mensual(lines)[1]:
+            anios.update(int(a) for a in tabla.iloc[:, 0].dropna())
+            meses = tabla[[m for m in MESES if m in tabla.columns]].to_numpy(dtype=np.float32)
+            celdas += meses.size
+            vacias += int(np.isnan(meses).sum())
+        registros = len(anios)
+        faltante = _porcentaje(vacias, celdas)
+        if anios:
+            primera, ultima = f"{min(anios)}-01-01", f"{max(anios)}-12-31"
+
+    else:
+        _, bloques = bloques_csv(parsear_txt(tipo, lines, {}))
+        registros = sum(len(filas) for _, _, filas in bloques)
+        valores = [c for _, _, filas in bloques for fila in filas for c in fila[1:]]
+        faltante = _porcentaje(sum(1 for c in valores if c.strip() in NULOS), len(valores))
+        if tipo.startswith("normales_"):
+            # normales_1991_2020: el periodo que cubren
+            _, desde, hasta = tipo.split("_")
+            primera, ultima = f"{desde}-01-01", f"{hasta}-12-31"
+
+    return {
+        "existe": registros > 0, "primera": primera, "ultima": ultima,
+        "registros": registros, "pct_faltante": faltante,
+    }
+
+
+def anios_cubiertos(registro):
+    if not registro.get("primera") or not registro.get("ultima"):
+        return 0.0
+    dias = (pd.Timestamp(registro["ultima"]) - pd.Timestamp(registro["primera"])).days + 1
+    return dias / 365.25
+
+
+def _cambia_filtro(anterior, registro):
+    return anterior is None or any(anterior[c] != registro[c] for c in FILTRABLES)
+
+
+# ---------------------- ÍNDICE ----------------------
+class IndiceDisponibilidad:
+    def __init__(
+        self, estaciones, obtener, resumir, tipos,
+        directorio=SMN_CACHE_DIR, hilos=SMN_DISPONIBILIDAD_HILOS,
+        ttl=SMN_DISPONIBILIDAD_TTL, ciclo=SMN_DISPONIBILIDAD_CICLO, cola=SMN_DISPONIBILIDAD_COLA,
+    ):
+        """
+        estaciones() -> estaciones del catálogo; obtener(est, tipo) -> Respuesta
+        con el TXT; resumir(tipo, texto) -> dict de resumen_disponibilidad.
+        """
+        self.estaciones = estaciones
+        self.obtener = obtener
+        self.resumir = resumir
+        self.tipos = tuple(tipos)
+        self.hilos = hilos
+        self.ttl = ttl
+        self.ciclo = ciclo
+        self.cola = cola
+
+        self._ruta = Path(directorio) / "disponibilidad.sqlite3"
+        self._ruta.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._registros = {}  # (clave, tipo) -> dict con CAMPOS y "sha"
+        self._resumiendo = set()
+        self._en_cola = 0
+        self._ejecutor = None
+        self._detener = threading.Event()
+        self._hilo = None
+        self._candado = Candado(Path(directorio) / "disponibilidad.lock")
+        # Cambia solo cuando puede cambiar el resultado de cumple() (para ETags de respuestas
+        # filtradas): una entrada nueva o distinta en FILTRABLES, no al refrescar su fecha
+        self.version = 0
+
+        with self._db() as db:
+            db.executescript("""
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS disponibilidad (
+                    clave TEXT, tipo TEXT, sha TEXT, existe INTEGER, primera TEXT, ultima TEXT,
+                    registros INTEGER, pct_faltante REAL, actualizado REAL,
+                    PRIMARY KEY (clave, tipo)
+                );
+            """)
+        self._registros.update(self._leer_base())
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self._ruta, timeout=30)
+            self._local.db = db
+        return db
+
+    def _leer_base(self):
+        registros = {}
+        for clave, tipo, sha, *valores in self._db().execute("SELECT * FROM disponibilidad"):
+            registro = dict(zip(CAMPOS, valores), sha=sha)
+            registro["existe"] = bool(registro["existe"])
+            registros[(clave, tipo)] = registro
+        return registros
+
+    def _recargar(self):
+        """Toma de la base lo que anotaron otros procesos (el recorrido corre en uno solo)."""
+        registros = self._leer_base()
+        with self._lock:
+            for llave, registro in registros.items():
+                actual = self._registros.get(llave)
+                if actual is None or registro["actualizado"] > actual["actualizado"]:
+                    self._registros[llave] = registro
+                    self.version += _cambia_filtro(actual, registro)
+
+    # ---------------------- consulta ----------------------
+    def obtener_registro(self, clave, tipo):
+        registro = self._registros.get((clave, tipo))
+        return None if registro is None else {c: registro[c] for c in CAMPOS}
+
+    def de_estacion(self, clave):
+        return {t: r for t in self.tipos if (r := self.obtener_registro(clave, t)) is not None}
+
+    def vigente(self, clave, tipo):
+        registro = self._registros.get((clave, tipo))
+        return registro is not None and time.time() - registro["actualizado"] < self.ttl
+
+    def sin_datos(self, clave, tipo):
+        """True solo si el índice sabe (y no ha vencido) que ese archivo no tiene datos."""
+        return self.vigente(clave, tipo) and not self._registros[(clave, tipo)]["existe"]
+
+    def cumple(self, clave, tipos, min_anios=None, activa_desde=None):
+        """Si la estación tiene datos de todos los `tipos` con la historia y la actividad pedidas."""
+        for tipo in tipos:
+            registro = self._registros.get((clave, tipo))
+            if registro is None or not registro["existe"]:
+                return False
+            if min_anios is not None and anios_cubiertos(registro) < min_anios:
+                return False
+            if activa_desde is not None and (registro["ultima"] or "") < activa_desde:
+                return False
+        return True
+
+    def cobertura(self):
+        """Cuántas (clave, tipo) hay en el índice y cuántas con datos."""
+        registros = list(self._registros.values())
+        return {"indexados": len(registros), "con_datos": sum(1 for r in registros if r["existe"])}
+
+    # ---------------------- actualización ----------------------
+    def guardar(self, clave, tipo, sha, resumen):
+        registro = dict(resumen, sha=sha, actualizado=time.time())
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO disponibilidad VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (clave, tipo, sha, int(registro["existe"]), registro["primera"], registro["ultima"],
+                 registro["registros"], registro["pct_faltante"], registro["actualizado"]),
+            )
+        with self._lock:
+            anterior = self._registros.get((clave, tipo))
+            self._registros[(clave, tipo)] = registro
+            self.version += _cambia_filtro(anterior, registro)
+
+    def observar(self, clave, tipo, resp, esperar=False):
+        """
+        Anota lo que se supo de (clave, tipo) al descargar su TXT. Solo un 404/410
+        o un archivo casi vacío cuentan como ausencia; los errores de red y los
+        demás códigos (429, 5xx que sobrevivieron a los reintentos, ...) no se
+        anotan porque pueden ser pasajeros. Si hay que resumir un archivo nuevo
+        y no se pide `esperar`, se hace en segundo plano.
+        """
+        if resp.error or resp.status not in (200, *STATUS_AUSENTE):
+            return
+        if resp.status in STATUS_AUSENTE or len(resp.text.splitlines()) < 5:
+            self.guardar(clave, tipo, "", {
+                "existe": False, "primera": None, "ultima": None, "registros": 0, "pct_faltante": 100.0,
+            })
+            return
+
+        sha = hashlib.sha256(resp.text.encode("utf-8")).hexdigest()
+        registro = self._registros.get((clave, tipo))
+        if registro is not None and registro["sha"] == sha:
+            if not self.vigente(clave, tipo):
+                self.guardar(clave, tipo, sha, {c: registro[c] for c in CAMPOS[:-1]})
+            return
+
+        with self._lock:
+            if self._detener.is_set() or (clave, tipo, sha) in self._resumiendo:
+                return
+            if not esperar and self._en_cola >= self.cola:
+                # Cola llena (una exportación grande): sin copiar más TXT a memoria
+                return
+            self._resumiendo.add((clave, tipo, sha))
+            if not esperar:
+                self._en_cola += 1
+        if esperar:
+            self._resumir(clave, tipo, sha, resp.text)
+            return
+        ejecutor = self._ejecutor_resumen()
+        if ejecutor is None:
+            self._terminar(clave, tipo, sha, en_cola=True)
+            return
+        ejecutor.submit(self._resumir, clave, tipo, sha, resp.text, True)
+
+    def _ejecutor_resumen(self):
+        """El ejecutor de resúmenes en segundo plano; None una vez detenido el índice."""
+        with self._lock:
+            if self._detener.is_set():
+                return None
+            if self._ejecutor is None:
+                self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disponibilidad")
+            return self._ejecutor
+
+    def detener(self):
+        """
+        Detiene el recorrido y los resúmenes (antes de cerrar el pool de procesos):
+        descarta los pendientes, espera los que estén en curso y no acepta más.
+        """
+        self._detener.set()
+        with self._lock:
+            ejecutor, self._ejecutor = self._ejecutor, None
+        if ejecutor is not None:
+            ejecutor.shutdown(wait=True, cancel_futures=True)
+        if self._hilo is not None:
+            self._hilo.join()
+
+    def _resumir(self, clave, tipo, sha, texto, en_cola=False):
+        try:
+            if not self._detener.is_set():
+                self.guardar(clave, tipo, sha, self.resumir(tipo, texto))
+        except Exception:
+            log.exception("No se pudo resumir la disponibilidad", extra={"clave": clave, "tipo": tipo})
+        finally:
+            self._terminar(clave, tipo, sha, en_cola)
+
+    def _terminar(self, clave, tipo, sha, en_cola):
+        with self._lock:
+            self._resumiendo.discard((clave, tipo, sha))
+            if en_cola:
+                self._en_cola -= 1
+
+    # ---------------------- recorrido en segundo plano ----------------------
+    def iniciar(self):
+        if self.hilos <= 0 or self.ciclo <= 0 or self._hilo is not None:
+            return
+        self._hilo = threading.Thread(target=self._recorrer, name="disponibilidad", daemon=True)
+        self._hilo.start()
+
+    def _recorrer(self):
+        try:
+            while not self._detener.is_set():
+                if self._candado.tomar():
+                    self._recorrido()
+                    self._detener.wait(self.ciclo)
+                    continue
+                # Otro proceso recorre el catálogo: aquí solo se releen sus resultados
+                try:
+                    self._recargar()
+                except Exception:
+                    log.exception("No se pudo releer el índice de disponibilidad")
+                self._detener.wait(min(self.ciclo, RELEER_CADA))
+        finally:
+            self._candado.soltar()
+
+    def _recorrido(self):
+        try:
+            pendientes = [
+                (est, tipo) for est in self.estaciones() for tipo in self.tipos
+                if (est.get(tipo) or "").strip() and not self.vigente(est.get("clave"), tipo)
+            ]
+            if pendientes:
+                log.info("Actualizando índice de disponibilidad", extra={"pendientes": len(pendientes)})
+                with ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="disponibilidad") as pool:
+                    for _ in pool.map(lambda t: self._revisar(*t), pendientes):
+                        pass
+                if self._detener.is_set():
+                    return
+                log.info("Índice de disponibilidad actualizado", extra=self.cobertura())
+        except Exception:
+            log.exception("Falló el recorrido del índice de disponibilidad")
+
+    def _revisar(self, est, tipo):
+        if self._detener.is_set():
+            return
+        try:
+            self.observar(est.get("clave"), tipo, self.obtener(est, tipo), esperar=True)
+        except Exception as ex:
+            log.warning("No se pudo revisar la disponibilidad", extra={
+                "clave": est.get("clave"), "tipo": tipo, "error": str(ex),
+            })
@@ -0,0 +1,192 @@
+"""
+Espejo local de los TXT del SMN.
+
+sync_smn.py recorre el catálogo y guarda cada archivo (diarios, mensuales,
+normales y extremos) comprimido en SMN_ESPEJO_DIR/{tipo}/{clave}.txt.gz, con un
+manifiesto (manifiesto.json) que registra por (clave, tipo) la URL, el sha256,
+los validadores HTTP (ETag, Last-Modified), la fecha de EMISIÓN y cuándo se
+sincronizó. Una sincronización incremental solo baja lo que cambió:
+  - entradas cuyo TTL (el de cache_smn por tipo) no ha vencido no se tocan;
+  - con validadores se hace un GET condicional y un 304 no baja nada;
+  - sin validadores se piden los primeros bytes (Range) y si la EMISIÓN es la
+    misma que la guardada no se baja el resto.
+
+La API lee del espejo con SMN_ORIGEN=espejo (o ?origen=espejo en
+/api/descargar_csv); con "auto" usa el espejo cuando tiene el archivo y la red
+si no.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+from cache_smn import TTL_POR_TIPO, TTL_DEFAULT, extraer_emision, _header
+from cliente_smn import Respuesta, STATUS_AUSENTE
+
+SMN_ESPEJO_DIR = os.getenv("SMN_ESPEJO_DIR", str(Path(__file__).resolve().parent / "espejo"))
+SMN_ORIGEN = os.getenv("SMN_ORIGEN", "red").lower()  # red | espejo | auto
+ORIGENES = ("red", "espejo", "auto")
+
+BYTES_ENCABEZADO = 4096  # alcanza para la EMISIÓN del encabezado
+GUARDAR_CADA = 200  # entradas entre escrituras del manifiesto
+
+log = logging.getLogger("smn.espejo")
+
+
+def _llave(clave, tipo):
+    return f"{clave}|{tipo}"
+
+
+class Espejo:
+    def __init__(self, directorio=SMN_ESPEJO_DIR):
+        self.dir = Path(directorio)
+
+    @property
+    def ruta_manifiesto(self):
+        return self.dir / "manifiesto.json"
+
+    def ruta(self, clave, tipo):
+        return self.dir / tipo / (re.sub(r"[^\w.-]", "_", str(clave)) + ".txt.gz")
+
+    # ---------------------- lectura (API) ----------------------
+    def leer(self, clave, tipo):
+        """Texto guardado de (clave, tipo), o None si el espejo no lo tiene."""
+        try:
+            return gzip.decompress(self.ruta(clave, tipo).read_bytes()).decode("utf-8")
+        except FileNotFoundError:
+            return None
+
+    def obtener(self, clave, tipo, url):
+        """
+        Como CacheSMN.obtener_txt pero desde el espejo. Si no está el archivo es
+        un error (no un 404): no dice nada de si el SMN lo tiene.
+        """
+        texto = self.leer(clave, tipo)
+        if texto is None:
+            return Respuesta(url=url, error="No está en el espejo local", headers={"X-Cache": "ESPEJO"})
+        return Respuesta(url=url, status=200, text=texto, headers={"X-Cache": "ESPEJO"})
+
+    # ---------------------- manifiesto ----------------------
+    def cargar_manifiesto(self):
+        try:
+            return json.loads(self.ruta_manifiesto.read_text(encoding="utf-8"))["archivos"]
+        except FileNotFoundError:
+            return {}
+
+    def guardar_manifiesto(self, archivos):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        datos = json.dumps({"actualizado": time.time(), "archivos": archivos}, ensure_ascii=False, indent=1)
+        tmp = self.ruta_manifiesto.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(datos, encoding="utf-8")
+        os.replace(tmp, self.ruta_manifiesto)
+
+    def _escribir(self, clave, tipo, texto):
+        ruta = self.ruta(clave, tipo)
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        tmp = ruta.with_name(f"{ruta.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(gzip.compress(texto.encode("utf-8"), compresslevel=6))
+        os.replace(tmp, ruta)
+
+    # ---------------------- sincronización ----------------------
+    def vigente(self, entrada, tipo):
+        ttl = TTL_POR_TIPO.get(tipo, TTL_DEFAULT)
+        return ttl is None or time.time() - entrada["sincronizado"] < ttl
+
+    def sincronizar_archivo(self, clave, tipo, url, anterior, cliente):
+        """
+        Revisa un archivo contra el SMN; regresa (resultado, entrada nueva del
+        manifiesto). resultado: nuevo | cambiado | sin_cambios | faltante | error.
+        """
+        ahora = time.time()
+        tiene_archivo = anterior is not None and anterior.get("sha256") and self.ruta(clave, tipo).exists()
+        resp = None
+
+        if tiene_archivo:
+            condicionales = {}
+            if anterior.get("etag"):
+                condicionales["If-None-Match"] = anterior["etag"]
+            if anterior.get("last_modified"):
+                condicionales["If-Modified-Since"] = anterior["last_modified"]
+            if not condicionales and anterior.get("emision"):
+                # Sin validadores: basta el encabezado para comparar la EMISIÓN
+                condicionales["Range"] = f"bytes=0-{BYTES_ENCABEZADO - 1}"
+            resp = cliente.obtener(url, headers=condicionales)
+            if resp.status == 304 or (
+                resp.status == 206 and extraer_emision(resp.text) == anterior["emision"]
+            ):
+                return "sin_cambios", dict(anterior, url=url, sincronizado=ahora)
+            if resp.status == 206:
+                resp = None  # cambió la EMISIÓN: hace falta el archivo completo
+
+        if resp is None:
+            resp = cliente.obtener(url)
+        if resp.error or resp.status not in (200, *STATUS_AUSENTE):
+            # 429, 403, 416, 5xx...: el SMN no dijo que el archivo ya no exista
+            return "error", anterior
+        if resp.status in STATUS_AUSENTE or len(resp.text.splitlines()) < 5:
+            try:
+                self.ruta(clave, tipo).unlink()
+            except FileNotFoundError:
+                pass
+            return "faltante", {"url": url, "existe": False, "sincronizado": ahora}
+
+        sha = hashlib.sha256(resp.text.encode("utf-8")).hexdigest()
+        entrada = {
+            "url": url,
+            "existe": True,
+            "sha256": sha,
+            "etag": _header(resp.headers, "ETag"),
+            "last_modified": _header(resp.headers, "Last-Modified"),
+            "emision": extraer_emision(resp.text),
+            "sincronizado": ahora,
+        }
+        if tiene_archivo and anterior["sha256"] == sha:
+            return "sin_cambios", dict(entrada, bytes=anterior.get("bytes"))
+        self._escribir(clave, tipo, resp.text)
+        entrada["bytes"] = self.ruta(clave, tipo).stat().st_size
+        return ("cambiado" if tiene_archivo else "nuevo"), entrada
+
+    def sincronizar(self, estaciones, tipos, cliente, forzar=False, progreso=None):
+        """
+        Sincroniza (estación, tipo) de todas las `estaciones` en paralelo con
+        cliente.mapear. El manifiesto se guarda cada GUARDAR_CADA archivos y al
+        final, así que una sincronización interrumpida no pierde lo avanzado.
+        """
+        archivos = self.cargar_manifiesto()
+        tareas = []
+        omitidos = 0
+        for est in estaciones:
+            for tipo in tipos:
+                url = (est.get(tipo) or "").strip()
+                if not url:
+                    continue
+                anterior = archivos.get(_llave(est.get("clave"), tipo))
+                if not forzar and anterior is not None and anterior.get("url") == url and self.vigente(anterior, tipo):
+                    omitidos += 1
+                    continue
+                tareas.append((est.get("clave"), tipo, url))
+
+        resumen = {"vigentes": omitidos, "nuevo": 0, "cambiado": 0, "sin_cambios": 0, "faltante": 0, "error": 0}
+        revisar = lambda t: self.sincronizar_archivo(*t, archivos.get(_llave(t[0], t[1])), cliente)
+        try:
+            for hechos, ((clave, tipo, url), resultado, error) in enumerate(cliente.mapear(revisar, tareas), 1):
+                if error is not None:
+                    log.warning("No se pudo sincronizar", extra={"clave": clave, "tipo": tipo, "error": str(error)})
+                    resumen["error"] += 1
+                    continue
+                estado, entrada = resultado
+                resumen[estado] += 1
+                if entrada is not None:
+                    archivos[_llave(clave, tipo)] = entrada
+                if hechos % GUARDAR_CADA == 0:
+                    self.guardar_manifiesto(archivos)
+                if progreso is not None:
+                    progreso(hechos, len(tareas), resumen)
+        finally:
+            self.guardar_manifiesto(archivos)
+        return resumen
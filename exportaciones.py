@@ -0,0 +1,372 @@
+"""
+Exportaciones masivas en segundo plano.
+
+Una exportación (los mismos filtros que /api/descargar_csv) se vuelve un
+trabajo con id estable: el hash de sus parámetros. Pedir dos veces la misma
+exportación mientras corre regresa el mismo trabajo. Los trabajos se ejecutan
+en unos pocos hilos propios con una cola acotada, así que no ocupan workers
+web ni dependen de que la conexión HTTP siga abierta.
+
+Cada trabajo vive en cache/exportaciones/{id}/:
+  - trabajo.json   parámetros, estado y progreso (se reescribe de forma atómica)
+  - partes/        un archivo por (estación, tipo) en cuanto termina
+  - resultado.zip  el artefacto final
+
+Como cada parte se guarda al terminar y trabajo.json lista las ya hechas, si
+el proceso se cae el trabajo se reanuda al arrancar sin repetir lo terminado.
+Los trabajos terminados o fallidos sin tocar en SMN_EXPORT_TTL se borran del
+disco (los hilos lo revisan cada PURGAR_CADA segundos).
+
+Con varios workers el disco es la fuente de verdad: un trabajo que no atiende
+este proceso se relee de trabajo.json, y antes de ejecutarlo se toma su
+candado (trabajo.lock), así que cada trabajo corre en un solo proceso aunque
+todos lo reencolen al arrancar.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import zipfile
+from collections import deque
+from pathlib import Path
+
+from cache_smn import SMN_CACHE_DIR
+from candado import Candado
+from zip_stream import zip_en_flujo
+
+SMN_EXPORT_DIR = os.getenv("SMN_EXPORT_DIR", str(Path(SMN_CACHE_DIR) / "exportaciones"))
+SMN_EXPORT_WORKERS = int(os.getenv("SMN_EXPORT_WORKERS", "2"))
+SMN_EXPORT_COLA = int(os.getenv("SMN_EXPORT_COLA", "16"))
+SMN_EXPORT_TTL = float(os.getenv("SMN_EXPORT_TTL", str(24 * 3600)))
+
+PURGAR_CADA = 600  # segundos entre revisiones de trabajos vencidos
+
+PENDIENTE, EN_CURSO, TERMINADO, FALLIDO = "pendiente", "en_curso", "terminado", "fallido"
+CAMPOS = ("parametros", "estado", "total", "hechas", "bytes", "creado", "actualizado", "error")
+
+log = logging.getLogger("smn.exportaciones")
+
+
+class ColaLlena(Exception):
+    """No hay lugar para otra exportación pendiente."""
+
+
+def id_trabajo(parametros):
+    normalizados = json.dumps(parametros, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(normalizados.encode("utf-8")).hexdigest()[:24]
+
+
+def nombre_seguro(nombre):
+    """Nombre de archivo sin separadores ni componentes especiales (viene del municipio del KML)."""
+    return re.sub(r"[^\w.-]", "_", nombre).lstrip(".") or "archivo"
+
+
+def _escribir_atomico(ruta, data):
+    tmp = ruta.with_name(f"{ruta.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, ruta)
+
+
+class Trabajo:
+    def __init__(self, directorio, id, parametros):
+        self.dir = Path(directorio) / id
+        self.id = id
+        self.parametros = parametros
+        self.estado = PENDIENTE
+        self.total = 0
+        self.hechas = {}  # "clave|tipo" -> nombre del archivo, o None si no hubo datos
+        self.fallidas = {}  # "clave|tipo" -> error de este intento (se reintentan al reanudar)
+        self.bytes = 0
+        self.creado = self.actualizado = time.time()
+        self.error = ""
+        self.candado = Candado(self.dir / "trabajo.lock")
+        self._lock = threading.Lock()
+
+    @property
+    def partes(self):
+        return self.dir / "partes"
+
+    @property
+    def resultado(self):
+        return self.dir / "resultado.zip"
+
+    @classmethod
+    def cargar(cls, ruta):
+        trabajo = cls(ruta.parent, ruta.name, None)
+        trabajo.refrescar()
+        return trabajo
+
+    def refrescar(self):
+        """Relee trabajo.json: otro proceso pudo crearlo, avanzarlo o terminarlo."""
+        datos = json.loads((self.dir / "trabajo.json").read_text(encoding="utf-8"))
+        with self._lock:
+            for campo in CAMPOS:
+                setattr(self, campo, datos[campo])
+
+    def guardar(self):
+        with self._lock:
+            self.actualizado = time.time()
+            datos = {
+                "id": self.id, "parametros": self.parametros, "estado": self.estado,
+                "total": self.total, "hechas": self.hechas, "bytes": self.bytes,
+                "creado": self.creado, "actualizado": self.actualizado, "error": self.error,
+            }
+            _escribir_atomico(self.dir / "trabajo.json", json.dumps(datos, ensure_ascii=False).encode("utf-8"))
+
+    def vencido(self, ttl):
+        return self.estado == TERMINADO and (time.time() - self.actualizado > ttl or not self.resultado.exists())
+
+    def purgable(self, ttl):
+        return self.estado in (TERMINADO, FALLIDO) and time.time() - self.actualizado > ttl
+
+    def anotar(self, llave, nombre=None, error=None):
+        """Registra una parte (hecha o fallida); el hilo del trabajo escribe mientras las peticiones leen."""
+        with self._lock:
+            if error is not None:
+                self.fallidas[llave] = error
+            else:
+                self.hechas[llave] = nombre
+
+    def progreso(self):
+        with self._lock:
+            hechas, con_datos = len(self.hechas), sum(1 for v in self.hechas.values() if v)
+            fallidas = len(self.fallidas)
+        return {
+            "id": self.id,
+            "estado": self.estado,
+            "parametros": self.parametros,
+            "total": self.total,
+            "hechas": hechas,
+            "con_datos": con_datos,
+            "fallidas": fallidas,
+            "bytes": self.bytes,
+            "creado": self.creado,
+            "actualizado": self.actualizado,
+            "error": self.error,
+        }
+
+
+class GestorExportaciones:
+    def __init__(
+        self, planificar, procesar, mapear,
+        directorio=SMN_EXPORT_DIR, workers=SMN_EXPORT_WORKERS, max_cola=SMN_EXPORT_COLA, ttl=SMN_EXPORT_TTL,
+    ):
+        """
+        planificar(parametros) -> [(est, tipo)]; procesar(est, tipo, formato) ->
+        (nombre, bytes) o None; mapear: como ClienteSMN.mapear.
+        """
+        self.planificar = planificar
+        self.procesar = procesar
+        self.mapear = mapear
+        self.dir = Path(directorio)
+        self.workers = workers
+        self.max_cola = max_cola
+        self.ttl = ttl
+
+        self._trabajos = {}
+        self._propios = set()  # ids encolados o en curso en este proceso
+        self._cola = deque()
+        self._cond = threading.Condition()
+        self._hilos = []
+        self._ultima_purga = 0.0
+
+    # ---------------------- ciclo de vida ----------------------
+    def iniciar(self):
+        """Carga los trabajos en disco, reencola los inconclusos y arranca los hilos."""
+        if self._hilos:
+            return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with self._cond:
+            for ruta in sorted(self.dir.iterdir()):
+                try:
+                    trabajo = Trabajo.cargar(ruta)
+                except (OSError, ValueError, KeyError):
+                    continue
+                self._trabajos[trabajo.id] = trabajo
+                if trabajo.estado in (PENDIENTE, EN_CURSO) and not trabajo.candado.ocupado():
+                    log.info("Reanudando exportación", extra={
+                        "trabajo": trabajo.id, "hechas": len(trabajo.hechas), "total": trabajo.total,
+                    })
+                    trabajo.estado = PENDIENTE
+                    self._propios.add(trabajo.id)
+                    self._cola.append(trabajo)
+        for n in range(self.workers):
+            hilo = threading.Thread(target=self._atender, name=f"exportacion-{n}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def _atender(self):
+        while True:
+            with self._cond:
+                while not self._cola:
+                    self._purgar()
+                    self._cond.wait(PURGAR_CADA)
+                self._purgar()
+                trabajo = self._cola.popleft()
+            if not self._reclamar(trabajo):
+                with self._cond:
+                    self._propios.discard(trabajo.id)
+                continue
+            try:
+                self._ejecutar(trabajo)
+            except Exception as ex:
+                log.exception("Exportación fallida", extra={"trabajo": trabajo.id})
+                trabajo.estado, trabajo.error = FALLIDO, str(ex)
+                trabajo.guardar()
+            finally:
+                trabajo.candado.soltar()
+                with self._cond:
+                    self._propios.discard(trabajo.id)
+
+    def _reclamar(self, trabajo):
+        """
+        Toma el candado del trabajo y lo relee del disco. False si otro proceso
+        lo está corriendo o ya lo terminó mientras esperaba en la cola.
+        """
+        if not trabajo.candado.tomar():
+            log.info("Exportación atendida por otro proceso", extra={"trabajo": trabajo.id})
+            return False
+        try:
+            trabajo.refrescar()
+        except (OSError, ValueError, KeyError):
+            trabajo.candado.soltar()
+            return False
+        if trabajo.estado not in (PENDIENTE, EN_CURSO):
+            trabajo.candado.soltar()
+            return False
+        return True
+
+    def _purgar(self):
+        """
+        Borra los trabajos vencidos (con self._cond tomado, para no competir con
+        enviar). Recorre el disco: también los creados por otros procesos.
+        """
+        if time.time() - self._ultima_purga < PURGAR_CADA:
+            return
+        self._ultima_purga = time.time()
+        for ruta in list(self.dir.iterdir()):
+            try:
+                trabajo = Trabajo.cargar(ruta)
+            except (OSError, ValueError, KeyError):
+                continue
+            if not trabajo.purgable(self.ttl) or not trabajo.candado.tomar():
+                continue
+            self._trabajos.pop(trabajo.id, None)
+            shutil.rmtree(trabajo.dir, ignore_errors=True)
+            trabajo.candado.soltar()
+            log.info("Exportación vencida borrada", extra={"trabajo": trabajo.id})
+
+    # ---------------------- API ----------------------
+    def enviar(self, parametros):
+        """
+        Trabajo para esos parámetros: el mismo si está en curso o terminado y
+        vigente. Uno fallido se reintenta conservando lo ya hecho. ColaLlena si
+        no cabe otro trabajo pendiente.
+        """
+        id = id_trabajo(parametros)
+        trabajo = self.obtener(id)
+        with self._cond:
+            if trabajo is not None and trabajo.estado in (PENDIENTE, EN_CURSO):
+                if id in self._propios or trabajo.candado.ocupado():
+                    return trabajo
+                # Inconcluso y sin candado: el proceso que lo corría murió; se reencola aquí
+            if trabajo is not None and trabajo.estado == TERMINADO and not trabajo.vencido(self.ttl):
+                return trabajo
+            if len(self._cola) >= self.max_cola:
+                raise ColaLlena()
+
+            if trabajo is None or trabajo.estado == TERMINADO:
+                trabajo = Trabajo(self.dir, id, parametros)
+                trabajo.partes.mkdir(parents=True, exist_ok=True)
+                for viejo in trabajo.partes.iterdir():
+                    viejo.unlink()
+                trabajo.resultado.unlink(missing_ok=True)
+            else:
+                trabajo.estado, trabajo.error = PENDIENTE, ""
+            trabajo.guardar()
+            self._trabajos[id] = trabajo
+            self._propios.add(id)
+            self._cola.append(trabajo)
+            self._cond.notify()
+            return trabajo
+
+    def obtener(self, id):
+        """
+        El trabajo con ese id, o None. Si no lo atiende este proceso se relee
+        de disco: pudo crearlo o avanzarlo otro worker.
+        """
+        if not re.fullmatch(r"[0-9a-f]{24}", id):
+            return None
+        with self._cond:
+            trabajo = self._trabajos.get(id)
+            if id in self._propios:
+                return trabajo
+        try:
+            if trabajo is None:
+                trabajo = Trabajo.cargar(self.dir / id)
+            else:
+                trabajo.refrescar()
+        except (OSError, ValueError, KeyError):
+            with self._cond:
+                if id not in self._propios:
+                    self._trabajos.pop(id, None)
+            return None
+        with self._cond:
+            return self._trabajos.setdefault(id, trabajo)
+
+    def por_estado(self):
+        """{(estado,): número de trabajos} para el medidor de /metrics."""
+        with self._cond:
+            conteo = {(estado,): 0 for estado in (PENDIENTE, EN_CURSO, TERMINADO, FALLIDO)}
+            for trabajo in self._trabajos.values():
+                conteo[(trabajo.estado,)] += 1
+            return conteo
+
+    # ---------------------- ejecución ----------------------
+    def _ejecutar(self, trabajo):
+        trabajo.estado = EN_CURSO
+        trabajo.fallidas = {}
+        formato = trabajo.parametros.get("formato", "csv")
+
+        tareas = self.planificar(trabajo.parametros)
+        trabajo.total = len(tareas)
+        trabajo.guardar()
+
+        pendientes = [(est, tipo) for est, tipo in tareas if f"{est.get('clave')}|{tipo}" not in trabajo.hechas]
+        ultimo_guardado = time.time()
+        for (est, tipo), archivo, error in self.mapear(lambda t: self.procesar(*t, formato), pendientes):
+            llave = f"{est.get('clave')}|{tipo}"
+            if error is not None:
+                trabajo.anotar(llave, error=str(error))
+                continue
+            nombre = None
+            if archivo is not None:
+                nombre, contenido = archivo
+                nombre = nombre_seguro(nombre)
+                _escribir_atomico(trabajo.partes / nombre, contenido)
+                trabajo.bytes += len(contenido)
+            trabajo.anotar(llave, nombre)
+            # El progreso se persiste a lo más cada segundo
+            if time.time() - ultimo_guardado >= 1:
+                trabajo.guardar()
+                ultimo_guardado = time.time()
+
+        if trabajo.fallidas:
+            trabajo.estado = FALLIDO
+            trabajo.error = f"{len(trabajo.fallidas)} archivos fallaron; vuelva a enviar para reintentarlos"
+            trabajo.guardar()
+            return
+
+        nombres = sorted(n for n in trabajo.hechas.values() if n)
+        compresion = zipfile.ZIP_DEFLATED if formato == "csv" else zipfile.ZIP_STORED
+        tmp = trabajo.resultado.with_name("resultado.zip.tmp")
+        with open(tmp, "wb") as f:
+            for chunk in zip_en_flujo(((n, (trabajo.partes / n).read_bytes()) for n in nombres), compresion):
+                f.write(chunk)
+        os.replace(tmp, trabajo.resultado)
+        trabajo.estado = TERMINADO
+        trabajo.guardar()
@@ -0,0 +1,289 @@
+"""
+GeoJSON de estados y municipios reproyectado y serializado una sola vez.
+
+Al arrancar se reproyectan los shapefiles a EPSG:4326 y cada feature se
+serializa a bytes. Las respuestas (FeatureCollection) se arman uniendo esos
+bytes y se guardan con su ETag y variantes gzip/brotli, de modo que una
+consulta repetida solo busca en un diccionario.
+
+Para vistas alejadas hay niveles de detalle: geometrías simplificadas por
+arcos compartidos (topologia.py, las fronteras entre vecinos se simplifican
+una sola vez) con coordenadas cuantizadas a cierto número de decimales. Los
+niveles por zoom se calculan en segundo plano al arrancar.
+"""
+import gzip
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from topologia import Topologia
+from vuelo_unico import VueloUnico
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él solo se ofrece gzip
+    brotli = None
+
+
+def serializar_features(gdf):
+    """Bytes JSON de cada feature, en el mismo formato que JSONResponse(gdf.to_json())."""
+    features = json.loads(gdf.to_json())["features"]
+    return [
+        json.dumps(f, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        for f in features
+    ]
+
+
+# Zooms con simplificación precalculada; de ZOOM_COMPLETO en adelante va la geometría original
+ZOOM_NIVELES = (3, 5, 7, 9, 11)
+ZOOM_COMPLETO = 12
+MAX_NIVELES_LIBRES = 16  # niveles con tolerance/precision arbitrarios que se conservan
+
+
+def tolerancia_zoom(zoom):
+    """Tamaño de un píxel (en grados) en teselas de 256 px para ese zoom."""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def precision_tolerancia(tolerancia):
+    """Decimales suficientes para que el redondeo sea menor que media tolerancia."""
+    return min(7, max(1, math.ceil(-math.log10(tolerancia / 2))))
+
+
+def nivel_detalle(zoom=None, tolerance=None, precision=None):
+    """
+    (tolerancia, decimales) a aplicar, o None para la geometría completa. Un zoom
+    se redondea al nivel precalculado inmediato superior (más detallado).
+    """
+    if tolerance is None and zoom is not None and zoom < ZOOM_COMPLETO:
+        z = min((n for n in ZOOM_NIVELES if n >= zoom), default=ZOOM_NIVELES[-1])
+        tolerance = tolerancia_zoom(z)
+    if tolerance:
+        tolerance = float(f"{tolerance:.2g}")  # acota la variedad de niveles cacheados
+        if precision is None:
+            precision = precision_tolerancia(tolerance)
+    else:
+        tolerance = 0.0
+    if not tolerance and precision is None:
+        return None
+    return (tolerance, precision)
+
+
+def simplificar(gdf, nivel, topologia=None):
+    """Geometrías del nivel; con la `topologia` de la capa los vecinos siguen compartiendo frontera."""
+    tolerancia, decimales = nivel
+    geom = gdf.geometry
+    if tolerancia:
+        if topologia is not None:
+            geom = gpd.GeoSeries(topologia.simplificar(tolerancia), index=gdf.index, crs=gdf.crs)
+        else:
+            geom = geom.simplify(tolerancia, preserve_topology=True)
+    if decimales is not None:
+        geom = gpd.GeoSeries(
+            shapely.transform(np.asarray(geom), lambda c: np.round(c, decimales)),
+            index=gdf.index, crs=gdf.crs,
+        )
+    return gdf.set_geometry(geom)
+
+
+def armar_coleccion(features):
+    return b'{"type":"FeatureCollection","features":[' + b",".join(features) + b"]}"
+
+
+class GeoJSONCacheado:
+    """
+    Cuerpo de una respuesta JSON (GeoJSON o el catálogo de estaciones) con ETag y
+    variantes comprimidas perezosas. Sin `etag` se usa el sha1 del cuerpo.
+    """
+
+    def __init__(self, body, total, etag=None):
+        self.body = body
+        self.total = total
+        self.etag = etag or '"' + hashlib.sha1(body).hexdigest() + '"'
+        self._variantes = {}
+        self._lock = threading.Lock()
+
+    def variante(self, encoding):
+        if encoding == "identity":
+            return self.body
+        with self._lock:
+            data = self._variantes.get(encoding)
+            if data is None:
+                if encoding == "br":
+                    data = brotli.compress(self.body, quality=9)
+                else:
+                    data = gzip.compress(self.body, compresslevel=6)
+                self._variantes[encoding] = data
+            return data
+
+    def tamano(self):
+        """Bytes que ocupa: el cuerpo más las variantes comprimidas ya calculadas."""
+        with self._lock:
+            return len(self.body) + sum(len(v) for v in self._variantes.values())
+
+
+class CacheRespuestas:
+    """
+    LRU de GeoJSONCacheado acotado por bytes (cuerpos y variantes), no por
+    número de entradas: unas pocas respuestas del catálogo completo pesan más
+    que cientos de consultas chicas.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._respuestas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, llave, armar):
+        with self._lock:
+            cacheado = self._respuestas.get(llave)
+            if cacheado is not None:
+                self._respuestas.move_to_end(llave)
+                return cacheado
+        cacheado = armar()
+        with self._lock:
+            self._respuestas[llave] = cacheado
+            total = sum(c.tamano() for c in self._respuestas.values())
+            # La más reciente se queda aunque sola pase del límite
+            while total > self.max_bytes and len(self._respuestas) > 1:
+                _, viejo = self._respuestas.popitem(last=False)
+                total -= viejo.tamano()
+        return cacheado
+
+    def limpiar(self):
+        with self._lock:
+            self._respuestas.clear()
+
+
+def elegir_encoding(accept_encoding):
+    aceptados = {p.split(";")[0].strip().lower() for p in (accept_encoding or "").split(",")}
+    if brotli is not None and "br" in aceptados:
+        return "br"
+    if "gzip" in aceptados:
+        return "gzip"
+    return "identity"
+
+
+class GeoJSONCache:
+    def __init__(self, gdf_estados, gdf_municipios, max_respuestas=512, features=None):
+        """features: bytes ya serializados por capa (p. ej. del snapshot); se calculan si faltan."""
+        features = features or {}
+        # 🔁 Reproyectar a EPSG:4326 una sola vez
+        self.estados = gdf_estados.to_crs(epsg=4326)
+        self.municipios = gdf_municipios.to_crs(epsg=4326)
+
+        self._capas = {"estados": self.estados, "municipios": self.municipios}
+        self._features = {
+            (capa, None): features.get(capa) or serializar_features(gdf)
+            for capa, gdf in self._capas.items()
+        }
+        self._features_libres = OrderedDict()
+        self._topologias = {}  # capa -> Topologia, se arma con el primer nivel simplificado
+        self._lock_niveles = threading.Lock()
+        self._nombres = {
+            "estados": self.estados["NOMGEO"].str.upper(),
+            "municipios": self.municipios["NOMGEO"].str.upper(),
+        }
+
+        self.max_respuestas = max_respuestas
+        self._respuestas = OrderedDict()
+        self._lock = threading.Lock()
+        self._vuelos = VueloUnico()
+
+        # Precalcular las respuestas que pide el mapa: país completo y cada estado
+        self.estados_geojson("TODOS")
+        for nombre in self._nombres["estados"]:
+            self.estados_geojson(nombre)
+            self.municipios_geojson(nombre, "TODOS")
+
+        threading.Thread(target=self._precalcular_niveles, name="geojson-niveles", daemon=True).start()
+
+    # ---------------------- niveles de detalle ----------------------
+    def _precalcular_niveles(self):
+        for zoom in ZOOM_NIVELES:
+            for capa in self._capas:
+                self._features_nivel(capa, nivel_detalle(zoom=zoom))
+
+    def _features_nivel(self, capa, nivel):
+        features = self._features.get((capa, nivel)) or self._features_libres.get((capa, nivel))
+        if features is not None:
+            return features
+
+        with self._lock_niveles:
+            features = self._features.get((capa, nivel)) or self._features_libres.get((capa, nivel))
+            if features is not None:
+                return features
+            topologia = None
+            if nivel[0]:
+                topologia = self._topologias.get(capa)
+                if topologia is None:
+                    topologia = self._topologias[capa] = Topologia(self._capas[capa].geometry)
+            features = serializar_features(simplificar(self._capas[capa], nivel, topologia))
+            if nivel in {nivel_detalle(zoom=z) for z in ZOOM_NIVELES}:
+                self._features[(capa, nivel)] = features
+            else:
+                self._features_libres[(capa, nivel)] = features
+                while len(self._features_libres) > MAX_NIVELES_LIBRES:
+                    self._features_libres.popitem(last=False)
+        return features
+
+    # ---------------------- filtros ----------------------
+    def _posiciones_estados(self, estado):
+        if estado and estado.upper() != "TODOS":
+            mask = self._nombres["estados"].str.contains(estado.upper())
+            return mask.to_numpy().nonzero()[0]
+        return range(len(self.estados))
+
+    def _posiciones_municipios(self, estado, municipio):
+        mask = None
+        if estado and estado.upper() != "TODOS":
+            match = self.estados[self._nombres["estados"].str.contains(estado.upper())]
+            if match.empty:
+                return []
+            mask = (self.municipios["CVE_ENT"] == match.iloc[0]["CVE_ENT"]).to_numpy()
+        if municipio and municipio.upper() != "TODOS":
+            m = self._nombres["municipios"].str.contains(municipio.upper()).to_numpy()
+            mask = m if mask is None else mask & m
+        if mask is None:
+            return range(len(self.municipios))
+        return mask.nonzero()[0]
+
+    # ---------------------- respuestas ----------------------
+    def _obtener(self, llave, posiciones):
+        with self._lock:
+            cacheado = self._respuestas.get(llave)
+            if cacheado is not None:
+                self._respuestas.move_to_end(llave)
+                return cacheado
+
+        # Peticiones simultáneas del mismo subconjunto arman una sola respuesta
+        return self._vuelos.hacer(llave, lambda: self._armar(llave, posiciones))
+
+    def _armar(self, llave, posiciones):
+        features = self._features_nivel(llave[0], llave[1])
+        posiciones = posiciones()
+        cacheado = GeoJSONCacheado(armar_coleccion([features[i] for i in posiciones]), len(posiciones))
+
+        with self._lock:
+            self._respuestas[llave] = cacheado
+            while len(self._respuestas) > self.max_respuestas:
+                self._respuestas.popitem(last=False)
+        return cacheado
+
+    def estados_geojson(self, estado="TODOS", nivel=None):
+        estado = (estado or "TODOS").upper()
+        return self._obtener(("estados", nivel, estado), lambda: self._posiciones_estados(estado))
+
+    def municipios_geojson(self, estado="TODOS", municipio="TODOS", nivel=None):
+        estado = (estado or "TODOS").upper()
+        municipio = (municipio or "TODOS").upper()
+        return self._obtener(
+            ("municipios", nivel, estado, municipio),
+            lambda: self._posiciones_municipios(estado, municipio),
+        )
@@ -0,0 +1,132 @@
+"""
+Índice espacial de estaciones y polígonos municipales.
+
+Las coordenadas de las estaciones se guardan como arreglos NumPy y en un
+STRtree, igual que los polígonos de municipios (EPSG:4326). Todas las
+consultas (caja, radio, k más cercanas, dentro de un municipio) son
+operaciones vectorizadas sobre esos arreglos, sin recorrer estaciones en Python.
+"""
+import numpy as np
+import shapely
+from shapely.geometry import box
+
+from catalogo import normalizar
+
+RADIO_TIERRA_KM = 6371.0088
+MEDIA_VUELTA_KM = np.pi * RADIO_TIERRA_KM  # ningún punto está más lejos que esto
+
+
+def haversine_km(lat, lon, lats, lons):
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(a))
+
+
+class IndiceEspacial:
+    def __init__(self, estaciones, estados, gdf_municipios):
+        validas, lats, lons = [], [], []
+        for est in estaciones:
+            try:
+                lat, lon = float(est.get("lat")), float(est.get("lon"))
+            except (TypeError, ValueError):
+                continue
+            validas.append(est)
+            lats.append(lat)
+            lons.append(lon)
+
+        self.estaciones = tuple(validas)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.arbol = shapely.STRtree(shapely.points(self.lons, self.lats))
+
+        # De los estados bastan sus atributos; los municipios deben venir en EPSG:4326
+        self.est_cve_ent = estados["CVE_ENT"].to_numpy()
+        self.est_nombre = [normalizar(n) for n in estados["NOMGEO"]]
+        self.municipios = np.asarray(gdf_municipios.geometry.values, dtype=object)
+        self.mun_cve_ent = gdf_municipios["CVE_ENT"].to_numpy()
+        self.mun_cve_mun = gdf_municipios["CVE_MUN"].to_numpy()
+        self.mun_nombre = np.array([normalizar(n) for n in gdf_municipios["NOMGEO"]], dtype=object)
+
+    def _resultado(self, idx, distancias=None):
+        """Lista de (estación, distancia_km o None)."""
+        if distancias is None:
+            return [(self.estaciones[i], None) for i in idx]
+        return [(self.estaciones[i], float(d)) for i, d in zip(idx, distancias)]
+
+    def en_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        idx = self.arbol.query(box(min_lon, min_lat, max_lon, max_lat), predicate="intersects")
+        idx.sort()
+        return self._resultado(idx)
+
+    def _en_circulo(self, lat, lon, km):
+        """(índices, distancias) de las estaciones a menos de `km`: caja en el STRtree y luego distancia exacta."""
+        # La caja contiene al casquete esférico: en longitud se abre arcsin(sen δ / cos φ), o completa si toca un polo
+        delta = km / RADIO_TIERRA_KM
+        dlat = np.degrees(delta)
+        if delta < np.pi / 2 - abs(np.radians(lat)):
+            dlon = np.degrees(np.arcsin(np.sin(delta) / np.cos(np.radians(lat))))
+            oeste, este = lon - dlon, lon + dlon
+        else:
+            oeste, este = -180.0, 180.0
+        cajas = [box(max(oeste, -180.0), lat - dlat, min(este, 180.0), lat + dlat)]
+        # Lo que pasa del antimeridiano se busca del otro lado
+        if oeste < -180.0:
+            cajas.append(box(oeste + 360.0, lat - dlat, 180.0, lat + dlat))
+        if este > 180.0:
+            cajas.append(box(-180.0, lat - dlat, este - 360.0, lat + dlat))
+        idx = np.unique(np.concatenate([self.arbol.query(c) for c in cajas]))
+        dist = haversine_km(lat, lon, self.lats[idx], self.lons[idx])
+        dentro = dist <= km
+        return idx[dentro], dist[dentro]
+
+    def en_radio(self, lat, lon, km):
+        """Estaciones a menos de `km` kilómetros, ordenadas por distancia."""
+        idx, dist = self._en_circulo(lat, lon, km)
+        orden = np.argsort(dist, kind="stable")
+        return self._resultado(idx[orden], dist[orden])
+
+    def cercanas(self, lat, lon, k=10):
+        """Las k estaciones más cercanas al punto, ordenadas por distancia."""
+        if not len(self.estaciones):
+            return []
+        k = min(k, len(self.estaciones))
+        # Radio inicial: la más cercana en el plano; se duplica hasta que el círculo tenga k
+        # estaciones, y entonces ninguna de fuera puede estar más cerca que esas
+        primera = self.arbol.query_nearest(shapely.Point(lon, lat))[0]
+        km = max(float(haversine_km(lat, lon, self.lats[primera], self.lons[primera])), 1.0)
+        while True:
+            idx, dist = self._en_circulo(lat, lon, km)
+            if len(idx) >= k or km >= MEDIA_VUELTA_KM:
+                break
+            km = min(2 * km, MEDIA_VUELTA_KM)
+        orden = np.argsort(dist, kind="stable")[:k]
+        return self._resultado(idx[orden], dist[orden])
+
+    def buscar_municipios(self, estado=None, municipio=None, cve_ent=None, cve_mun=None):
+        """Posiciones de los polígonos que coinciden con los criterios dados."""
+        mask = np.ones(len(self.municipios), dtype=bool)
+        if estado and not cve_ent:
+            nombre = normalizar(estado)
+            coincidencias = [i for i, n in enumerate(self.est_nombre) if n == nombre] or \
+                [i for i, n in enumerate(self.est_nombre) if nombre in n]
+            if not coincidencias:
+                return np.array([], dtype=np.intp)
+            cve_ent = self.est_cve_ent[coincidencias[0]]
+        if cve_ent:
+            mask &= self.mun_cve_ent == cve_ent
+        if cve_mun:
+            mask &= self.mun_cve_mun == cve_mun
+        if municipio:
+            nombre = normalizar(municipio)
+            exacto = mask & (self.mun_nombre == nombre)
+            mask = exacto if exacto.any() else mask & np.array([nombre in n for n in self.mun_nombre])
+        return mask.nonzero()[0]
+
+    def en_municipios(self, posiciones):
+        """Estaciones dentro (o sobre el borde) de los polígonos indicados."""
+        if len(posiciones) == 0:
+            return []
+        pares = self.arbol.query(self.municipios[posiciones], predicate="intersects")
+        idx = np.unique(pares[1])
+        return self._resultado(idx)
@@ -0,0 +1,89 @@
+"""
+Lectura del KML de estaciones del SMN y el snapshot binario del catálogo.
+
+Vive aparte de main.py para que los pasos sin servidor (convert_shp.py,
+sync_smn.py, benchmark.py) puedan leer el catálogo sin levantar la API: sin
+clientes HTTP, caches en sqlite ni hilos de fondo.
+"""
+import os
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from snapshot import Snapshot
+
+BASE_DIR = Path(__file__).resolve().parent
+KML_FILE = os.getenv("SMN_KML_FILE", "data/doc.kml")  # benchmark.py apunta aquí su KML sintético
+
+# Snapshot binario generado por convert_shp.py; si no existe o está vencido se leen los originales
+SNAPSHOT = Snapshot(BASE_DIR / "data", {
+    "estaciones": [BASE_DIR / KML_FILE],
+    "estados": [BASE_DIR / "data" / "Estados" / f"Estados.{ext}" for ext in ("shp", "shx", "dbf", "prj")],
+    "municipios": [BASE_DIR / "data" / "Municipios" / f"Municipios.{ext}" for ext in ("shp", "shx", "dbf", "prj")],
+})
+
+KML_NS = "{http://www.opengis.net/kml/2.2}"
+
+
+def registro_estacion(datos):
+    return {
+        "clave": datos.get("CLAVE"),
+        "nombre": datos.get("NOMBRE"),
+        "estado": datos.get("ESTADO"),
+        "municipio": datos.get("MUNICIPIO"),
+        "organismo": datos.get("ORG_CUENCA"),
+        "cuenca": datos.get("CUENCA"),
+        "tipo_est": datos.get("TIPO_EST"),
+        "inicio": datos.get("INICIO"),
+        "mas_reciente": datos.get("MAS_RECIENTE"),
+        "lat": datos.get("LATITUD"),
+        "lon": datos.get("LONGITUD"),
+        "alt": datos.get("ALTITUD"),
+        "diarios": datos.get("DIARIOS"),
+        "mensuales": datos.get("MENSUALES"),
+        "normales_1961_1990": datos.get("NORMALES_1961_1990"),
+        "normales_1971_2000": datos.get("NORMALES_1971_2000"),
+        "normales_1981_2010": datos.get("NORMALES_1981_2010"),
+        "normales_1991_2020": datos.get("NORMALES_1991_2020"),
+        "extremos": datos.get("EXTREMOS"),
+        "situacion": datos.get("SITUACION")
+    }
+
+
+def iter_kml(ruta=KML_FILE):
+    """
+    Recorre el KML con iterparse y entrega una estación por Placemark. Cada
+    Placemark se descarta del árbol al terminar, así que la memoria no crece
+    con el tamaño del archivo.
+    """
+    pila = []
+    datos = None      # SimpleData del primer SchemaData del Placemark en curso
+    en_schema = False
+
+    for evento, elem in ET.iterparse(ruta, events=("start", "end")):
+        if evento == "start":
+            if elem.tag == KML_NS + "Placemark":
+                datos = None
+            elif (elem.tag == KML_NS + "SchemaData" and datos is None
+                  and any(e.tag == KML_NS + "Placemark" for e in pila)
+                  and pila[-1].tag == KML_NS + "ExtendedData"):
+                datos = {}
+                en_schema = True
+            pila.append(elem)
+            continue
+
+        pila.pop()
+        if elem.tag == KML_NS + "SimpleData" and en_schema and pila and pila[-1].tag == KML_NS + "SchemaData":
+            datos[elem.attrib["name"]] = elem.text
+        elif elem.tag == KML_NS + "SchemaData":
+            en_schema = False
+        elif elem.tag == KML_NS + "Placemark":
+            if datos and datos.get("ESTADO"):
+                yield registro_estacion(datos)
+            datos = None
+            elem.clear()
+            if pila:
+                pila[-1].remove(elem)
+
+
+def parse_kml():
+    return list(iter_kml(KML_FILE))
@@ -1,27 +1,79 @@
 from fastapi import FastAPI, Query
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from contextlib import asynccontextmanager
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-import xml.etree.ElementTree as ET
-import requests
-import csv
-import io
+from starlette.background import BackgroundTask
+import base64
+import hashlib
+import itertools
+import logging
+import math
+import threading
+import time
 import zipfile
-import re
 import os
 import geopandas as gpd
 from shapely.geometry import mapping
 import numpy as np
-import pandas as pd
-import json
 from fastapi import Request
 from datetime import datetime
-from pathlib import Path
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from pydantic import BaseModel
-
-app = FastAPI(title="API de Estaciones Climatológicas - ITSM")
+import anyio
+
+from cliente_smn import ClienteSMN, STATUS_AUSENTE, en_segundo_plano
+from cache_smn import CacheSMN
+from zip_stream import zip_en_flujo
+from catalogo import CatalogoEstaciones, diferencias_catalogo, json_bytes, CAMPOS as CAMPOS_ESTACION
+from geo_cache import GeoJSONCache, GeoJSONCacheado, CacheRespuestas, elegir_encoding, nivel_detalle
+from teselas import TeselasVectoriales, CapaVectorial, ZOOM_MAX
+from indice_espacial import IndiceEspacial
+from snapshot import Perezoso, sha256_archivo
+# KML y snapshot en su propio módulo (convert_shp.py y sync_smn.py los usan sin levantar la API)
+from kml import BASE_DIR, KML_FILE, SNAPSHOT, iter_kml
+# registro_estacion y parse_kml se reexportan para quien los importaba desde main
+from kml import registro_estacion, parse_kml
+from vuelo_unico import VueloUnico
+from procesos import PoolProcesos
+# Los parsers se reexportan para quien los importaba desde main
+from parsers import (
+    parse_mensual_txt, parse_normales_txt, parse_extremos_txt_fixed, parse_diarios_txt, parse_diarios,
+    parsear_txt, parsear_texto, diarios_tipados, CAMPOS_META_DIARIOS,
+)
+from series_diarias import AlmacenSeries, VARIABLES, arrow_series
+from columnar import FORMATOS, serializar as serializar_columnar
+from exportaciones import GestorExportaciones, ColaLlena, TERMINADO
+from agregados import PERIODOS, ESTADISTICAS, VALOR_NORMAL, agregar, normales_mensuales, calcular_anomalias
+from disponibilidad import IndiceDisponibilidad, resumen_disponibilidad
+from climatologia import Climatologia, FUENTES as FUENTES_CLIMATOLOGIA, COLUMNAS as MESES_CLIMATOLOGIA, seleccionar
+from espejo import Espejo, SMN_ORIGEN, ORIGENES
+from admision import LimitadorClientes, CupoDescargas, CupoLleno, cliente_de
+from bitacora import configurar as configurar_bitacora
+from metricas import REGISTRO, TIPO_CONTENIDO, MiddlewareMetricas, etapa, propagar
+
+configurar_bitacora()
+log = logging.getLogger("smn.api")
+
+@asynccontextmanager
+async def lifespan(app):
+    if SMN_KML_VIGILAR_SEG > 0:
+        threading.Thread(target=vigilar_kml, name="vigilar-kml", daemon=True).start()
+    EXPORTACIONES.iniciar()
+    DISPONIBILIDAD.iniciar()
+    CLIMATOLOGIA.iniciar()
+    yield
+    CLIMATOLOGIA.detener()
+    DISPONIBILIDAD.detener()
+    POOL_PARSEO.cerrar()
+
+app = FastAPI(title="API de Estaciones Climatológicas - ITSM", lifespan=lifespan)
+app.add_middleware(MiddlewareMetricas)
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=REGISTRO.exponer(), media_type=TIPO_CONTENIDO)
 
 
 # -------- CONFIGURAR STATIC --------
@@ -39,579 +91,1098 @@ def serve_home():
             media_type="text/plain"
         )
 
-KML_FILE = "data/doc.kml"
-
-# ---------------------- PARSE KML ----------------------
-def parse_kml():
-    estaciones = []
-    tree = ET.parse(KML_FILE)
-    root = tree.getroot()
-    ns = {"kml": "http://www.opengis.net/kml/2.2"}
-
-    placemarks = root.findall(".//kml:Placemark", ns)
-    for placemark in placemarks:
-        ext_data = placemark.find(".//kml:ExtendedData/kml:SchemaData", ns)
-        if ext_data is None:
-            continue
-
-        datos = {}
-        for data in ext_data.findall("kml:SimpleData", ns):
-            datos[data.attrib["name"]] = data.text
-
-        if datos.get("ESTADO"):
-            estaciones.append({
-                "clave": datos.get("CLAVE"),
-                "nombre": datos.get("NOMBRE"),
-                "estado": datos.get("ESTADO"),
-                "municipio": datos.get("MUNICIPIO"),
-                "organismo": datos.get("ORG_CUENCA"),
-                "cuenca": datos.get("CUENCA"),
-                "tipo_est": datos.get("TIPO_EST"),
-                "inicio": datos.get("INICIO"),
-                "mas_reciente": datos.get("MAS_RECIENTE"),
-                "lat": datos.get("LATITUD"),
-                "lon": datos.get("LONGITUD"),
-                "alt": datos.get("ALTITUD"),
-                "diarios": datos.get("DIARIOS"),
-                "mensuales": datos.get("MENSUALES"),
-                "normales_1961_1990": datos.get("NORMALES_1961_1990"),
-                "normales_1971_2000": datos.get("NORMALES_1971_2000"),
-                "normales_1981_2010": datos.get("NORMALES_1981_2010"),
-                "normales_1991_2020": datos.get("NORMALES_1991_2020"),
-                "extremos": datos.get("EXTREMOS"),
-                "situacion": datos.get("SITUACION")
-            })
-    return estaciones
-
-ESTACIONES = parse_kml()
+# ---------------------- EJECUCIÓN ----------------------
+# El parseo (CPU) va a un pool de procesos; lo bloqueante de descargas y series
+# va a hilos con su propio límite, para no agotar los del resto de los endpoints.
+POOL_PARSEO = PoolProcesos()
+SMN_HILOS_DESCARGA = int(os.getenv("SMN_HILOS_DESCARGA", "16"))
+LIMITE_DESCARGAS = anyio.CapacityLimiter(SMN_HILOS_DESCARGA)
+
+async def en_hilo(fn, *args, limitador=None):
+    """fn(*args) en un hilo sin detener el event loop; `limitador` acota cuántos corren a la vez."""
+    return await anyio.to_thread.run_sync(fn, *args, limiter=limitador)
+
+async def en_flujo(iterador, limitador=None):
+    """Recorre un iterador bloqueante (p. ej. el ZIP en flujo) desde hilos."""
+    fin = object()
+    while True:
+        elemento = await en_hilo(next, iterador, fin, limitador=limitador)
+        if elemento is fin:
+            return
+        yield elemento
+
+# ---------------------- CATÁLOGO ----------------------
+def cargar_catalogo():
+    tabla = SNAPSHOT.estaciones()
+    if tabla is not None:
+        # La huella es el sha256 del KML que guardó el manifest: el arranque no relee el KML
+        return CatalogoEstaciones.desde_tabla(tabla, huella=SNAPSHOT.sha256("estaciones"))
+    ruta = BASE_DIR / KML_FILE
+    huella = sha256_archivo(ruta) if ruta.exists() else ""
+    return CatalogoEstaciones(iter_kml(KML_FILE), huella=huella)
+
+CATALOGO = Perezoso(cargar_catalogo)
+
+# ---------------------- RECARGA DEL CATÁLOGO ----------------------
+SMN_ADMIN_TOKEN = os.getenv("SMN_ADMIN_TOKEN", "")
+SMN_KML_VIGILAR_SEG = float(os.getenv("SMN_KML_VIGILAR_SEG", "0"))  # 0 = sin vigilancia
+_lock_recarga = threading.Lock()
+
+def recargar_catalogo():
+    """
+    Vuelve a leer el KML solo si su sha256 cambió. El catálogo nuevo se arma
+    aparte y se publica con un único reemplazo de referencia: las peticiones en
+    curso terminan con el catálogo que ya tenían.
+    """
+    with _lock_recarga:
+        actual = CATALOGO.get()
+        huella = sha256_archivo(BASE_DIR / KML_FILE)
+        if huella == actual.huella:
+            return {"cambio": False, "huella": huella, "total": len(actual)}
+
+        nuevo = CatalogoEstaciones(iter_kml(KML_FILE), huella=huella)
+        cambios = diferencias_catalogo(actual, nuevo)
+        CATALOGO.reemplazar(nuevo)
+
+        # Derivados que dependen de las estaciones
+        INDICE_ESPACIAL.reiniciar()
+        RESPUESTAS_ESTACIONES.limpiar()
+        if TESELAS.cargado:
+            TESELAS.get().reemplazar_capa("estaciones", CapaVectorial.desde_estaciones(nuevo))
+
+        log.info("Catálogo recargado", extra={
+            "estaciones": len(nuevo), "nuevas": len(cambios["agregadas"]),
+            "eliminadas": len(cambios["eliminadas"]), "modificadas": len(cambios["modificadas"]),
+        })
+        return {"cambio": True, "huella": huella, "total": len(nuevo), **cambios}
+
+def vigilar_kml():
+    ultimo = None
+    while True:
+        time.sleep(SMN_KML_VIGILAR_SEG)
+        try:
+            st = os.stat(BASE_DIR / KML_FILE)
+            firma = (st.st_size, st.st_mtime_ns)
+            if ultimo is not None and firma != ultimo:
+                recargar_catalogo()
+            ultimo = firma
+        except Exception as ex:
+            log.warning("Vigilancia del KML: %s", ex)
+
+@app.post("/api/admin/recargar_catalogo")
+def post_recargar_catalogo(request: Request):
+    if not SMN_ADMIN_TOKEN or request.headers.get("x-admin-token") != SMN_ADMIN_TOKEN:
+        return JSONResponse(content={"error": "No autorizado"}, status_code=403)
+    return recargar_catalogo()
 
 @app.get("/api/estados")
 def get_estados():
-    estados = set()
-    for e in ESTACIONES:
-        if e["estado"]:
-            estados.add(e["estado"].strip().upper())
-    return {"estados": sorted(estados)}
+    return {"estados": CATALOGO.get().estados}
 
-@app.get("/api/estaciones")
-def get_estaciones(
-    estado: str = Query(None),
-    municipio: str = Query(None),
-    clave: str = Query(None)
-):
-    filtradas = ESTACIONES
-    if estado:
-        filtradas = [e for e in filtradas if e["estado"] and e["estado"].lower() == estado.lower()]
-    if municipio:
-        filtradas = [e for e in filtradas if e["municipio"] and e["municipio"].lower() == municipio.lower()]
-    if clave:
-        filtradas = [e for e in filtradas if e["clave"] == clave]
-
-    return {"total": len(filtradas), "estaciones": filtradas}
-
-# ---------------------- PARSER PARA MENSUALES ----------------------
-def extract_metadata(lines):
-    meta_order = [
-        ("ESTADÍSTICA MENSUAL", ""),
-        ("EMISIÓN", ""),
-        ("ESTACIÓN", ""),
-        ("NOMBRE", ""),
-        ("ESTADO", ""),
-        ("MUNICIPIO", ""),
-        ("SITUACIÓN", ""),
-        ("CVE-OMM", ""),
-        ("LATITUD", ""),
-        ("LONGITUD", ""),
-        ("ALTITUD", ""),
-    ]
-    header_zone = lines[:120]
-
-    def find_value(key):
-        for ln in header_zone:
-            s = ln.strip()
-            if s.startswith(key):
-                return s.split(":", 1)[-1].strip()
-        return ""
-
-    out = []
-    for key, default in meta_order:
-        if key == "ESTADÍSTICA MENSUAL":
-            out.append([key, ""])
-        else:
-            out.append([key, find_value(key) or default])
-    return out
-
-def header_spans(header_line):
-    h = header_line.expandtabs(8).rstrip("\n")
-    matches = list(re.finditer(r"\S+", h))
-    labels = [m.group(0) for m in matches]
-    starts = [m.start() for m in matches]
-    return labels, starts
-
-def slice_by_spans(line, starts, ncols):
-    s = line.expandtabs(8).rstrip("\n")
-    if len(s) < (starts[-1] + 1):
-        s = s + " " * ((starts[-1] + 1) - len(s))
-    cols = []
-    for i in range(ncols):
-        start = starts[i]
-        end = starts[i + 1] if i + 1 < ncols else None
-        piece = s[start:end].strip()
-        cols.append(piece)
-    return cols
-
-def parse_mensual_txt(lines):
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-
-    # --- Metadatos ---
-    for k, v in extract_metadata(lines):
-        writer.writerow([k, v])
-    writer.writerow([])
-
-    # --- Tablas ---
-    i = 0
-    n = len(lines)
-
-    def prev_nonempty(idx):
-        j = idx - 1
-        while j >= 0:
-            if lines[j].strip():
-                return lines[j].strip()
-            j -= 1
-        return ""
-
-    while i < n:
-        line = lines[i].strip()
-        if line.startswith("AÑO"):
-            title = prev_nonempty(i)
-            skip_titles = {
-                "COMISIÓN NACIONAL DEL AGUA",
-                "COORDINACIÓN GENERAL DEL SERVICIO METEOROLÓGICO NACIONAL",
-                "BASE DE DATOS CLIMATOLÓGICA NACIONAL",
-                "ESTADÍSTICA MENSUAL",
-            }
-            if title not in skip_titles and ":" not in title:
-                writer.writerow([title, ""])
-
-            header = lines[i].rstrip("\n")
-            labels, starts = header_spans(header)
-            writer.writerow(labels)
-            i += 1
-
-            while i < n:
-                cur = lines[i]
-                cur_strip = cur.strip()
-                if not cur_strip or cur_strip.startswith("AÑO"):
-                    break
-                data_cols = slice_by_spans(cur, starts, len(starts))
-                writer.writerow(data_cols)
-                i += 1
-
-            writer.writerow([])
-            continue
-        i += 1
-
-    return buffer.getvalue()
-
-# ---------------------- PARSER PARA NORMALES ----------------------
-DELIM = re.compile(r"\t+|\s{2,}")  # separador: tabs o 2+ espacios
-
-def parse_normales_txt(lines, periodo="1961-1990"):
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-
-    # --- Metadatos ---
-    header_zone = lines[:60]
-
-    def find_value(key):
-        for ln in header_zone:
-            s = ln.strip()
-            if s.upper().startswith(key):
-                return s.split(":", 1)[-1].strip()
-        return ""
-
-    writer.writerow([f"NORMAL CLIMATOLÓGICA {periodo}", ""])
-    for key in ["EMISIÓN", "ESTACIÓN", "NOMBRE", "ESTADO", "MUNICIPIO",
-                "SITUACIÓN", "CVE-OMM", "LATITUD", "LONGITUD", "ALTITUD"]:
-        writer.writerow([key, find_value(key)])
-    writer.writerow([])
-
-    # --- Tablas ---
-    n = len(lines)
-    i = 0
-
-    def prev_nonempty(idx):
-        j = idx - 1
-        while j >= 0:
-            if lines[j].strip():
-                return lines[j].strip()
-            j -= 1
-        return ""
-
-    while i < n:
-        line = lines[i].strip()
-        if line.startswith("MESES"):
-            title = prev_nonempty(i)
-            if title and ":" not in title and not title.startswith("NORMAL CLIMATOLÓGICA"):
-                writer.writerow([title, ""])
-
-            headers = DELIM.split(line.strip())
-            headers = ["VARIABLE"] + headers[1:]
-            writer.writerow(headers)
-            i += 1
-
-            while i < n:
-                cur = lines[i].strip()
-                if not cur or cur.startswith("MESES"):
-                    break
-                parts = DELIM.split(cur)
-                if parts:
-                    writer.writerow(parts)
-                i += 1
-
-            writer.writerow([])
-            continue
-        i += 1
-
-    return buffer.getvalue()
-
-# ---------------------- PARSER PARA EXTREMOS ----------------------
-def parse_extremos_txt_fixed(lines):
-    buffer = io.StringIO()
-    writer = csv.writer(buffer)
-
-    # --- Metadatos ---
-    header_zone = lines[:60]
-
-    def find_value(key):
-        for ln in header_zone:
-            s = ln.strip()
-            if s.upper().startswith(key):
-                return s.split(":", 1)[-1].strip()
-        return ""
-
-    writer.writerow(["VALORES EXTREMOS", ""])
-    for key in ["EMISIÓN", "ESTACIÓN", "NOMBRE", "ESTADO", "MUNICIPIO",
-                "SITUACIÓN", "CVE-OMM", "LATITUD", "LONGITUD", "ALTITUD"]:
-        writer.writerow([key, find_value(key)])
-    writer.writerow([])
-
-    # --- Tablas ---
-    n = len(lines)
-    i = 0
-
-    expected_headers = [
-        "MES", "Año Inicio", "Año Final", "Núm Años",
-        "Valor Máx.", "Fecha Máx.", "Se ha Rep.",
-        "Valor Mín.", "Fecha Mín.", "Se ha Rep.",
-        "Valor Medio", "Desv Estándar"
-    ]
+# ---------------------- /api/estaciones ----------------------
+SMN_ESTACIONES_MAX_AGE = int(os.getenv("SMN_ESTACIONES_MAX_AGE", "60"))
+SMN_ESTACIONES_CACHE_MB = float(os.getenv("SMN_ESTACIONES_CACHE_MB", "64"))  # cuerpos y variantes comprimidas
+FILTROS_ESTACIONES = ("estado", "municipio", "clave", "situacion", "tipo_est", "cuenca")
 
-    while i < n:
-        line = lines[i].strip()
-        # Detectar inicio de sección
-        if line.upper().startswith(("TEMPERATURA MÁXIMA", "TEMPERATURA MÍNIMA", "PRECIPITACIÓN", "EVAPORACIÓN")):
-            writer.writerow([line, ""])
-            i += 1
-            continue
-
-        # Detectar encabezado de tabla (línea que empieza con MES)
-        if line.startswith("MES"):
-            # saltamos 2 filas de encabezado en el TXT y ponemos las esperadas
-            writer.writerow(expected_headers)
-            i += 2
-            # Escribir filas hasta línea en blanco o nueva sección
-            while i < n and lines[i].strip() and not lines[i].upper().startswith(("TEMPERATURA", "PRECIPITACIÓN", "EVAPORACIÓN")):
-                parts = re.split(r"\s{2,}|\t+", lines[i].strip())
-                writer.writerow(parts)
-                i += 1
-            writer.writerow([])
-            continue
-
-        i += 1
-
-    return buffer.getvalue() 
-
-# ---------------------- PARSER PARA DIARIOS ----------------------
-def parse_diarios_txt(lines, est):
+def cursor_estaciones(catalogo, posicion):
+    """Cursor opaco: posición en el resultado, ligada a la versión (huella) del catálogo."""
+    return base64.urlsafe_b64encode(f"{catalogo.huella[:16]}:{posicion}".encode()).decode().rstrip("=")
+
+def leer_cursor(catalogo, cursor):
+    """Posición del cursor, o None si no es válido o es de otra versión del catálogo."""
+    try:
+        huella, posicion = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        posicion = int(posicion)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return posicion if huella == catalogo.huella[:16] and posicion >= 0 else None
+
+def etag_estaciones(catalogo, version, llave):
+    """ETag fuerte a partir de la versión del catálogo (y del índice de disponibilidad) y la consulta."""
+    return '"' + hashlib.sha1(f"{catalogo.huella}|{version}|{llave!r}".encode()).hexdigest() + '"'
+
+RESPUESTAS_ESTACIONES = CacheRespuestas(int(SMN_ESTACIONES_CACHE_MB * 1024 * 1024))
+
+def respuesta_estaciones(catalogo, version, llave):
     """
-    Convierte un TXT diario del SMN en CSV estructurado.
-    Extrae metadatos (emisión, coordenadas, etc.) y detecta encabezados FECHA y unidades.
+    Cuerpo serializado de una consulta. El catálogo es inmutable, así que se
+    guarda por su huella (no por el objeto, que se reemplaza al recargar).
     """
-    emision = ""
-    for l in lines[:60]:
-        # Buscar línea tipo "EMISIÓN : 19/09/2025"
-        m = re.search(r'EMISI[ÓO]N\s*:?\s*(\d{2}/\d{2}/\d{4})', l, flags=re.IGNORECASE)
-        if m:
-            emision = m.group(1)
-            break
-
-    csv_buffer = io.StringIO()
-    writer = csv.writer(csv_buffer, delimiter=",")
-
-    # ---- Metadatos ----
-    writer.writerow(["REGISTRO DIARIO HISTÓRICO", ""])
-    writer.writerow(["EMISIÓN", emision])
-    writer.writerow(["ESTACIÓN", est.get("clave", "") or ""])
-    writer.writerow(["NOMBRE", (est.get("nombre", "") or "").strip()])
-    writer.writerow(["ESTADO", est.get("estado", "") or ""])
-    writer.writerow(["MUNICIPIO", est.get("municipio", "") or ""])
-    writer.writerow(["SITUACIÓN", est.get("situacion", "") or ""])
-    writer.writerow(["CVE-OMM", ""])
-    writer.writerow(["LATITUD", f"{est.get('lat','') or ''} °".strip()])
-    writer.writerow(["LONGITUD", f"{est.get('lon','') or ''} °".strip()])
-    writer.writerow(["ALTITUD", f"{est.get('alt','') or ''} msnm".strip()])
-    writer.writerow([])
-    # ---- Fin metadatos ----
-
-    # ---- Procesar datos tabulares ----
-    i = 0
-    wrote_header = False
-    while i < len(lines):
-        raw = lines[i]
-        line = raw.strip()
-
-        # Detectar encabezado "FECHA ..."
-        if not wrote_header and re.match(r'^\s*FECHA\b', line, flags=re.IGNORECASE):
-            header_cols = re.findall(r'\S+', lines[i])
-
-            # Detectar unidades en la siguiente línea (si existen)
-            units = []
-            if i + 1 < len(lines):
-                units = re.findall(r'\(([^)]*)\)', lines[i + 1])
-
-            header_final = []
-            for idx, col in enumerate(header_cols):
-                if idx == 0 and col.upper().startswith("FECHA"):
-                    header_final.append(col)
-                else:
-                    unit_idx = idx - 1
-                    unit = units[unit_idx].strip() if unit_idx < len(units) else ""
-                    header_final.append(col if not unit else f"{col} ({unit})")
-
-            writer.writerow(header_final)
-            wrote_header = True
-            i += 2 if units else 1
-            continue
-
-        # Escribir filas con datos
-        if wrote_header and line != "":
-            writer.writerow(re.findall(r'\S+', lines[i]))
-
-        i += 1
-
-    return csv_buffer.getvalue()
+    return RESPUESTAS_ESTACIONES.obtener(
+        (catalogo.huella, version, llave), lambda: armar_respuesta_estaciones(catalogo, version, llave)
+    )
 
+def armar_respuesta_estaciones(catalogo, version, llave):
+    filtros, disponibilidad, campos, inicio, limite = llave
+    filtradas = catalogo.filtrar(**dict(zip(FILTROS_ESTACIONES, filtros)))
+    if disponibilidad is not None:
+        # Filtros del índice de disponibilidad: solo pasan las estaciones ya revisadas que cumplen
+        filtradas = [e for e in filtradas if DISPONIBILIDAD.cumple(e.clave, *disponibilidad)]
+    pagina = filtradas[inicio:inicio + limite if limite else None]
+
+    contenido = {"total": len(filtradas), "estaciones": [e.to_dict(campos) for e in pagina]}
+    if disponibilidad is not None:
+        contenido["indice_disponibilidad"] = DISPONIBILIDAD.cobertura()
+    if limite or inicio:
+        fin = inicio + len(pagina)
+        contenido["siguiente"] = cursor_estaciones(catalogo, fin) if fin < len(filtradas) else None
+    return GeoJSONCacheado(json_bytes(contenido), len(pagina), etag_estaciones(catalogo, version, llave))
+
+@app.get("/api/estaciones")
+async def get_estaciones(
+    request: Request,
+    estado: str = Query(None),
+    municipio: str = Query(None),
+    clave: str = Query(None),
+    situacion: str = Query(None),
+    tipo_est: str = Query(None),
+    cuenca: str = Query(None),
+    has: str = Query(None, description="Tipos de datos que debe tener, separados por coma (p. ej. diarios,mensuales)"),
+    min_years: float = Query(None, ge=0, description="Años mínimos de historia en esos tipos"),
+    active_since: str = Query(None, description="Con datos desde esta fecha AAAA-MM-DD o año AAAA"),
+    fields: str = Query(None, description="Campos a incluir, separados por coma (p. ej. clave,nombre,lat,lon)"),
+    limit: int = Query(None, ge=1, le=10000, description="Estaciones por página"),
+    cursor: str = Query(None, description="Valor de 'siguiente' de la página anterior"),
+):
+    # La primera llamada lee el KML o el snapshot: fuera del event loop
+    catalogo = await en_hilo(CATALOGO.get)
+    campos = CAMPOS_ESTACION
+    if fields:
+        pedidos = {c.strip().lower() for c in fields.split(",") if c.strip()}
+        desconocidos = sorted(pedidos - set(CAMPOS_ESTACION))
+        if desconocidos:
+            return JSONResponse(
+                content={"error": f"Campos desconocidos: {', '.join(desconocidos)}; use {', '.join(CAMPOS_ESTACION)}"},
+                status_code=400,
+            )
+        campos = tuple(c for c in CAMPOS_ESTACION if c in pedidos)
+
+    disponibilidad = None
+    if has or min_years is not None or active_since:
+        tipos = [t.strip().lower() for t in (has or "diarios").split(",") if t.strip()]
+        invalidos = [t for t in tipos if t not in TIPOS_DESCARGA]
+        if invalidos:
+            return JSONResponse(
+                content={"error": f"Tipos desconocidos: {', '.join(invalidos)}; use {', '.join(TIPOS_DESCARGA)}"},
+                status_code=400,
+            )
+        desde = None
+        if active_since:
+            try:
+                desde = datetime.strptime(active_since, "%Y" if len(active_since) == 4 else "%Y-%m-%d").date().isoformat()
+            except ValueError:
+                return JSONResponse(content={"error": "active_since debe ser AAAA-MM-DD o AAAA"}, status_code=400)
+        disponibilidad = (tuple(tipos), min_years, desde)
+
+    inicio = 0
+    if cursor:
+        inicio = leer_cursor(catalogo, cursor)
+        if inicio is None:
+            return JSONResponse(content={"error": "Cursor inválido o de otra versión del catálogo"}, status_code=400)
+
+    llave = ((estado, municipio, clave, situacion, tipo_est, cuenca), disponibilidad, campos, inicio, limit)
+    version = DISPONIBILIDAD.version if disponibilidad is not None else 0
+    etag = etag_estaciones(catalogo, version, llave)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={SMN_ESTACIONES_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+    }
+    # 304 sin armar la respuesta: el ETag sale de la versión y la consulta
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    encoding = elegir_encoding(request.headers.get("accept-encoding"))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    cuerpo = await en_hilo(lambda: respuesta_estaciones(catalogo, version, llave).variante(encoding))
+    return Response(content=cuerpo, media_type="application/json", headers=headers)
+
+@app.get("/api/disponibilidad")
+def get_disponibilidad(clave: str = Query(..., description="Clave de la estación")):
+    estaciones = CATALOGO.get().filtrar(clave=clave)
+    if not estaciones:
+        return JSONResponse(content={"error": "Estación no encontrada"}, status_code=404)
+    return {"clave": estaciones[0].clave, "disponibilidad": DISPONIBILIDAD.de_estacion(estaciones[0].clave)}
 
 # ----------------------- GeoJSON -----------------------
-BASE_DIR = Path(__file__).resolve().parent
+def cargar_gdf(nombre, shp):
+    """Polígonos en EPSG:4326, desde el snapshot si está vigente."""
+    gdf = SNAPSHOT.gdf(nombre)
+    if gdf is None:
+        gdf = gpd.read_file(shp).to_crs(epsg=4326)
+    return gdf
+
+def cargar_atributos(nombre, perezoso):
+    """Columnas sin la geometría: del snapshot sin decodificar el WKB, o del GeoDataFrame."""
+    atributos = SNAPSHOT.atributos(nombre)
+    if atributos is None:
+        gdf = perezoso.get()
+        atributos = gdf.drop(columns=gdf.geometry.name)
+    return atributos
+
+GDF_ESTADOS = Perezoso(lambda: cargar_gdf("estados", BASE_DIR / "data" / "Estados" / "Estados.shp"))
+GDF_MUNICIPIOS = Perezoso(lambda: cargar_gdf("municipios", BASE_DIR / "data" / "Municipios" / "Municipios.shp"))
+ATRIBUTOS_ESTADOS = Perezoso(lambda: cargar_atributos("estados", GDF_ESTADOS))
+ATRIBUTOS_MUNICIPIOS = Perezoso(lambda: cargar_atributos("municipios", GDF_MUNICIPIOS))
+GEOJSON = Perezoso(lambda: GeoJSONCache(
+    GDF_ESTADOS.get(),
+    GDF_MUNICIPIOS.get(),
+    features={
+        "estados": SNAPSHOT.geojson_features("estados"),
+        "municipios": SNAPSHOT.geojson_features("municipios"),
+    },
+))
+
+def responder_geojson(request, cacheado):
+    """Sirve bytes ya serializados; 304 si el ETag coincide, comprimido si el cliente lo acepta."""
+    headers = {
+        "ETag": cacheado.etag,
+        "Cache-Control": "public, max-age=3600",
+        "Vary": "Accept-Encoding",
+    }
+    if cacheado.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    encoding = elegir_encoding(request.headers.get("accept-encoding"))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=cacheado.variante(encoding), media_type="application/json", headers=headers)
 
-gdf_estados = gpd.read_file(BASE_DIR / "data" / "Estados" / "Estados.shp")
-gdf_municipios = gpd.read_file(BASE_DIR / "data" / "Municipios" / "Municipios.shp")
 # ---------------------- GEOJSON ESTADOS ----------------------
 @app.get("/api/estados_geojson")
-def get_estados_geojson(estado: str = Query("TODOS")):
-    print(f"[DEBUG] /api/estados_geojson → estado recibido: {estado}")
-
-    if estado and estado.upper() != "TODOS":
-        subset = gdf_estados[gdf_estados["NOMGEO"].str.upper().str.contains(estado.upper())]
-        print(f"[DEBUG] Estados filtrados: {len(subset)}")
-    else:
-        subset = gdf_estados
-        print(f"[DEBUG] Todos los estados: {len(subset)}")
-
-    # 🔁 Reproyectar a EPSG:4326
-    subset = subset.to_crs(epsg=4326)
-
-    return JSONResponse(content=json.loads(subset.to_json()))
+async def get_estados_geojson(
+    request: Request,
+    estado: str = Query("TODOS"),
+    zoom: int = Query(None, ge=0, le=22),
+    tolerance: float = Query(None, ge=0, description="Tolerancia de simplificación en grados"),
+    precision: int = Query(None, ge=0, le=10, description="Decimales de las coordenadas")
+):
+    log.debug("/api/estados_geojson", extra={"estado": estado})
+    nivel = nivel_detalle(zoom, tolerance, precision)
+    cacheado = await en_hilo(lambda: GEOJSON.get().estados_geojson(estado, nivel))
+    return responder_geojson(request, cacheado)
 
 
 
 # ---------------------- GEOJSON MUNICIPIOS ----------------------
 @app.get("/api/municipios_geojson")
-def get_municipios_geojson(
+async def get_municipios_geojson(
+    request: Request,
     estado: str = Query("TODOS"),
-    municipio: str = Query("TODOS")
+    municipio: str = Query("TODOS"),
+    zoom: int = Query(None, ge=0, le=22),
+    tolerance: float = Query(None, ge=0, description="Tolerancia de simplificación en grados"),
+    precision: int = Query(None, ge=0, le=10, description="Decimales de las coordenadas")
 ):
-    print(f"[DEBUG] /api/municipios_geojson → estado: {estado}, municipio: {municipio}")
-
-    subset = gdf_municipios
-
-    if estado and estado.upper() != "TODOS":
-        match = gdf_estados[gdf_estados["NOMGEO"].str.upper().str.contains(estado.upper())]
-        if not match.empty:
-            cve_ent = match.iloc[0]["CVE_ENT"]
-            subset = subset[subset["CVE_ENT"] == cve_ent]
-            print(f"[DEBUG] Filtrado por estado {estado} → código {cve_ent}, municipios: {len(subset)}")
-        else:
-            print(f"[DEBUG] Estado {estado} no encontrado en shapefile")
-            subset = subset.iloc[0:0]
+    log.debug("/api/municipios_geojson", extra={"estado": estado, "municipio": municipio})
+    nivel = nivel_detalle(zoom, tolerance, precision)
+    cacheado = await en_hilo(lambda: GEOJSON.get().municipios_geojson(estado, municipio, nivel))
+    return responder_geojson(request, cacheado)
+
+
+# ---------------------- TESELAS VECTORIALES ----------------------
+TESELAS = Perezoso(lambda: TeselasVectoriales({
+    "estados": CapaVectorial.desde_gdf(GDF_ESTADOS.get()),
+    "municipios": CapaVectorial.desde_gdf(GDF_MUNICIPIOS.get()),
+    "estaciones": CapaVectorial.desde_estaciones(CATALOGO.get()),
+}))
+
+@app.get("/api/tiles/{layer}/{z}/{x}/{y}.mvt")
+def get_tile(layer: str, z: int, x: int, y: int):
+    teselas = TESELAS.get()
+    if layer not in teselas.capas:
+        return JSONResponse(content={"error": f"Capa no encontrada: {layer}"}, status_code=404)
+    if not (0 <= z <= ZOOM_MAX and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return JSONResponse(content={"error": "Tesela fuera de rango"}, status_code=404)
+
+    data = teselas.tesela(layer, z, x, y)
+    headers = {"Cache-Control": "public, max-age=86400"}
+    if not data:
+        return Response(status_code=204, headers=headers)
+    return Response(content=data, media_type="application/vnd.mapbox-vector-tile", headers=headers)
+
+
+# ---------------------- CONSULTAS ESPACIALES ----------------------
+INDICE_ESPACIAL = Perezoso(lambda: IndiceEspacial(CATALOGO.get(), ATRIBUTOS_ESTADOS.get(), GDF_MUNICIPIOS.get()))
+
+def respuesta_espacial(resultado):
+    estaciones = []
+    for est, distancia in resultado:
+        d = est.to_dict()
+        if distancia is not None:
+            d["distancia_km"] = round(distancia, 3)
+        estaciones.append(d)
+    return {"total": len(estaciones), "estaciones": estaciones}
+
+@app.get("/api/estaciones/bbox")
+def get_estaciones_bbox(
+    min_lon: float = Query(..., ge=-180, le=180),
+    min_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90)
+):
+    return respuesta_espacial(INDICE_ESPACIAL.get().en_bbox(min_lon, min_lat, max_lon, max_lat))
 
-    if municipio and municipio.upper() != "TODOS":
-        subset = subset[subset["NOMGEO"].str.upper().str.contains(municipio.upper())]
-        print(f"[DEBUG] Municipios después de filtrar municipio: {len(subset)}")
+@app.get("/api/estaciones/radio")
+def get_estaciones_radio(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    km: float = Query(..., gt=0, le=5000)
+):
+    return respuesta_espacial(INDICE_ESPACIAL.get().en_radio(lat, lon, km))
 
-    # 🔁 Reproyectar a EPSG:4326
-    subset = subset.to_crs(epsg=4326)
+@app.get("/api/estaciones/cercanas")
+def get_estaciones_cercanas(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(10, ge=1, le=500)
+):
+    return respuesta_espacial(INDICE_ESPACIAL.get().cercanas(lat, lon, k))
 
-    print(f"[DEBUG] Municipios devueltos OK: {len(subset)}")
-    return JSONResponse(content=json.loads(subset.to_json()))
+@app.get("/api/estaciones/municipio")
+def get_estaciones_municipio(
+    estado: str = Query(None),
+    municipio: str = Query(None),
+    cve_ent: str = Query(None),
+    cve_mun: str = Query(None)
+):
+    if not (municipio or cve_mun):
+        return JSONResponse(content={"error": "Indique municipio o cve_mun"}, status_code=400)
+    posiciones = INDICE_ESPACIAL.get().buscar_municipios(estado, municipio, cve_ent, cve_mun)
+    if len(posiciones) == 0:
+        return JSONResponse(content={"error": "Municipio no encontrado en shapefile"}, status_code=404)
+    return respuesta_espacial(INDICE_ESPACIAL.get().en_municipios(posiciones))
 
 
 # ----------------------- DEBUG EXTRA -----------------------
 @app.get("/api/debug_estados")
 def debug_estados():
-    estados = sorted(gdf_estados["NOMGEO"].unique().tolist())
-    print(f"[DEBUG] Total estados en shapefile: {len(estados)}")
+    estados = sorted(ATRIBUTOS_ESTADOS.get()["NOMGEO"].unique().tolist())
+    log.debug("Total estados en shapefile: %d", len(estados))
     return {"total": len(estados), "estados": estados}
 
 @app.get("/api/debug_municipios_all")
 def debug_municipios_all():
-    municipios = sorted(gdf_municipios["NOMGEO"].unique().tolist())
-    print(f"[DEBUG] Total municipios en shapefile: {len(municipios)}")
+    municipios = sorted(ATRIBUTOS_MUNICIPIOS.get()["NOMGEO"].unique().tolist())
+    log.debug("Total municipios en shapefile: %d", len(municipios))
     return {"total": len(municipios), "ejemplo": municipios[:50]}
 
 @app.get("/api/debug_municipios_por_estado")
 def debug_municipios_por_estado():
-    counts = gdf_municipios.groupby("CVE_ENT")["NOMGEO"].count().to_dict()
+    counts = ATRIBUTOS_MUNICIPIOS.get().groupby("CVE_ENT")["NOMGEO"].count().to_dict()
     return counts
 @app.get("/api/debug_total_municipios")
 def debug_total_municipios():
-    return {"total": int(gdf_municipios.shape[0])}
+    return {"total": int(ATRIBUTOS_MUNICIPIOS.get().shape[0])}
 
 # ---------------------- DESCARGA CSV/ZIP ----------------------
+CLIENTE_SMN = ClienteSMN()
+CACHE_SMN = CacheSMN()
+ESPEJO = Espejo()
+
+# Descargas y conversiones idénticas en curso se comparten entre peticiones
+VUELOS_SMN = VueloUnico()
+
+# Tiempos por etapa; también van a Server-Timing si la petición lo pidió
+DESCARGAS_SMN = REGISTRO.histograma(
+    "smn_descarga_segundos", "Obtención de un TXT del SMN por tipo y origen (X-Cache)", ("tipo", "cache")
+)
+PARSEO = REGISTRO.histograma("smn_parseo_segundos", "Parseo de un TXT en el pool de procesos", ("tipo",))
+SERIALIZACION = REGISTRO.histograma(
+    "smn_serializacion_segundos", "Conversión de un archivo a CSV, Parquet o Arrow, o su compresión en el ZIP",
+    ("formato",),
+)
+
+def meta_estacion(est):
+    """Lo que los parsers necesitan de la estación, como dict simple para el pool de procesos."""
+    return {k: est.get(k) for k in CAMPOS_META_DIARIOS}
+
+def obtener_txt(est, tipo, origen=None):
+    """
+    TXT de (estación, tipo) a través de la caché, una sola descarga por URL a la vez.
+    origen (por omisión SMN_ORIGEN): red, espejo (solo el espejo local de
+    sync_smn.py) o auto (el espejo si tiene el archivo y si no la red).
+    """
+    url = est.get(tipo)
+    if (origen or SMN_ORIGEN) != "red":
+        with etapa("espejo", DESCARGAS_SMN, tipo=tipo, cache="ESPEJO"):
+            resp = ESPEJO.obtener(est.get("clave"), tipo, url)
+        if resp.ok or (origen or SMN_ORIGEN) == "espejo":
+            return resp
+    return VUELOS_SMN.hacer(("txt", url), lambda: _obtener_txt(est, tipo, url))
+
+def _obtener_txt(est, tipo, url):
+    with etapa("smn", DESCARGAS_SMN, tipo=tipo) as etiquetas:
+        resp = CACHE_SMN.obtener_txt(est.get("clave"), tipo, url, CLIENTE_SMN)
+        etiquetas["cache"] = resp.headers.get("X-Cache", "ERROR")
+    return resp
+
+def parsear_en_pool(tipo, texto, est):
+    with etapa("parseo", PARSEO, tipo=tipo):
+        return POOL_PARSEO.ejecutar(parsear_texto, tipo, texto, meta_estacion(est))
+
+def procesar_archivo(est, tipo, formato="csv", origen=None, estricto=False):
+    """
+    Descarga (o lee del espejo) y parsea un archivo; regresa (nombre, bytes) o
+    None si no hay datos. Con `estricto` un error pasajero (de red, 429, 5xx)
+    lanza RuntimeError en lugar de regresar None.
+    """
+    return VUELOS_SMN.hacer(
+        ("archivo", est.get("clave"), tipo, formato, origen, estricto),
+        lambda: _procesar_archivo(est, tipo, formato, origen, estricto),
+    )
+
+def _procesar_archivo(est, tipo, formato, origen=None, estricto=False):
+    url = est.get(tipo)
+    resp = obtener_txt(est, tipo, origen)
+    DISPONIBILIDAD.observar(est.get("clave"), tipo, resp)
+    if estricto and (resp.error or resp.status not in (200, *STATUS_AUSENTE)):
+        raise RuntimeError(resp.error or f"HTTP {resp.status}")
+    if resp.error:
+        log.warning("Error al acceder a URL", extra={"url": url, "error": resp.error})
+        return None
+
+    if resp.status != 200 or not resp.text.strip():
+        log.warning("Archivo no disponible", extra={"clave": est.get("clave"), "tipo": tipo})
+        return None
+
+    if len(resp.text.splitlines()) < 5:
+        log.warning("Archivo vacío o incorrecto", extra={"url": url})
+        return None
+
+    variante = "|".join(est.get(k) or "" for k in CAMPOS_META_DIARIOS) if tipo == "diarios" else ""
+    csv_content = CACHE_SMN.obtener_csv(tipo, resp.text, lambda: parsear_en_pool(tipo, resp.text, est), variante)
+    extension = FORMATOS[formato][0]
+    nombre = f"{(est.get('municipio') or 'MUNICIPIO').replace(' ', '_')}_{est.get('clave')}_{tipo}{extension}"
+    if formato == "csv":
+        with etapa("serializacion", SERIALIZACION, formato="csv"):
+            return nombre, csv_content.encode("utf-8-sig")
+
+    def serializar():
+        with etapa("serializacion", SERIALIZACION, formato=formato):
+            return POOL_PARSEO.ejecutar(
+                serializar_columnar, csv_content, formato, tipo=tipo, clave=est.get("clave") or ""
+            )
+    return nombre, CACHE_SMN.obtener_binario(tipo, resp.text, serializar, f"{variante}|{formato}")
+
+TIPOS_DESCARGA = ["diarios", "mensuales", "normales_1961_1990",
+                  "normales_1971_2000", "normales_1981_2010", "normales_1991_2020",
+                  "extremos"]
+
+# Qué (estación, tipo) tienen datos, para filtrar estaciones y planear descargas
+# Los recorridos de fondo piden al SMN con su propio límite (SMN_MAX_RPS_FONDO)
+DISPONIBILIDAD = IndiceDisponibilidad(
+    lambda: CATALOGO.get(),
+    en_segundo_plano(obtener_txt),
+    lambda tipo, texto: POOL_PARSEO.ejecutar(resumen_disponibilidad, tipo, texto),
+    TIPOS_DESCARGA,
+)
+
+def estaciones_descarga(estado, municipio, clave, situacion):
+    return CATALOGO.get().filtrar(
+        estado=estado if estado != "TODOS" else None,
+        municipio=municipio if municipio != "TODOS" else None,
+        clave=clave if clave != "TODAS" else None,
+        situacion=situacion if situacion and situacion.upper() != "TODAS" else None
+    )
+
+def tareas_descarga(estaciones, data):
+    """
+    (estación, tipo) de cada archivo a descargar: los que tienen URL, menos los
+    que el índice de disponibilidad sabe que no tienen datos.
+    """
+    data_keys = TIPOS_DESCARGA if data.upper() == "TODOS" else [data.lower()]
+    return [
+        (est, tipo) for est in estaciones for tipo in data_keys
+        if (est.get(tipo) or "").strip() and not DISPONIBILIDAD.sin_datos(est.get("clave"), tipo)
+    ]
+
+# ---------------------- ADMISIÓN ----------------------
+# El costo de una petición es el número de archivos del SMN que implica
+LIMITE_CLIENTES = LimitadorClientes()
+CUPO_DESCARGAS = CupoDescargas()
+ADMISION = REGISTRO.contador(
+    "smn_admision_total", "Decisiones del control de admisión por ruta", ("ruta", "resultado")
+)
+REGISTRO.medidor("smn_descargas", "Descargas caras en curso y en espera", ("estado",),
+                 funcion=lambda: {(k,): v for k, v in CUPO_DESCARGAS.estado().items()})
+
+def rechazo_cliente(request, ruta, costo):
+    """None si el cliente tiene cupo para `costo` archivos; si no, la respuesta 429 con Retry-After."""
+    espera = LIMITE_CLIENTES.admitir(cliente_de(request), costo)
+    if espera <= 0:
+        return None
+    ADMISION.inc(ruta=ruta, resultado="limite_cliente")
+    log.info("Petición rechazada por límite del cliente", extra={"cliente": cliente_de(request), "ruta": ruta, "costo": costo})
+    return JSONResponse(
+        content={"error": "Demasiadas descargas desde este cliente, intente más tarde", "costo": costo},
+        status_code=429, headers={"Retry-After": str(math.ceil(espera))},
+    )
+
+def rechazo_cupo(ruta, reintentar):
+    ADMISION.inc(ruta=ruta, resultado="cupo_lleno")
+    return JSONResponse(
+        content={"error": "El servidor está ocupado con otras descargas, intente más tarde"},
+        status_code=503, headers={"Retry-After": str(reintentar)},
+    )
+
+async def liberar_al_final(flujo, liberar):
+    """Reenvía un flujo asíncrono y libera el cupo cuando termina (o se corta)."""
+    try:
+        async for parte in flujo:
+            yield parte
+    finally:
+        liberar()
+
+def nombre_descarga(estado, municipio, clave, data):
+    zip_name_parts = []
+    zip_name_parts.append((estado or "ESTADOS_TODOS").replace(" ", "_").upper())
+    zip_name_parts.append((municipio or "MUNICIPIOS_TODOS").replace(" ", "_").upper())
+    zip_name_parts.append((clave or "ESTACIONES_TODAS").replace(" ", "_").upper())
+    zip_name_parts.append(data.upper())
+    return "_".join(zip_name_parts)
+
 @app.get("/api/descargar_csv")
-def descargar_csv(
+async def descargar_csv(
+    request: Request,
     estado: str = Query(None),
     municipio: str = Query(None),
     clave: str = Query(None),
     data: str = Query("DIARIOS"),
-    situacion: str = Query(None)
+    situacion: str = Query(None),
+    formato: str = Query("csv", alias="format", description="csv | parquet | arrow"),
+    origen: str = Query(None, description="red | espejo | auto (por omisión SMN_ORIGEN)"),
 ):
-    estaciones = ESTACIONES
-    if estado and estado != "TODOS":
-        estaciones = [e for e in estaciones if e["estado"] and e["estado"].lower() == estado.lower()]
-    if municipio and municipio != "TODOS":
-        estaciones = [e for e in estaciones if e["municipio"] and e["municipio"].lower() == municipio.lower()]
-    if clave and clave != "TODAS":
-        estaciones = [e for e in estaciones if e["clave"] == clave]
-    if situacion and situacion.upper() != "TODAS":
-        estaciones = [e for e in estaciones if e["situacion"] and e["situacion"].upper() == situacion.upper()]
-
+    formato = formato.lower()
+    if formato not in FORMATOS:
+        return JSONResponse(content={"error": "format debe ser csv, parquet o arrow"}, status_code=400)
+    origen = origen.lower() if origen else None
+    if origen is not None and origen not in ORIGENES:
+        return JSONResponse(content={"error": f"origen debe ser uno de {', '.join(ORIGENES)}"}, status_code=400)
+
+    estaciones = await en_hilo(estaciones_descarga, estado, municipio, clave, situacion)
     if not estaciones:
         return JSONResponse(content={"error": "No se encontraron estaciones"}, status_code=404)
 
-    tipos = ["diarios", "mensuales", "normales_1961_1990",
-             "normales_1971_2000", "normales_1981_2010", "normales_1991_2020",
-             "extremos"]
-    data_keys = tipos if data.upper() == "TODOS" else [data.lower()]
-
-    archivos = []
-    estaciones_validas = []  # para guardar solo las que tengan datos del tipo solicitado
-
-    for est in estaciones:
-        tiene_dato = False  # bandera para ver si la estación tiene al menos un tipo válido
-
-        for tipo in data_keys:
-            url = est.get(tipo)
-            if not url or url.strip() == "":
-                # No tiene este tipo de dato → saltar
-                continue
-
-            # Intentar obtener el archivo remoto
-            try:
-                resp = requests.get(url, timeout=30)
-            except Exception as ex:
-                print(f"[WARN] Error al acceder a URL {url}: {ex}")
-                continue
+    # Solo se piden las URLs que existen; las descargas van en paralelo
+    tareas = tareas_descarga(estaciones, data)
+    if not tareas:
+        return JSONResponse(content={"error": "No se encontro el tipo de dato solicitado."}, status_code=404)
 
-            if resp.status_code != 200 or not resp.text.strip():
-                print(f"[WARN] Archivo no disponible para {est.get('clave')} tipo {tipo}")
-                continue
-
-            lines = resp.text.splitlines()
-            if len(lines) < 5:
-                print(f"[WARN] Archivo vacío o incorrecto en {url}")
+    # Admisión antes de cualquier descarga: cupo del cliente y lugar entre las descargas en curso
+    rechazo = rechazo_cliente(request, "descargar_csv", len(tareas))
+    if rechazo is not None:
+        return rechazo
+    try:
+        liberar = await CUPO_DESCARGAS.entrar()
+    except CupoLleno as ex:
+        LIMITE_CLIENTES.devolver(cliente_de(request), len(tareas))
+        return rechazo_cupo("descargar_csv", ex.reintentar)
+    ADMISION.inc(ruta="descargar_csv", resultado="admitida")
+    try:
+        return await _descargar(tareas, formato, origen, nombre_descarga(estado, municipio, clave, data), liberar)
+    except BaseException:
+        liberar()
+        raise
+
+async def _descargar(tareas, formato, origen, base_filename, liberar):
+    def archivos_validos():
+        procesar = propagar(lambda t: procesar_archivo(*t, formato, origen))
+        for (est, tipo), archivo, error in CLIENTE_SMN.mapear(procesar, tareas):
+            if error is not None:
+                log.warning("Error al procesar archivo", extra={"clave": est.get("clave"), "tipo": tipo, "error": str(error)})
                 continue
+            if archivo is not None:
+                yield archivo
 
-            # Si llegamos aquí, la estación sí tiene datos de ese tipo
-            tiene_dato = True
-
-            # Parsear según tipo
-            if tipo == "mensuales":
-                csv_content = parse_mensual_txt(lines)
-            elif tipo.startswith("normales"):
-                periodo = tipo.split("_")[-1]
-                csv_content = parse_normales_txt(lines, periodo)
-            elif tipo == "extremos":
-                csv_content = parse_extremos_txt_fixed(lines)
-            elif tipo == "diarios":
-                csv_content = parse_diarios_txt(lines, est)
-            else:
-                # fallback: guardar texto crudo como CSV simple
-                csv_content = "\n".join(lines)
-
-            archivos.append((
-                f"{(est.get('municipio') or 'MUNICIPIO').replace(' ', '_')}_{est.get('clave')}_{tipo}.csv",
-                csv_content
-            ))
-
-        if tiene_dato:
-            estaciones_validas.append(est)
+    # Se esperan solo los dos primeros archivos válidos: bastan para saber si hay
+    # que responder 404, un CSV suelto o un ZIP. El resto se procesa mientras se envía.
+    archivos = archivos_validos()
+    primeros = await en_hilo(lambda: list(itertools.islice(archivos, 2)), limitador=LIMITE_DESCARGAS)
 
     # Si ninguna estación tuvo datos válidos
-    if not estaciones_validas or not archivos:
+    if not primeros:
+        liberar()
         return JSONResponse(
             content={"error": "No se encontro el tipo de dato solicitado."},
             status_code=404
         )
 
+    if len(primeros) == 1:
+        liberar()
+        filename, content = primeros[0]
+        extension, media_type = FORMATOS[formato]
+        return StreamingResponse(
+            iter([content]),
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename={base_filename}{extension}"}
+        )
 
+    # Los archivos entran al ZIP en el orden en que terminan de descargarse.
+    # Parquet/Arrow ya van comprimidos con zstd: se guardan sin volver a comprimir.
+    zip_filename = base_filename + ".zip"
+    return StreamingResponse(
+        liberar_al_final(en_flujo(zip_en_flujo(
+            itertools.chain(primeros, archivos),
+            zipfile.ZIP_DEFLATED if formato == "csv" else zipfile.ZIP_STORED,
+            medir=lambda: etapa("zip", SERIALIZACION, formato="zip"),
+        ), limitador=LIMITE_DESCARGAS), liberar),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={zip_filename}"},
+        # Por si el cliente se desconecta antes de que empiece el flujo
+        background=BackgroundTask(liberar),
+    )
 
+# ---------------------- EXPORTACIONES EN SEGUNDO PLANO ----------------------
+def planificar_exportacion(parametros):
+    estaciones = estaciones_descarga(
+        parametros["estado"], parametros["municipio"], parametros["clave"], parametros["situacion"]
+    )
+    return tareas_descarga(estaciones, parametros["data"])
+
+def procesar_exportacion(est, tipo, formato="csv"):
+    """procesar_archivo para los trabajos: un error pasajero va a fallidas (se reintenta), no a 'sin datos'."""
+    return procesar_archivo(est, tipo, formato, estricto=True)
+
+EXPORTACIONES = GestorExportaciones(planificar_exportacion, procesar_exportacion, CLIENTE_SMN.mapear)
+REGISTRO.medidor(
+    "smn_exportaciones", "Exportaciones en segundo plano por estado", ("estado",), funcion=EXPORTACIONES.por_estado
+)
+
+def respuesta_trabajo(trabajo, status_code=200):
+    progreso = trabajo.progreso()
+    if trabajo.estado == TERMINADO:
+        progreso["descarga"] = f"/api/exportaciones/{trabajo.id}/descarga"
+    return JSONResponse(content=progreso, status_code=status_code)
+
+@app.post("/api/exportaciones")
+def post_exportacion(
+    request: Request,
+    estado: str = Query(None),
+    municipio: str = Query(None),
+    clave: str = Query(None),
+    data: str = Query("DIARIOS"),
+    situacion: str = Query(None),
+    formato: str = Query("csv", alias="format", description="csv | parquet | arrow")
+):
+    """Encola una exportación con los mismos filtros que /api/descargar_csv."""
+    formato = formato.lower()
+    if formato not in FORMATOS:
+        return JSONResponse(content={"error": "format debe ser csv, parquet o arrow"}, status_code=400)
+    parametros = {
+        "estado": estado, "municipio": municipio, "clave": clave,
+        "data": data.upper(), "situacion": situacion, "formato": formato,
+    }
+    if not estaciones_descarga(estado, municipio, clave, situacion):
+        return JSONResponse(content={"error": "No se encontraron estaciones"}, status_code=404)
+    costo = len(planificar_exportacion(parametros))
+    rechazo = rechazo_cliente(request, "exportaciones", costo)
+    if rechazo is not None:
+        return rechazo
+    try:
+        trabajo = EXPORTACIONES.enviar(parametros)
+    except ColaLlena:
+        LIMITE_CLIENTES.devolver(cliente_de(request), costo)
+        ADMISION.inc(ruta="exportaciones", resultado="cupo_lleno")
+        return JSONResponse(
+            content={"error": "Hay demasiadas exportaciones pendientes"},
+            status_code=503, headers={"Retry-After": "60"},
+        )
+    ADMISION.inc(ruta="exportaciones", resultado="admitida")
+    return respuesta_trabajo(trabajo, status_code=202)
+
+@app.get("/api/exportaciones/{id}")
+def get_exportacion(id: str):
+    trabajo = EXPORTACIONES.obtener(id)
+    if trabajo is None:
+        return JSONResponse(content={"error": "Exportación no encontrada"}, status_code=404)
+    return respuesta_trabajo(trabajo)
+
+@app.get("/api/exportaciones/{id}/descarga")
+def get_exportacion_descarga(id: str):
+    trabajo = EXPORTACIONES.obtener(id)
+    if trabajo is None:
+        return JSONResponse(content={"error": "Exportación no encontrada"}, status_code=404)
+    if trabajo.estado != TERMINADO or not trabajo.resultado.exists():
+        return JSONResponse(content={"error": "La exportación no ha terminado", **trabajo.progreso()}, status_code=409)
+    p = trabajo.parametros
+    return FileResponse(
+        trabajo.resultado,
+        media_type="application/zip",
+        filename=nombre_descarga(p["estado"], p["municipio"], p["clave"], p["data"]) + ".zip",
+    )
 
-    zip_name_parts = []
-    zip_name_parts.append((estado or "ESTADOS_TODOS").replace(" ", "_").upper())
-    zip_name_parts.append((municipio or "MUNICIPIOS_TODOS").replace(" ", "_").upper())
-    zip_name_parts.append((clave or "ESTACIONES_TODAS").replace(" ", "_").upper())
-    zip_name_parts.append(data.upper())
-    base_filename = "_".join(zip_name_parts)
+# ---------------------- SERIES DIARIAS ----------------------
+ALMACEN_SERIES = AlmacenSeries()
+SMN_SERIES_MAX_CLAVES = int(os.getenv("SMN_SERIES_MAX_CLAVES", "50"))
+
+def serie_diaria(est):
+    """Serie diaria tipada de la estación; solo descarga y parsea si el TXT cambió."""
+    return VUELOS_SMN.hacer(("serie", est.get("clave")), lambda: _serie_diaria(est))
+
+def _serie_diaria(est):
+    clave = est.get("clave")
+    sha = CACHE_SMN.sha_vigente(clave, "diarios")
+    if sha:
+        serie = ALMACEN_SERIES.buscar(clave, sha)
+        if serie is not None:
+            return serie
+
+    resp = obtener_txt(est, "diarios")
+    DISPONIBILIDAD.observar(clave, "diarios", resp)
+    if not resp.ok or not resp.text.strip():
+        log.warning("Serie diaria no disponible", extra={"clave": clave, "error": resp.error or resp.status})
+        return None
+
+    sha = hashlib.sha256(resp.text.encode("utf-8")).hexdigest()
+    serie = ALMACEN_SERIES.buscar(clave, sha)
+    if serie is None:
+        with etapa("parseo", PARSEO, tipo="serie_diaria"):
+            df = POOL_PARSEO.ejecutar(diarios_tipados, resp.text, meta_estacion(est))
+        serie = ALMACEN_SERIES.guardar(clave, sha, df)
+    return serie
+
+def lista_json(valores):
+    """Arreglo numérico -> lista JSON con NaN como null."""
+    # float32 -> float64 redondeado para no arrastrar 21.299999237...
+    return [None if v != v else v for v in np.asarray(valores, dtype=np.float64).round(4).tolist()]
+
+def _fecha_query(valor):
+    return np.datetime64(valor, "D") if valor else None
+
+def series_solicitadas(clave):
+    """
+    (claves pedidas, {clave: SerieDiaria}) para un parámetro "c1,c2,...". Si la
+    petición no es válida el segundo elemento es la JSONResponse de error.
+    """
+    claves = list(dict.fromkeys(c.strip() for c in clave.split(",") if c.strip()))
+    if not claves or len(claves) > SMN_SERIES_MAX_CLAVES:
+        return claves, JSONResponse(
+            content={"error": f"Se requieren entre 1 y {SMN_SERIES_MAX_CLAVES} claves"}, status_code=400
+        )
 
-    if len(archivos) == 1:
-        filename, content = archivos[0]
-        csv_filename = base_filename + ".csv"
-        return StreamingResponse(
-            iter([content.encode("utf-8-sig")]),
-            media_type="text/csv; charset=utf-8",
-            headers={"Content-Disposition": f"attachment; filename={csv_filename}"}
+    catalogo = CATALOGO.get()
+    estaciones = []
+    for c in claves:
+        encontradas = [e for e in catalogo.filtrar(clave=c) if (e.get("diarios") or "").strip()]
+        if encontradas:
+            estaciones.append(encontradas[0])
+    if not estaciones:
+        return claves, JSONResponse(
+            content={"error": "No se encontraron estaciones con datos diarios"}, status_code=404
         )
 
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        for filename, content in archivos:
-            zf.writestr(filename, content.encode("utf-8-sig"))
+    series = {}
+    for est, serie, error in CLIENTE_SMN.mapear(propagar(serie_diaria), estaciones):
+        if error is not None:
+            log.warning("Error al obtener la serie", extra={"clave": est.get("clave"), "error": str(error)})
+        elif serie is not None:
+            series[est.get("clave")] = serie
+    return claves, series
+
+@app.get("/api/series")
+async def get_series(
+    request: Request,
+    clave: str = Query(..., description="Una o varias claves separadas por coma"),
+    variable: str = Query("tmax", description="precip | evap | tmax | tmin"),
+    inicio: str = Query(None, description="Fecha inicial AAAA-MM-DD (incluida)"),
+    fin: str = Query(None, description="Fecha final AAAA-MM-DD (incluida)"),
+    formato: str = Query("json", description="json | arrow"),
+):
+    variable = variable.lower()
+    if variable not in VARIABLES:
+        return JSONResponse(content={"error": f"variable debe ser una de {', '.join(VARIABLES)}"}, status_code=400)
+    formato = formato.lower()
+    if formato not in ("json", "arrow"):
+        return JSONResponse(content={"error": "formato debe ser json o arrow"}, status_code=400)
+    try:
+        desde, hasta = _fecha_query(inicio), _fecha_query(fin)
+    except ValueError:
+        return JSONResponse(content={"error": "Fechas inválidas, use AAAA-MM-DD"}, status_code=400)
 
-    zip_buffer.seek(0)
-    zip_filename = base_filename + ".zip"
-    return StreamingResponse(
-        zip_buffer,
-        media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename={zip_filename}"}
+    rechazo = rechazo_cliente(request, "series", len([c for c in clave.split(",") if c.strip()]))
+    if rechazo is not None:
+        return rechazo
+    claves, series = await en_hilo(series_solicitadas, clave, limitador=LIMITE_DESCARGAS)
+    if isinstance(series, JSONResponse):
+        return series
+
+    # Se responde en el orden en que se pidieron las claves
+    partes = [(c, *series[c].rango(variable, desde, hasta)) for c in claves if c in series]
+
+    if formato == "arrow":
+        return Response(
+            content=arrow_series(partes, variable),
+            media_type="application/vnd.apache.arrow.stream",
+        )
+    return {
+        "variable": variable,
+        "inicio": inicio,
+        "fin": fin,
+        "series": [
+            {
+                "clave": c,
+                "fechas": np.datetime_as_string(fechas, unit="D").tolist(),
+                "valores": lista_json(valores),
+            }
+            for c, fechas, valores in partes
+        ],
+        "sin_datos": [c for c in claves if c not in series],
+    }
+
+# ---------------------- AGREGADOS CLIMATOLÓGICOS ----------------------
+TIPOS_NORMALES = ("normales_1961_1990", "normales_1971_2000", "normales_1981_2010", "normales_1991_2020")
+
+def normales_estacion(est, tipo):
+    """{variable: 13 normales (ENE..DIC, ANUAL)} de la estación; {} si no hay archivo."""
+    url = (est.get(tipo) or "").strip()
+    if not url:
+        return {}
+    resp = obtener_txt(est, tipo)
+    if not resp.ok or not resp.text.strip():
+        return {}
+    # Misma llave de caché que descargar_csv: el CSV se reutiliza entre ambos
+    return normales_mensuales(CACHE_SMN.obtener_csv(
+        tipo, resp.text, lambda: POOL_PARSEO.ejecutar(parsear_texto, tipo, resp.text, meta_estacion(est))
+    ))
+
+@app.get("/api/agregados")
+async def get_agregados(
+    request: Request,
+    clave: str = Query(..., description="Una o varias claves separadas por coma"),
+    variable: str = Query("tmax", description="precip | evap | tmax | tmin"),
+    periodo: str = Query("mensual", description="mensual | anual"),
+    inicio: str = Query(None, description="Periodo inicial AAAA-MM o AAAA (incluido)"),
+    fin: str = Query(None, description="Periodo final AAAA-MM o AAAA (incluido)"),
+    anomalias: bool = Query(False, description="Agregar normal y anomalía de cada periodo"),
+    normales: str = Query("1991_2020", description="Periodo de normales para las anomalías"),
+):
+    variable = variable.lower()
+    if variable not in VARIABLES:
+        return JSONResponse(content={"error": f"variable debe ser una de {', '.join(VARIABLES)}"}, status_code=400)
+    periodo = periodo.lower()
+    if periodo not in PERIODOS:
+        return JSONResponse(content={"error": "periodo debe ser mensual o anual"}, status_code=400)
+    tipo_normales = f"normales_{normales}"
+    if tipo_normales not in TIPOS_NORMALES:
+        return JSONResponse(content={"error": f"normales no válidas: {normales}"}, status_code=400)
+    unidad = f"datetime64[{PERIODOS[periodo]}]"
+    try:
+        desde = np.datetime64(inicio).astype(unidad) if inicio else None
+        hasta = np.datetime64(fin).astype(unidad) if fin else None
+    except ValueError:
+        return JSONResponse(content={"error": "Periodos inválidos, use AAAA-MM o AAAA"}, status_code=400)
+
+    rechazo = rechazo_cliente(request, "agregados", len([c for c in clave.split(",") if c.strip()]))
+    if rechazo is not None:
+        return rechazo
+    claves, series = await en_hilo(series_solicitadas, clave, limitador=LIMITE_DESCARGAS)
+    if isinstance(series, JSONResponse):
+        return series
+    claves_con_datos = [c for c in claves if c in series]
+
+    def calcular():
+        resultados = agregar([series[c] for c in claves_con_datos], variable, periodo)
+        normales_por_clave = {}
+        if anomalias:
+            catalogo = CATALOGO.get()
+            estaciones = [catalogo.filtrar(clave=c)[0] for c in claves_con_datos]
+            for est, normal, error in CLIENTE_SMN.mapear(lambda e: normales_estacion(e, tipo_normales), estaciones):
+                if error is not None:
+                    log.warning("Error al obtener normales", extra={"clave": est.get("clave"), "error": str(error)})
+                elif variable in normal:
+                    normales_por_clave[est.get("clave")] = normal[variable]
+        return resultados, normales_por_clave
+
+    resultados, normales_por_clave = await en_hilo(calcular, limitador=LIMITE_DESCARGAS)
+
+    salida = []
+    for c, agregado in zip(claves_con_datos, resultados):
+        agregado = agregado.rango(desde, hasta)
+        fila = {"clave": c, "periodos": np.datetime_as_string(agregado.periodos).tolist()}
+        for nombre in ESTADISTICAS:
+            valores = getattr(agregado, nombre)
+            fila[nombre] = valores.tolist() if nombre.startswith("dias") else lista_json(valores)
+        if anomalias:
+            normal = normales_por_clave.get(c)
+            if normal is None:
+                fila["normal"] = fila["anomalia"] = fila["incompleto"] = None
+            else:
+                referencia, anomalia, incompleto = calcular_anomalias(agregado, variable, normal, periodo)
+                fila["normal"], fila["anomalia"] = lista_json(referencia), lista_json(anomalia)
+                fila["incompleto"] = incompleto.tolist()
+        salida.append(fila)
+
+    return {
+        "variable": variable,
+        "periodo": periodo,
+        "valor_anomalia": VALOR_NORMAL[variable] if anomalias else None,
+        "normales": normales if anomalias else None,
+        "agregados": salida,
+        "sin_datos": [c for c in claves if c not in series],
+    }
+
+# ---------------------- TABLA CLIMATOLÓGICA ----------------------
+def csv_climatologia(est, fuente):
+    """(sha del TXT, función que da su CSV) para la tabla climatológica; None si no hay datos."""
+    if DISPONIBILIDAD.sin_datos(est.get("clave"), fuente):
+        return None
+    resp = obtener_txt(est, fuente)
+    DISPONIBILIDAD.observar(est.get("clave"), fuente, resp)
+    if resp.error or resp.status not in (200, *STATUS_AUSENTE):
+        # Un error de red o del SMN (429, 5xx) no quita lo que ya estaba en la tabla
+        raise RuntimeError(resp.error or f"HTTP {resp.status}")
+    if resp.status != 200 or len(resp.text.splitlines()) < 5:
+        return None
+    sha = hashlib.sha256(resp.text.encode("utf-8")).hexdigest()
+    return sha, en_segundo_plano(
+        lambda: CACHE_SMN.obtener_csv(fuente, resp.text, lambda: parsear_en_pool(fuente, resp.text, est))
     )
+
+CLIMATOLOGIA = Climatologia(lambda: CATALOGO.get(), en_segundo_plano(csv_climatologia))
+
+def consulta_climatologia(tabla, fuente, variable, estadistica, mes):
+    """
+    Valida la consulta contra la tabla: regresa (fuente, variable, estadística,
+    columna del mes) o un JSONResponse 400 con lo que sí hay.
+    """
+    fuente = fuente.lower()
+    if fuente not in FUENTES_CLIMATOLOGIA and f"normales_{fuente}" in FUENTES_CLIMATOLOGIA:
+        fuente = f"normales_{fuente}"
+    if fuente not in FUENTES_CLIMATOLOGIA:
+        return JSONResponse(
+            content={"error": f"fuente debe ser una de {', '.join(FUENTES_CLIMATOLOGIA)}"}, status_code=400
+        )
+    nombre = tabla.resolver_variable(fuente, variable)
+    if nombre is None:
+        return JSONResponse(content={
+            "error": f"Variable sin datos en {fuente}: {variable}", "variables": tabla.grupos(fuente),
+        }, status_code=400)
+    estadisticas = tabla.grupos(fuente, nombre)
+    estadistica = (estadistica or ("maximo" if fuente == "extremos" else "normal")).lower()
+    if estadistica not in estadisticas:
+        return JSONResponse(content={
+            "error": f"Estadística sin datos para {nombre}: {estadistica}", "estadisticas": estadisticas,
+        }, status_code=400)
+    mes = mes.upper()
+    if mes not in MESES_CLIMATOLOGIA:
+        return JSONResponse(content={"error": f"mes debe ser uno de {', '.join(MESES_CLIMATOLOGIA)}"}, status_code=400)
+    return fuente, nombre, estadistica, MESES_CLIMATOLOGIA.index(mes)
+
+def mascara_climatologia(tabla, estado, municipio, cuenca, situacion):
+    """Estaciones de la tabla que pasan los filtros del catálogo."""
+    if not (estado or municipio or cuenca or situacion):
+        return tabla.mascara(None)
+    filtradas = CATALOGO.get().filtrar(estado=estado, municipio=municipio, cuenca=cuenca, situacion=situacion)
+    return tabla.mascara(e.clave for e in filtradas)
+
+def fila_climatologia(clave):
+    estaciones = CATALOGO.get().filtrar(clave=clave)
+    est = estaciones[0] if estaciones else None
+    return {"clave": clave, **{c: est.get(c) if est else None for c in ("nombre", "estado", "municipio", "lat", "lon")}}
+
+def _fecha_dias(dias):
+    return None if dias != dias else str(np.datetime64(int(dias), "D"))
+
+@app.get("/api/climatologia")
+def get_climatologia(
+    fuente: str = Query("normales_1991_2020", description="normales_AAAA_AAAA (o solo AAAA_AAAA) | extremos"),
+    variable: str = Query("tmax", description="tmax | tmin | tmed | precip | evap o el título normalizado de la tabla"),
+    estadistica: str = Query(None, description="Renglón de la tabla (normal, maxima_mensual, ...) o maximo | minimo | medio | desviacion | anios en extremos"),
+    mes: str = Query("ANUAL", description="ENE..DIC | ANUAL"),
+    estado: str = Query(None),
+    municipio: str = Query(None),
+    cuenca: str = Query(None),
+    situacion: str = Query(None),
+    mayor_que: float = Query(None, description="Solo valores mayores"),
+    menor_que: float = Query(None, description="Solo valores menores"),
+    orden: str = Query("desc", description="desc | asc"),
+    limite: int = Query(100, ge=1, le=10000),
+):
+    tabla = CLIMATOLOGIA.tabla()
+    consulta = consulta_climatologia(tabla, fuente, variable, estadistica, mes)
+    if isinstance(consulta, JSONResponse):
+        return consulta
+    fuente, variable, estadistica, columna = consulta
+
+    valores = tabla.por_estacion(fuente, variable, estadistica, columna)
+    posiciones, total = seleccionar(
+        valores, mascara_climatologia(tabla, estado, municipio, cuenca, situacion),
+        mayor_que, menor_que, orden.lower() != "asc", limite,
+    )
+    fechas = None
+    if fuente == "extremos" and estadistica in ("maximo", "minimo"):
+        fechas = tabla.por_estacion(fuente, variable, f"fecha_{estadistica}", columna)
+
+    estaciones = []
+    for posicion, valor in zip(posiciones, lista_json(valores[posiciones])):
+        fila = fila_climatologia(tabla.claves[posicion])
+        fila["valor"] = valor
+        if fechas is not None:
+            fila["fecha"] = _fecha_dias(fechas[posicion])
+        estaciones.append(fila)
+    return {
+        "fuente": fuente, "variable": variable, "estadistica": estadistica, "mes": MESES_CLIMATOLOGIA[columna],
+        "total": total, "estaciones": estaciones, "tabla": CLIMATOLOGIA.cobertura(),
+    }
+
+@app.get("/api/climatologia/comparar")
+def get_climatologia_comparar(
+    fuente_a: str = Query("normales_1981_2010"),
+    fuente_b: str = Query("normales_1991_2020"),
+    variable: str = Query("tmax"),
+    estadistica: str = Query(None),
+    mes: str = Query("ANUAL", description="ENE..DIC | ANUAL"),
+    estado: str = Query(None),
+    municipio: str = Query(None),
+    cuenca: str = Query(None),
+    situacion: str = Query(None),
+    mayor_que: float = Query(None, description="Solo diferencias (b - a) mayores"),
+    menor_que: float = Query(None, description="Solo diferencias (b - a) menores"),
+    orden: str = Query("desc", description="desc | asc"),
+    limite: int = Query(100, ge=1, le=10000),
+):
+    """Diferencia b - a por estación entre dos fuentes (p. ej. dos periodos de normales)."""
+    tabla = CLIMATOLOGIA.tabla()
+    consultas = [consulta_climatologia(tabla, f, variable, estadistica, mes) for f in (fuente_a, fuente_b)]
+    for consulta in consultas:
+        if isinstance(consulta, JSONResponse):
+            return consulta
+    a, b = (tabla.por_estacion(*consulta) for consulta in consultas)
+    diferencia = b - a
+
+    posiciones, total = seleccionar(
+        diferencia, mascara_climatologia(tabla, estado, municipio, cuenca, situacion),
+        mayor_que, menor_que, orden.lower() != "asc", limite,
+    )
+    columnas = zip(lista_json(a[posiciones]), lista_json(b[posiciones]), lista_json(diferencia[posiciones]))
+    estaciones = []
+    for posicion, (valor_a, valor_b, valor_dif) in zip(posiciones, columnas):
+        estaciones.append({**fila_climatologia(tabla.claves[posicion]), "a": valor_a, "b": valor_b, "diferencia": valor_dif})
+    return {
+        "a": dict(zip(("fuente", "variable", "estadistica"), consultas[0][:3])),
+        "b": dict(zip(("fuente", "variable", "estadistica"), consultas[1][:3])),
+        "mes": mes.upper(), "total": total, "estaciones": estaciones, "tabla": CLIMATOLOGIA.cobertura(),
+    }
+
 # Modelo de datos para que Swagger muestre los campos
 class Sugerencia(BaseModel):
     nombre: str
     mensaje: str
 
+def enviar_correo(remitente, contraseña, msg):
+    with smtplib.SMTP("smtp.gmail.com", 587, timeout=30) as server:
+        server.starttls()
+        server.login(remitente, contraseña)
+        server.send_message(msg)
+
 @app.post("/api/enviar_sugerencia")
 async def enviar_sugerencia(data: Sugerencia):
-    print(f"[DEBUG] Datos recibidos: {data}")
-    
     nombre = data.nombre.strip()
     mensaje = data.mensaje.strip()
-    
-    print(f"[DEBUG] Nombre procesado: '{nombre}'")
-    print(f"[DEBUG] Mensaje procesado: '{mensaje}'")
+
+    log.debug("Sugerencia recibida", extra={"nombre": nombre, "mensaje": mensaje})
 
     if not nombre or not mensaje:
         return {"status": "error", "detail": "Campos incompletos"}
@@ -639,14 +1210,12 @@ async def enviar_sugerencia(data: Sugerencia):
     msg.attach(MIMEText(cuerpo, "plain"))
 
     try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(remitente, contraseña)
-            server.send_message(msg)
+        # smtplib es bloqueante: se ejecuta en un hilo para no detener el event loop
+        await en_hilo(enviar_correo, remitente, contraseña, msg)
 
-        print(f"[INFO] Sugerencia enviada correctamente por {nombre}")
+        log.info("Sugerencia enviada correctamente", extra={"nombre": nombre})
         return {"status": "ok", "detail": "Sugerencia enviada correctamente"}
 
     except Exception as e:
-        print(f"[ERROR] No se pudo enviar el correo: {e}")
+        log.error("No se pudo enviar el correo: %s", e)
         return {"status": "error", "detail": str(e)}
\ No newline at end of file
@@ -0,0 +1,272 @@
+"""
+Métricas en formato de texto de Prometheus y tiempos por etapa (Server-Timing).
+
+Cada módulo declara sus métricas en REGISTRO (contadores, histogramas y
+medidores con etiquetas) y /metrics expone el registro completo. No depende de
+prometheus_client: el formato de exposición es texto plano.
+
+Con etapa("parseo", HISTOGRAMA, tipo=...) se mide un bloque: el tiempo va al
+histograma y, si la petición en curso pidió Server-Timing (SMN_SERVER_TIMING=1
+o el encabezado X-Server-Timing), se suma a esa etapa en la respuesta. Las
+etapas viajan en un contextvar; para trabajo que corre en otros hilos (p. ej.
+ClienteSMN.mapear) la función se envuelve con propagar(). En respuestas en
+flujo (ZIP) el encabezado sale antes del cuerpo, así que solo incluye lo que
+terminó antes de empezar a enviar.
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+SMN_SERVER_TIMING = os.getenv("SMN_SERVER_TIMING", "0") == "1"
+
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _formato_etiquetas(nombres, valores, extra=()):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    pares += [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = "untyped"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _llave(self, etiquetas):
+        return tuple(str(etiquetas.get(n, "")) for n in self.etiquetas)
+
+    def _muestras(self):
+        with self._lock:
+            return [(llave, valor) for llave, valor in sorted(self._valores.items())]
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        for llave, valor in self._muestras():
+            lineas.append(f"{self.nombre}{_formato_etiquetas(self.etiquetas, llave)} {_numero(valor)}")
+        return lineas
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor=1, **etiquetas):
+        llave = self._llave(etiquetas)
+        with self._lock:
+            self._valores[llave] = self._valores.get(llave, 0) + valor
+
+
+class Medidor(_Metrica):
+    """Valor que sube y baja; con `funcion` se lee al exponer ({llave: valor} o un número)."""
+
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+
+    def inc(self, valor=1, **etiquetas):
+        llave = self._llave(etiquetas)
+        with self._lock:
+            self._valores[llave] = self._valores.get(llave, 0) + valor
+
+    def dec(self, valor=1, **etiquetas):
+        self.inc(-valor, **etiquetas)
+
+    def _muestras(self):
+        if self.funcion is None:
+            return super()._muestras()
+        valores = self.funcion()
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        return sorted((tuple(str(v) for v in llave), valor) for llave, valor in valores.items())
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.cubetas = tuple(sorted(cubetas))
+
+    def observar(self, valor, **etiquetas):
+        llave = self._llave(etiquetas)
+        i = bisect.bisect_left(self.cubetas, valor)
+        with self._lock:
+            datos = self._valores.get(llave)
+            if datos is None:
+                # [conteo por cubeta (sin acumular) ..., suma, total]
+                datos = self._valores[llave] = [0] * (len(self.cubetas) + 1) + [0.0, 0]
+            datos[i] += 1
+            datos[-2] += valor
+            datos[-1] += 1
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        with self._lock:
+            muestras = [(llave, list(datos)) for llave, datos in sorted(self._valores.items())]
+        for llave, datos in muestras:
+            acumulado = 0
+            for limite, conteo in zip(self.cubetas + (float("inf"),), datos):
+                acumulado += conteo
+                le = _formato_etiquetas(self.etiquetas, llave, [("le", _numero(limite))])
+                lineas.append(f"{self.nombre}_bucket{le} {acumulado}")
+            etiquetas = _formato_etiquetas(self.etiquetas, llave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {_numero(datos[-2])}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {datos[-1]}")
+        return lineas
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = []
+
+    def _agregar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._agregar(Contador(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre, ayuda, etiquetas=(), funcion=None):
+        return self._agregar(Medidor(nombre, ayuda, etiquetas, funcion))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS):
+        return self._agregar(Histograma(nombre, ayuda, etiquetas, cubetas))
+
+    def exponer(self):
+        """Texto para /metrics (formato de exposición 0.0.4 de Prometheus)."""
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = Registro()
+TIPO_CONTENIDO = "text/plain; version=0.0.4; charset=utf-8"
+
+PETICIONES = REGISTRO.histograma(
+    "smn_http_peticion_segundos", "Duración de las peticiones HTTP por ruta", ("ruta", "metodo", "status")
+)
+BYTES_SERVIDOS = REGISTRO.contador("smn_http_bytes_servidos_total", "Bytes enviados en cuerpos de respuesta", ("ruta",))
+
+
+# ---------------------- ETAPAS (Server-Timing) ----------------------
+_ETAPAS = contextvars.ContextVar("smn_etapas", default=None)
+
+
+class Etapas:
+    """Tiempo acumulado por etapa en una petición; una etapa puede repetirse y correr en varios hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiempos = {}  # nombre -> [segundos, veces]
+
+    def agregar(self, nombre, segundos):
+        with self._lock:
+            tiempo = self._tiempos.setdefault(nombre, [0.0, 0])
+            tiempo[0] += segundos
+            tiempo[1] += 1
+
+    def encabezado(self):
+        with self._lock:
+            tiempos = list(self._tiempos.items())
+        partes = []
+        for nombre, (segundos, veces) in tiempos:
+            parte = f"{nombre};dur={segundos * 1000:.1f}"
+            if veces > 1:
+                parte += f';desc="{veces}x"'
+            partes.append(parte)
+        return ", ".join(partes)
+
+
+@contextmanager
+def etapa(nombre, histograma=None, **etiquetas):
+    """
+    Mide el bloque: lo observa en `histograma` con `etiquetas` y lo suma a la
+    etapa `nombre` de la petición en curso. Regresa el dict de etiquetas para
+    completar las que solo se conocen al final (p. ej. si hubo caché).
+    """
+    t0 = time.perf_counter()
+    try:
+        yield etiquetas
+    finally:
+        segundos = time.perf_counter() - t0
+        if histograma is not None:
+            histograma.observar(segundos, **etiquetas)
+        etapas = _ETAPAS.get()
+        if etapas is not None:
+            etapas.agregar(nombre, segundos)
+
+
+def propagar(fn):
+    """fn para otro hilo, registrando sus etapas en la petición que la creó."""
+    etapas = _ETAPAS.get()
+    if etapas is None:
+        return fn
+
+    def envuelta(*args, **kwargs):
+        token = _ETAPAS.set(etapas)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _ETAPAS.reset(token)
+    return envuelta
+
+
+class MiddlewareMetricas:
+    """ASGI: duración y bytes por ruta, y el encabezado Server-Timing si se pidió."""
+
+    def __init__(self, app, server_timing=SMN_SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        pedido = self.server_timing or any(k == b"x-server-timing" for k, _ in scope.get("headers", ()))
+        etapas = Etapas() if pedido else None
+        token = _ETAPAS.set(etapas)
+        t0 = time.perf_counter()
+        respuesta = {"status": 500, "bytes": 0}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                respuesta["status"] = mensaje["status"]
+                if etapas is not None:
+                    etapas.agregar("app", time.perf_counter() - t0)
+                    encabezados = list(mensaje.get("headers", []))
+                    encabezados.append((b"server-timing", etapas.encabezado().encode("latin-1")))
+                    mensaje = dict(mensaje, headers=encabezados)
+            elif mensaje["type"] == "http.response.body":
+                respuesta["bytes"] += len(mensaje.get("body", b""))
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _ETAPAS.reset(token)
+            ruta = getattr(scope.get("route"), "path", None) or ("/static" if scope["path"].startswith("/static") else "otra")
+            PETICIONES.observar(
+                time.perf_counter() - t0, ruta=ruta, metodo=scope["method"], status=respuesta["status"]
+            )
+            BYTES_SERVIDOS.inc(respuesta["bytes"], ruta=ruta)
@@ -0,0 +1,493 @@
+"""
+Parsers de los TXT del SMN (mensuales, normales, extremos y diarios) a CSV.
+
+Son funciones puras sobre el texto, sin estado de la aplicación, para que
+puedan correr en un pool de procesos (ver procesos.py).
+"""
+import csv
+import functools
+import io
+import operator
+import re
+
+import numpy as np
+import pandas as pd
+
+# ---------------------- PARSER PARA MENSUALES ----------------------
+def extract_metadata(lines):
+    meta_order = [
+        ("ESTADÍSTICA MENSUAL", ""),
+        ("EMISIÓN", ""),
+        ("ESTACIÓN", ""),
+        ("NOMBRE", ""),
+        ("ESTADO", ""),
+        ("MUNICIPIO", ""),
+        ("SITUACIÓN", ""),
+        ("CVE-OMM", ""),
+        ("LATITUD", ""),
+        ("LONGITUD", ""),
+        ("ALTITUD", ""),
+    ]
+    header_zone = lines[:120]
+
+    def find_value(key):
+        for ln in header_zone:
+            s = ln.strip()
+            if s.startswith(key):
+                return s.split(":", 1)[-1].strip()
+        return ""
+
+    out = []
+    for key, default in meta_order:
+        if key == "ESTADÍSTICA MENSUAL":
+            out.append([key, ""])
+        else:
+            out.append([key, find_value(key) or default])
+    return out
+
+def header_spans(header_line):
+    h = header_line.expandtabs(8).rstrip("\n")
+    matches = list(re.finditer(r"\S+", h))
+    labels = [m.group(0) for m in matches]
+    starts = [m.start() for m in matches]
+    return labels, starts
+
+class CortesFijos:
+    """
+    Plan de corte de una tabla de ancho fijo, compilado una vez por encabezado:
+    un itemgetter con un slice por columna, así cada renglón se parte en C de
+    una sola llamada en vez de recalcular los límites columna por columna.
+    """
+    __slots__ = ("ncols", "_cortar")
+
+    def __init__(self, starts):
+        self.ncols = len(starts)
+        limites = list(starts[1:]) + [None]
+        cortes = [slice(a, b) for a, b in zip(starts, limites)]
+        if len(cortes) == 1:
+            # itemgetter de un solo elemento no regresa tupla
+            unico = cortes[0]
+            self._cortar = lambda s: (s[unico],)
+        else:
+            self._cortar = operator.itemgetter(*cortes)
+
+    def fila(self, line):
+        s = line.expandtabs(8) if "\t" in line else line
+        return [p.strip() for p in self._cortar(s)]
+
+    def filas(self, lines):
+        """Todas las filas de un bloque de datos, ya recortadas."""
+        cortar = self._cortar
+        return [
+            [p.strip() for p in cortar(l.expandtabs(8) if "\t" in l else l)]
+            for l in lines
+        ]
+
+@functools.lru_cache(maxsize=256)
+def compilar_encabezado(header_line):
+    """(etiquetas, CortesFijos) de un renglón AÑO; los encabezados se repiten entre archivos."""
+    labels, starts = header_spans(header_line)
+    return labels, CortesFijos(starts)
+
+def slice_by_spans(line, starts, ncols):
+    # Rellenar a la derecha no cambia nada: los cortes fuera de la línea dan "" tras strip()
+    return CortesFijos(starts[:ncols]).fila(line)
+
+SKIP_TITLES_MENSUALES = {
+    "COMISIÓN NACIONAL DEL AGUA",
+    "COORDINACIÓN GENERAL DEL SERVICIO METEOROLÓGICO NACIONAL",
+    "BASE DE DATOS CLIMATOLÓGICA NACIONAL",
+    "ESTADÍSTICA MENSUAL",
+}
+
+def tablas_mensuales(lines):
+    """
+    [(título o None, etiquetas, filas)] de cada tabla AÑO del TXT mensual. El
+    bloque de datos se delimita primero y se corta completo con el plan de su
+    encabezado.
+    """
+    tablas = []
+    i = 0
+    n = len(lines)
+
+    def prev_nonempty(idx):
+        j = idx - 1
+        while j >= 0:
+            if lines[j].strip():
+                return lines[j].strip()
+            j -= 1
+        return ""
+
+    while i < n:
+        line = lines[i].strip()
+        if line.startswith("AÑO"):
+            title = prev_nonempty(i)
+            if title in SKIP_TITLES_MENSUALES or ":" in title:
+                title = None
+
+            labels, cortes = compilar_encabezado(lines[i].rstrip("\n"))
+            i += 1
+            inicio = i
+            while i < n:
+                cur_strip = lines[i].strip()
+                if not cur_strip or cur_strip.startswith("AÑO"):
+                    break
+                i += 1
+
+            tablas.append((title, labels, cortes.filas(lines[inicio:i])))
+            continue
+        i += 1
+    return tablas
+
+def _csv_mensual(lines, tablas):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # --- Metadatos ---
+    for k, v in extract_metadata(lines):
+        writer.writerow([k, v])
+    writer.writerow([])
+
+    # --- Tablas ---
+    for title, labels, filas in tablas:
+        if title is not None:
+            writer.writerow([title, ""])
+        writer.writerow(labels)
+        writer.writerows(filas)
+        writer.writerow([])
+
+    return buffer.getvalue()
+
+def tabla_mensual(labels, filas):
+    """
+    DataFrame tipado de una tabla mensual: AÑO como Int32 y el resto de las
+    columnas como float32 (los valores no numéricos quedan en NaN).
+    """
+    ancho = len(labels)
+    datos = np.array([(f + [""] * ancho)[:ancho] for f in filas], dtype=object).reshape(len(filas), ancho)
+    df = pd.DataFrame(datos, columns=labels)
+    for j, col in enumerate(labels):
+        numeros = pd.to_numeric(pd.Series(datos[:, j]), errors="coerce")
+        df.isetitem(j, numeros.astype("Int32") if j == 0 else numeros.astype(np.float32))
+    return df
+
+def parse_mensual(lines):
+    """
+    Convierte un TXT mensual del SMN en CSV y además regresa sus tablas
+    tipadas: [(título o None, DataFrame)] (ver tabla_mensual).
+    """
+    tablas = tablas_mensuales(lines)
+    tipadas = [(title, tabla_mensual(labels, filas)) for title, labels, filas in tablas]
+    return _csv_mensual(lines, tablas), tipadas
+
+def parse_mensual_txt(lines):
+    return _csv_mensual(lines, tablas_mensuales(lines))
+
+# ---------------------- PARSER PARA NORMALES ----------------------
+DELIM = re.compile(r"\t+|\s{2,}")  # separador: tabs o 2+ espacios
+
+def parse_normales_txt(lines, periodo="1961-1990"):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # --- Metadatos ---
+    header_zone = lines[:60]
+
+    def find_value(key):
+        for ln in header_zone:
+            s = ln.strip()
+            if s.upper().startswith(key):
+                return s.split(":", 1)[-1].strip()
+        return ""
+
+    writer.writerow([f"NORMAL CLIMATOLÓGICA {periodo}", ""])
+    for key in ["EMISIÓN", "ESTACIÓN", "NOMBRE", "ESTADO", "MUNICIPIO",
+                "SITUACIÓN", "CVE-OMM", "LATITUD", "LONGITUD", "ALTITUD"]:
+        writer.writerow([key, find_value(key)])
+    writer.writerow([])
+
+    # --- Tablas ---
+    n = len(lines)
+    i = 0
+
+    def prev_nonempty(idx):
+        j = idx - 1
+        while j >= 0:
+            if lines[j].strip():
+                return lines[j].strip()
+            j -= 1
+        return ""
+
+    while i < n:
+        line = lines[i].strip()
+        if line.startswith("MESES"):
+            title = prev_nonempty(i)
+            if title and ":" not in title and not title.startswith("NORMAL CLIMATOLÓGICA"):
+                writer.writerow([title, ""])
+
+            headers = DELIM.split(line.strip())
+            headers = ["VARIABLE"] + headers[1:]
+            writer.writerow(headers)
+            i += 1
+
+            while i < n:
+                cur = lines[i].strip()
+                if not cur or cur.startswith("MESES"):
+                    break
+                parts = DELIM.split(cur)
+                if parts:
+                    writer.writerow(parts)
+                i += 1
+
+            writer.writerow([])
+            continue
+        i += 1
+
+    return buffer.getvalue()
+
+# ---------------------- PARSER PARA EXTREMOS ----------------------
+def parse_extremos_txt_fixed(lines):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # --- Metadatos ---
+    header_zone = lines[:60]
+
+    def find_value(key):
+        for ln in header_zone:
+            s = ln.strip()
+            if s.upper().startswith(key):
+                return s.split(":", 1)[-1].strip()
+        return ""
+
+    writer.writerow(["VALORES EXTREMOS", ""])
+    for key in ["EMISIÓN", "ESTACIÓN", "NOMBRE", "ESTADO", "MUNICIPIO",
+                "SITUACIÓN", "CVE-OMM", "LATITUD", "LONGITUD", "ALTITUD"]:
+        writer.writerow([key, find_value(key)])
+    writer.writerow([])
+
+    # --- Tablas ---
+    n = len(lines)
+    i = 0
+
+    expected_headers = [
+        "MES", "Año Inicio", "Año Final", "Núm Años",
+        "Valor Máx.", "Fecha Máx.", "Se ha Rep.",
+        "Valor Mín.", "Fecha Mín.", "Se ha Rep.",
+        "Valor Medio", "Desv Estándar"
+    ]
+
+    while i < n:
+        line = lines[i].strip()
+        # Detectar inicio de sección
+        if line.upper().startswith(("TEMPERATURA MÁXIMA", "TEMPERATURA MÍNIMA", "PRECIPITACIÓN", "EVAPORACIÓN")):
+            writer.writerow([line, ""])
+            i += 1
+            continue
+
+        # Detectar encabezado de tabla (línea que empieza con MES)
+        if line.startswith("MES"):
+            # saltamos 2 filas de encabezado en el TXT y ponemos las esperadas
+            writer.writerow(expected_headers)
+            i += 2
+            # Escribir filas hasta línea en blanco o nueva sección
+            while i < n and lines[i].strip() and not lines[i].upper().startswith(("TEMPERATURA", "PRECIPITACIÓN", "EVAPORACIÓN")):
+                parts = re.split(r"\s{2,}|\t+", lines[i].strip())
+                writer.writerow(parts)
+                i += 1
+            writer.writerow([])
+            continue
+
+        i += 1
+
+    return buffer.getvalue() 
+
+# ---------------------- PARSER PARA DIARIOS ----------------------
+FECHA_RE = re.compile(r'^\s*FECHA\b', flags=re.IGNORECASE)
+UNIDAD_RE = re.compile(r'\(([^)]*)\)')
+ESPACIOS_A_COMA = bytes.maketrans(bytes([9, 11, 12, 13, 28, 29, 30, 31, 32]), b"," * 9)
+NULOS_DIARIOS = ["Nulo", "NULO", "nulo", ""]
+EMISION_DIARIOS_RE = re.compile(r'EMISI[ÓO]N\s*:?\s*(\d{2}/\d{2}/\d{4})', flags=re.IGNORECASE)
+
+def metadatos_diarios(lines, est):
+    """
+    Filas de metadatos del CSV diario: la emisión sale del TXT y el resto del KML.
+    """
+    emision = ""
+    for l in lines[:60]:
+        # Buscar línea tipo "EMISIÓN : 19/09/2025"
+        m = EMISION_DIARIOS_RE.search(l)
+        if m:
+            emision = m.group(1)
+            break
+
+    return [
+        ["REGISTRO DIARIO HISTÓRICO", ""],
+        ["EMISIÓN", emision],
+        ["ESTACIÓN", est.get("clave", "") or ""],
+        ["NOMBRE", (est.get("nombre", "") or "").strip()],
+        ["ESTADO", est.get("estado", "") or ""],
+        ["MUNICIPIO", est.get("municipio", "") or ""],
+        ["SITUACIÓN", est.get("situacion", "") or ""],
+        ["CVE-OMM", ""],
+        ["LATITUD", f"{est.get('lat','') or ''} °".strip()],
+        ["LONGITUD", f"{est.get('lon','') or ''} °".strip()],
+        ["ALTITUD", f"{est.get('alt','') or ''} msnm".strip()],
+        [],
+    ]
+
+def encabezado_diarios(lines):
+    """
+    Detecta el encabezado "FECHA ..." y las unidades de la línea siguiente.
+    Regresa (columnas, índice de la primera línea de datos) o (None, len(lines)).
+    """
+    for i, raw in enumerate(lines):
+        if not FECHA_RE.match(raw.strip()):
+            continue
+        header_cols = raw.split()
+
+        # Detectar unidades en la siguiente línea (si existen)
+        units = UNIDAD_RE.findall(lines[i + 1]) if i + 1 < len(lines) else []
+
+        header_final = []
+        for idx, col in enumerate(header_cols):
+            if idx == 0 and col.upper().startswith("FECHA"):
+                header_final.append(col)
+            else:
+                unit_idx = idx - 1
+                unit = units[unit_idx].strip() if unit_idx < len(units) else ""
+                header_final.append(col if not unit else f"{col} ({unit})")
+        return header_final, i + (2 if units else 1)
+    return None, len(lines)
+
+def filas_csv_diarios(datos):
+    """
+    Las líneas de datos como filas CSV, idénticas a escribir con csv.writer los
+    tokens separados por espacios de cada línea no vacía.
+
+    Se trabaja sobre el bloque completo en bytes con NumPy: cada racha de
+    espacios/tabs entre dos tokens se vuelve una coma y el resto se elimina.
+    Si hay algo que csv.writer tendría que entrecomillar o texto no ASCII, se
+    usa el camino por línea.
+    """
+    lineas = list(filter(str.strip, datos))
+    if not lineas:
+        return ""
+    texto = "\n".join(lineas) + "\n"
+    if not texto.isascii() or "," in texto or '"' in texto:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(line.split() for line in lineas)
+        return buffer.getvalue()
+
+    data = texto.encode("ascii")
+    b = np.frombuffer(data, dtype=np.uint8)
+    # Espacios según str.split() (sin contar el salto de línea)
+    ws = (b == 32) | ((b >= 9) & (b <= 13) & (b != 10)) | ((b >= 28) & (b <= 31))
+    tok = ~ws & (b != 10)
+
+    cambios = np.flatnonzero(ws[1:] != ws[:-1]) + 1
+    inicios = cambios[ws[cambios]]
+    if ws[0]:
+        inicios = np.concatenate(([0], inicios))
+    fines = cambios[~ws[cambios]]  # el texto termina en "\n", toda racha tiene fin
+
+    # La racha es separador solo si hay token antes y después (no al inicio/fin de línea)
+    coma = (inicios > 0) & tok[inicios - 1] & tok[fines]
+    separadores = inicios[coma]
+
+    if len(separadores) == np.count_nonzero(ws):
+        # Caso común: un solo tab/espacio entre tokens, basta con traducir bytes
+        salida = data.translate(ESPACIOS_A_COMA)
+    else:
+        out = b.copy()
+        out[separadores] = 44  # ","
+        conservar = ~ws
+        conservar[separadores] = True
+        salida = out[conservar].tobytes()
+    return salida.replace(b"\n", b"\r\n").decode("ascii")
+
+def _fechas(serie):
+    fechas = pd.to_datetime(serie, format="%Y-%m-%d", errors="coerce")
+    if fechas.isna().all():
+        fechas = pd.to_datetime(serie, format="%d/%m/%Y", errors="coerce")
+    return fechas
+
+def tabla_diarios(header, filas):
+    """
+    DataFrame tipado a partir de las filas CSV: "fecha" como datetime64 y las
+    variables (precip, evap, tmax, tmin) como float32, con "Nulo" como NaN.
+    """
+    nombres = [col.split(" (")[0].lower() for col in header] if header else ["fecha"]
+    if not filas:
+        df = pd.DataFrame({n: pd.Series(dtype="float32") for n in nombres})
+        df["fecha"] = pd.Series(dtype="datetime64[ns]")
+        return df
+
+    opciones = dict(
+        header=None, names=nombres, usecols=range(len(nombres)),
+        on_bad_lines="skip", engine="c", keep_default_na=False,
+    )
+    try:
+        # Camino rápido: el parser C convierte directo a float32
+        df = pd.read_csv(
+            io.StringIO(filas), na_values=NULOS_DIARIOS,
+            dtype={n: (str if i == 0 else np.float32) for i, n in enumerate(nombres)}, **opciones,
+        )
+    except ValueError:
+        # Algún valor no numérico fuera de "Nulo": se convierte columna por columna
+        df = pd.read_csv(io.StringIO(filas), dtype=str, **opciones)
+        for col in nombres[1:]:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(np.float32)
+    df[nombres[0]] = _fechas(df[nombres[0]])
+    return df.rename(columns={nombres[0]: "fecha"})
+
+def _csv_diarios(lines, est, header, filas):
+    csv_buffer = io.StringIO()
+    writer = csv.writer(csv_buffer, delimiter=",")
+    writer.writerows(metadatos_diarios(lines, est))
+    if header:
+        writer.writerow(header)
+    # Las filas ya vienen en formato CSV; se concatenan sin pasar por el buffer
+    return csv_buffer.getvalue() + filas
+
+def parse_diarios(lines, est):
+    """
+    Convierte un TXT diario del SMN en CSV estructurado y además regresa los
+    datos como DataFrame tipado (ver tabla_diarios).
+    """
+    header, inicio = encabezado_diarios(lines)
+    filas = filas_csv_diarios(lines[inicio:]) if header else ""
+    return _csv_diarios(lines, est, header, filas), tabla_diarios(header, filas)
+
+def parse_diarios_txt(lines, est):
+    """
+    Convierte un TXT diario del SMN en CSV estructurado.
+    Extrae metadatos (emisión, coordenadas, etc.) y detecta encabezados FECHA y unidades.
+    """
+    header, inicio = encabezado_diarios(lines)
+    filas = filas_csv_diarios(lines[inicio:]) if header else ""
+    return _csv_diarios(lines, est, header, filas)
+
+# Campos del KML que parse_diarios_txt copia a los metadatos del CSV
+CAMPOS_META_DIARIOS = ("clave", "nombre", "estado", "municipio", "situacion", "lat", "lon", "alt")
+
+def parsear_txt(tipo, lines, est):
+    if tipo == "mensuales":
+        return parse_mensual_txt(lines)
+    if tipo.startswith("normales"):
+        periodo = tipo.split("_")[-1]
+        return parse_normales_txt(lines, periodo)
+    if tipo == "extremos":
+        return parse_extremos_txt_fixed(lines)
+    if tipo == "diarios":
+        return parse_diarios_txt(lines, est)
+    # fallback: guardar texto crudo como CSV simple
+    return "\n".join(lines)
+
+def parsear_texto(tipo, texto, est):
+    """parsear_txt a partir del texto completo; es lo que se envía al pool de procesos."""
+    return parsear_txt(tipo, texto.splitlines(), est)
+
+def diarios_tipados(texto, est):
+    """Solo el DataFrame tipado de parse_diarios."""
+    return parse_diarios(texto.splitlines(), est)[1]
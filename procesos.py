@@ -0,0 +1,57 @@
+"""
+Pool de procesos para el trabajo de CPU (parseo de TXT y conversión a
+Parquet/Arrow), para que no compita por el GIL con los hilos que atienden
+peticiones.
+
+Las llamadas se hacen desde hilos (el pool de ClienteSMN o los de las
+peticiones) y bloquean hasta tener el resultado. Como mucho hay
+SMN_COLA_PARSEO trabajos enviados a la vez; los demás esperan su turno en el
+hilo que los pidió. Con SMN_PROCESOS_PARSEO=0 todo corre en el mismo proceso.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+SMN_PROCESOS_PARSEO = int(os.getenv("SMN_PROCESOS_PARSEO", str(os.cpu_count() or 1)))
+SMN_COLA_PARSEO = int(os.getenv("SMN_COLA_PARSEO", str(4 * max(1, SMN_PROCESOS_PARSEO))))
+
+
+class PoolProcesos:
+    def __init__(self, procesos=SMN_PROCESOS_PARSEO, max_pendientes=SMN_COLA_PARSEO):
+        self.procesos = procesos
+        self.max_pendientes = max_pendientes
+        self._cupo = threading.BoundedSemaphore(max(1, max_pendientes))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: los workers no heredan hilos ni locks del servidor
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.procesos, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def ejecutar(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs) en un proceso del pool; fn debe ser una función de módulo (picklable)."""
+        if self.procesos <= 0:
+            return fn(*args, **kwargs)
+        with self._cupo:
+            pool = self._pool()
+            try:
+                return pool.submit(fn, *args, **kwargs).result()
+            except BrokenProcessPool:
+                # Un worker murió (p. ej. por memoria): se descarta el pool y se rehace al siguiente uso
+                with self._lock:
+                    if self._executor is pool:
+                        self._executor = None
+                raise
+
+    def cerrar(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,153 @@
+"""
+Almacén columnar de las series diarias por estación.
+
+Cada estación se guarda en cache/series/{clave}.arrow (Arrow IPC) con la fecha
+(date32, ordenada) y una columna float32 por variable. En los metadatos del
+archivo va el sha256 del TXT del que salió, así que solo se vuelve a parsear
+cuando el SMN publica una versión nueva. Los archivos se abren con memory-map
+y un rango de fechas se corta con búsqueda binaria, sin leer la historia
+completa.
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from cache_smn import SMN_CACHE_DIR, PARSER_VERSION
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # sin pyarrow las series solo viven en memoria
+    pa = None
+
+SMN_SERIES_DIR = os.getenv("SMN_SERIES_DIR", str(Path(SMN_CACHE_DIR) / "series"))
+SMN_SERIES_EN_MEMORIA = int(os.getenv("SMN_SERIES_EN_MEMORIA", "256"))
+
+VARIABLES = ("precip", "evap", "tmax", "tmin")
+
+
+class SerieDiaria:
+    """Fechas (datetime64[D], ordenadas) y un arreglo float32 por variable; NaN = sin dato."""
+
+    def __init__(self, clave, sha, fechas, valores):
+        self.clave = clave
+        self.sha = sha
+        self.fechas = fechas
+        self.valores = valores
+        self.agregados = {}  # (variable, periodo) -> Agregado, ver agregados.py
+
+    @classmethod
+    def desde_tabla(cls, clave, sha, df):
+        """A partir del DataFrame de parse_diarios (columna "fecha" + variables)."""
+        df = df[df["fecha"].notna()].sort_values("fecha", kind="stable")
+        fechas = df["fecha"].to_numpy().astype("datetime64[D]")
+        valores = {
+            var: (df[var].to_numpy(dtype=np.float32) if var in df else np.full(len(df), np.nan, np.float32))
+            for var in VARIABLES
+        }
+        return cls(clave, sha, fechas, valores)
+
+    def __len__(self):
+        return len(self.fechas)
+
+    def rango(self, variable, desde=None, hasta=None):
+        """(fechas, valores) con desde <= fecha <= hasta; los extremos None no acotan."""
+        i = 0 if desde is None else np.searchsorted(self.fechas, desde, side="left")
+        j = len(self.fechas) if hasta is None else np.searchsorted(self.fechas, hasta, side="right")
+        return self.fechas[i:j], self.valores[variable][i:j]
+
+
+class AlmacenSeries:
+    def __init__(self, directorio=SMN_SERIES_DIR, max_en_memoria=SMN_SERIES_EN_MEMORIA):
+        self.dir = Path(directorio)
+        self.max_en_memoria = max_en_memoria
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        if pa is not None:
+            self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _ruta(self, clave):
+        return self.dir / f"{clave}.arrow"
+
+    def _recordar(self, serie):
+        with self._lock:
+            self._memoria[serie.clave] = serie
+            self._memoria.move_to_end(serie.clave)
+            while len(self._memoria) > self.max_en_memoria:
+                self._memoria.popitem(last=False)
+        return serie
+
+    # ---------------------- lectura ----------------------
+    def buscar(self, clave, sha=None):
+        """
+        Serie guardada de la estación, o None. Con `sha` solo se acepta la que
+        salió de ese mismo TXT.
+        """
+        with self._lock:
+            serie = self._memoria.get(clave)
+            if serie is not None:
+                self._memoria.move_to_end(clave)
+        if serie is None:
+            serie = self._leer(clave)
+            if serie is not None:
+                self._recordar(serie)
+        if serie is None or (sha is not None and serie.sha != sha):
+            return None
+        return serie
+
+    def _leer(self, clave):
+        if pa is None:
+            return None
+        try:
+            tabla = pa.ipc.open_file(pa.memory_map(str(self._ruta(clave)))).read_all()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        meta = tabla.schema.metadata or {}
+        if meta.get(b"parser_version", b"").decode() != PARSER_VERSION:
+            return None
+        return SerieDiaria(
+            clave,
+            meta.get(b"raw_sha", b"").decode(),
+            tabla.column("fecha").to_numpy(),
+            {var: tabla.column(var).to_numpy() for var in VARIABLES},
+        )
+
+    # ---------------------- escritura ----------------------
+    def guardar(self, clave, sha, df):
+        """Convierte el DataFrame diario, lo escribe en disco y lo deja en memoria."""
+        serie = SerieDiaria.desde_tabla(clave, sha, df)
+        if pa is not None:
+            tabla = pa.table(
+                {"fecha": pa.array(serie.fechas, type=pa.date32()),
+                 **{var: pa.array(serie.valores[var], type=pa.float32()) for var in VARIABLES}},
+            ).replace_schema_metadata({"raw_sha": sha, "parser_version": PARSER_VERSION})
+            ruta = self._ruta(clave)
+            tmp = ruta.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with pa.OSFile(str(tmp), "wb") as f, pa.ipc.new_file(f, tabla.schema) as writer:
+                writer.write_table(tabla)
+            os.replace(tmp, ruta)
+        return self._recordar(serie)
+
+
+def arrow_series(partes, variable):
+    """Bytes Arrow IPC (stream) con columnas clave, fecha y la variable pedida."""
+    if pa is None:
+        raise RuntimeError("Se necesita pyarrow para responder en formato Arrow")
+    claves, fechas, valores = [], [], []
+    for clave, f, v in partes:
+        claves.append(np.full(len(f), clave, dtype=object))
+        fechas.append(f)
+        valores.append(v)
+    tabla = pa.table({
+        "clave": pa.array(np.concatenate(claves) if claves else [], type=pa.string()).dictionary_encode(),
+        "fecha": pa.array(np.concatenate(fechas) if fechas else [], type=pa.date32()),
+        variable: pa.array(np.concatenate(valores) if valores else [], type=pa.float32(), from_pandas=True),
+    })
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, tabla.schema) as writer:
+        writer.write_table(tabla)
+    return buffer.getvalue()
@@ -0,0 +1,227 @@
+"""
+Snapshot binario del catálogo KML y de los shapefiles para arrancar rápido.
+
+convert_shp.py escribe en data/snapshot/:
+  - estaciones.arrow          catálogo de estaciones (Arrow IPC, columnas de texto)
+  - estados.feather           polígonos ya reproyectados a EPSG:4326
+  - municipios.feather
+  - estados_geojson.arrow     bytes GeoJSON de cada feature, listos para servir
+  - municipios_geojson.arrow
+  - manifest.json             huella (tamaño, mtime, sha256) de los archivos fuente
+
+Los archivos se abren con memory-map, así que los workers comparten las
+páginas del sistema operativo; los datos se quedan en columnas Arrow y cada
+quien arma objetos de Python solo de lo que usa (catalogo.FilasPerezosas, los
+atributos de los polígonos sin decodificar su WKB). Si algún archivo fuente
+cambió respecto al manifest, el snapshot se ignora y se vuelve a leer el
+original. El sha256 del manifest sirve además de huella del catálogo, así que
+el arranque no relee el KML.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import geopandas as gpd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # sin pyarrow no hay snapshot: se parsean los originales
+    pa = None
+
+MANIFEST_VERSION = 1
+
+
+class Perezoso:
+    """Valor que se calcula al primer uso, una sola vez aunque lleguen peticiones a la vez."""
+
+    _SIN_VALOR = object()
+
+    def __init__(self, fn):
+        self._fn = fn
+        self._valor = self._SIN_VALOR
+        self._lock = threading.Lock()
+
+    def get(self):
+        valor = self._valor
+        if valor is self._SIN_VALOR:
+            with self._lock:
+                if self._valor is self._SIN_VALOR:
+                    self._valor = self._fn()
+                valor = self._valor
+        return valor
+
+    def reemplazar(self, valor):
+        self._valor = valor
+
+    def reiniciar(self):
+        """Descarta el valor; el siguiente get() lo vuelve a calcular."""
+        self._valor = self._SIN_VALOR
+
+    @property
+    def cargado(self):
+        return self._valor is not self._SIN_VALOR
+
+
+def sha256_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def huella(rutas, con_hash=True):
+    out = []
+    for ruta in rutas:
+        st = os.stat(ruta)
+        out.append({
+            "archivo": Path(ruta).name,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "sha256": sha256_archivo(ruta) if con_hash else None,
+        })
+    return out
+
+
+class Snapshot:
+    def __init__(self, data_dir, fuentes):
+        """fuentes: {nombre: [rutas de los archivos originales]}."""
+        self.dir = Path(data_dir) / "snapshot"
+        self.fuentes = {k: [Path(r) for r in v] for k, v in fuentes.items()}
+        self._manifest = None
+        self._vigencia = {}
+
+    # ---------------------- vigencia ----------------------
+    def _leer_manifest(self):
+        if self._manifest is None:
+            try:
+                self._manifest = json.loads((self.dir / "manifest.json").read_text(encoding="utf-8"))
+            except (FileNotFoundError, ValueError):
+                self._manifest = {}
+        return self._manifest
+
+    def vigente(self, nombre):
+        if nombre not in self._vigencia:
+            self._vigencia[nombre] = self._comparar_fuentes(nombre)
+        return self._vigencia[nombre]
+
+    def _comparar_fuentes(self, nombre):
+        if pa is None:
+            return False
+        manifest = self._leer_manifest()
+        if manifest.get("version") != MANIFEST_VERSION:
+            return False
+        guardada = manifest.get("fuentes", {}).get(nombre)
+        if not guardada:
+            return False
+        try:
+            actual = huella(self.fuentes[nombre], con_hash=False)
+        except FileNotFoundError:
+            return False
+        if len(actual) != len(guardada):
+            return False
+        confirmados = False
+        for a, g in zip(actual, guardada):
+            if a["archivo"] != g["archivo"] or a["size"] != g["size"]:
+                return False
+            # mtime distinto (p. ej. tras un git clone): se confirma por contenido
+            if a["mtime_ns"] != g["mtime_ns"]:
+                ruta = next(r for r in self.fuentes[nombre] if r.name == a["archivo"])
+                if sha256_archivo(ruta) != g["sha256"]:
+                    return False
+                g["mtime_ns"] = a["mtime_ns"]
+                confirmados = True
+        if confirmados:
+            self._guardar_manifest(manifest)
+        return True
+
+    def _guardar_manifest(self, manifest):
+        """
+        Anota los mtime ya confirmados por contenido para que los demás workers y
+        los siguientes arranques no vuelvan a calcular el sha256. Si el directorio
+        es de solo lectura, se queda como estaba.
+        """
+        tmp = self.dir / f"manifest.json.{os.getpid()}.tmp"
+        try:
+            tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+            os.replace(tmp, self.dir / "manifest.json")
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+    def sha256(self, nombre):
+        """sha256 del archivo fuente de `nombre` según el manifest, o None si no hay snapshot vigente."""
+        if not self.vigente(nombre):
+            return None
+        guardada = self._leer_manifest()["fuentes"][nombre]
+        return guardada[0]["sha256"] if len(guardada) == 1 else None
+
+    def _abrir(self, archivo):
+        return pa.ipc.open_file(pa.memory_map(str(self.dir / archivo))).read_all()
+
+    # ---------------------- lectura ----------------------
+    def estaciones(self):
+        """Tabla Arrow del catálogo (en memory-map), o None si no hay snapshot vigente."""
+        if not self.vigente("estaciones"):
+            return None
+        return self._abrir("estaciones.arrow")
+
+    def gdf(self, nombre):
+        """GeoDataFrame en EPSG:4326, o None si no hay snapshot vigente. Decodifica toda la geometría."""
+        if not self.vigente(nombre):
+            return None
+        return gpd.read_feather(self.dir / f"{nombre}.feather", memory_map=True)
+
+    def atributos(self, nombre):
+        """Columnas no geométricas como DataFrame (sin decodificar el WKB), o None si no hay snapshot vigente."""
+        if not self.vigente(nombre):
+            return None
+        tabla = self._abrir(f"{nombre}.feather")
+        geo = json.loads((tabla.schema.metadata or {}).get(b"geo", b"{}"))
+        geometrias = set(geo.get("columns", {})) or {geo.get("primary_column", "geometry")}
+        return tabla.drop_columns([c for c in tabla.column_names if c in geometrias]).to_pandas()
+
+    def geojson_features(self, nombre):
+        if not self.vigente(nombre):
+            return None
+        return self._abrir(f"{nombre}_geojson.arrow").column("geojson").to_pylist()
+
+    # ---------------------- escritura (convert_shp.py) ----------------------
+    def _escribir(self, archivo, tabla):
+        tmp = self.dir / (archivo + ".tmp")
+        with pa.OSFile(str(tmp), "wb") as f, pa.ipc.new_file(f, tabla.schema) as writer:
+            writer.write_table(tabla)
+        os.replace(tmp, self.dir / archivo)
+
+    def construir(self, registros, gdfs, geojson_features):
+        """
+        registros: lista de dicts del catálogo; gdfs: {nombre: GeoDataFrame en
+        EPSG:4326}; geojson_features: {nombre: [bytes por feature]}.
+        """
+        if pa is None:
+            raise RuntimeError("Se necesita pyarrow para construir el snapshot")
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+        campos = list(registros[0]) if registros else []
+        self._escribir(
+            "estaciones.arrow",
+            pa.table({c: pa.array([r.get(c) for r in registros], type=pa.string()) for c in campos}),
+        )
+        for nombre, gdf in gdfs.items():
+            tmp = self.dir / f"{nombre}.feather.tmp"
+            gdf.to_feather(tmp, compression="uncompressed")
+            os.replace(tmp, self.dir / f"{nombre}.feather")
+            self._escribir(
+                f"{nombre}_geojson.arrow",
+                pa.table({"geojson": pa.array(geojson_features[nombre], type=pa.binary())}),
+            )
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "fuentes": {nombre: huella(rutas) for nombre, rutas in self.fuentes.items()},
+        }
+        (self.dir / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        self._manifest = manifest
+        self._vigencia = {}
@@ -35,10 +35,12 @@ async function obtenerEstados() {
   return await res.json();
 }
 
-async function obtenerEstaciones(estado) {
-  const url = estado && estado !== "TODOS"
-    ? `/api/estaciones?estado=${encodeURIComponent(estado)}`
-    : "/api/estaciones";
+// campos: solo esos campos de cada estación (p. ej. "clave,nombre,municipio")
+async function obtenerEstaciones(estado, campos) {
+  const params = new URLSearchParams();
+  if (estado && estado !== "TODOS") params.set("estado", estado);
+  if (campos) params.set("fields", campos);
+  const url = params.toString() ? `/api/estaciones?${params}` : "/api/estaciones";
   const res = await fetch(url);
   if (!res.ok) throw new Error("Error al obtener estaciones");
   return await res.json();
@@ -62,7 +64,7 @@ estadoSelect.addEventListener("change", async function () {
   if (!estado) return;
 
   try {
-    const datos = await obtenerEstaciones(estado);
+    const datos = await obtenerEstaciones(estado, "municipio");
     const estaciones = datos.estaciones;
 
     // Obtener municipios únicos del estado seleccionado
@@ -104,7 +106,7 @@ municipioSelect.addEventListener("change", async function () {
   }
 
   try {
-    const datos = await obtenerEstaciones(estado);
+    const datos = await obtenerEstaciones(estado, "clave,nombre,municipio");
     let estaciones = datos.estaciones;
 
     // Filtrar por municipio si no es "TODOS"
@@ -435,8 +437,9 @@ async function cargarGeoJSON(estado, municipio) {
 
   try {
     // -------- ESTADO --------
-    let urlE = "/api/estados_geojson";
-    if (e && e !== "TODOS") urlE += `?estado=${encodeURIComponent(e)}`;
+    // zoom: nivel de detalle de la geometría según la vista que se va a mostrar
+    let urlE = "/api/estados_geojson?zoom=" + (e && e !== "TODOS" ? 7 : 5);
+    if (e && e !== "TODOS") urlE += `&estado=${encodeURIComponent(e)}`;
     console.log("[GeoJSON] Fetch estado:", urlE);
 
     const resE = await fetch(urlE);
@@ -458,7 +461,7 @@ async function cargarGeoJSON(estado, municipio) {
     if (m && m.trim() !== "" && m.toUpperCase() !== "NINGUNO") {
       if (m.toUpperCase() === "TODOS") {
         // Caso 1: todos los municipios del estado
-        let urlM = `/api/municipios_geojson?estado=${encodeURIComponent(e)}`;
+        let urlM = `/api/municipios_geojson?estado=${encodeURIComponent(e)}&zoom=9`;
         console.log("[GeoJSON] Fetch todos los municipios:", urlM);
 
         const resM = await fetch(urlM);
@@ -476,7 +479,7 @@ async function cargarGeoJSON(estado, municipio) {
         }
       } else {
         // Caso 2: municipio específico
-        let urlM = `/api/municipios_geojson?estado=${encodeURIComponent(e)}&municipio=${encodeURIComponent(m)}`;
+        let urlM = `/api/municipios_geojson?estado=${encodeURIComponent(e)}&municipio=${encodeURIComponent(m)}&zoom=11`;
         console.log("[GeoJSON] Fetch municipio específico:", urlM);
 
         const resM = await fetch(urlM);
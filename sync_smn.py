@@ -0,0 +1,62 @@
+"""
+Sincroniza el espejo local de los TXT del SMN (ver espejo.py).
+
+    python sync_smn.py                                  # todo el catálogo y todos los tipos
+    python sync_smn.py --tipos diarios,mensuales --estado OAXACA
+    python sync_smn.py --forzar                         # revisar aunque no haya vencido el TTL
+
+Después, con SMN_ORIGEN=espejo (o ?origen=espejo en /api/descargar_csv) la API
+lee los archivos del espejo en lugar de pedirlos al SMN. Pensado para correr
+periódicamente (cron); solo baja lo que cambió.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from catalogo import normalizar
+from cliente_smn import ClienteSMN, SMN_MAX_WORKERS, SMN_MAX_RPS
+from espejo import Espejo, SMN_ESPEJO_DIR
+from kml import iter_kml, KML_FILE
+
+TIPOS = ("diarios", "mensuales", "normales_1961_1990", "normales_1971_2000",
+         "normales_1981_2010", "normales_1991_2020", "extremos")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--destino", type=Path, default=Path(SMN_ESPEJO_DIR), help="directorio del espejo")
+    parser.add_argument("--kml", default=None, help="KML del catálogo (por omisión el de la API)")
+    parser.add_argument("--tipos", default=",".join(TIPOS), help="tipos separados por coma")
+    parser.add_argument("--estado", default=None, help="solo las estaciones de este estado")
+    parser.add_argument("--hilos", type=int, default=SMN_MAX_WORKERS, help="descargas en paralelo")
+    parser.add_argument("--rps", type=float, default=SMN_MAX_RPS, help="peticiones por segundo al SMN (0 = sin límite)")
+    parser.add_argument("--forzar", action="store_true", help="revisar también lo que no ha vencido")
+    args = parser.parse_args()
+
+    tipos = [t.strip().lower() for t in args.tipos.split(",") if t.strip()]
+    invalidos = [t for t in tipos if t not in TIPOS]
+    if invalidos:
+        parser.error(f"tipos desconocidos: {', '.join(invalidos)}")
+
+    estaciones = list(iter_kml(args.kml or KML_FILE))
+    if args.estado:
+        estaciones = [e for e in estaciones if normalizar(e.get("estado")) == normalizar(args.estado)]
+    print(f"📡 {len(estaciones)} estaciones × {len(tipos)} tipos -> {args.destino}")
+
+    def progreso(hechos, total, resumen):
+        if hechos % 100 == 0 or hechos == total:
+            print(f"  {hechos}/{total}  " + "  ".join(f"{k}={v}" for k, v in resumen.items()), flush=True)
+
+    t0 = time.perf_counter()
+    cliente = ClienteSMN(max_workers=args.hilos, max_rps=args.rps)
+    resumen = Espejo(args.destino).sincronizar(estaciones, tipos, cliente, forzar=args.forzar, progreso=progreso)
+
+    print(f"\n✅ Espejo sincronizado en {time.perf_counter() - t0:.1f} s")
+    for estado, cuantos in resumen.items():
+        print(f"  {estado:<12}{cuantos:>8}")
+    return 1 if resumen["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
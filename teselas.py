@@ -0,0 +1,139 @@
+"""
+Teselas vectoriales (Mapbox Vector Tiles) de estados, municipios y estaciones.
+
+Las capas se guardan en Web Mercator (EPSG:3857) con un STRtree, así que cada
+tesela solo toca las geometrías que la intersectan. Esas geometrías se recortan
+al cuadro de la tesela (más un pequeño margen), se simplifican a la resolución
+del zoom y se codifican; el resultado se guarda en una caché LRU.
+"""
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import mapbox_vector_tile
+import numpy as np
+import shapely
+from shapely.geometry import box
+
+from vuelo_unico import VueloUnico
+
+SMN_TESELAS_MAX = int(os.getenv("SMN_TESELAS_MAX", "4096"))
+
+EXTENT = 4096
+BUFFER = 64  # margen en unidades de tesela para que no se vean cortes en los bordes
+ORIGEN = 20037508.342789244  # medio ancho del mundo en EPSG:3857
+ZOOM_MAX = 18
+
+
+def limites_tesela(z, x, y):
+    """(minx, miny, maxx, maxy) en EPSG:3857 de la tesela z/x/y (esquema XYZ)."""
+    tam = 2 * ORIGEN / (2 ** z)
+    minx = -ORIGEN + x * tam
+    maxy = ORIGEN - y * tam
+    return minx, maxy - tam, minx + tam, maxy
+
+
+def _valor_mvt(v):
+    if isinstance(v, np.generic):
+        v = v.item()
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return None
+    if isinstance(v, (str, int, float, bool)):
+        return v
+    return str(v)
+
+
+class CapaVectorial:
+    def __init__(self, geometrias, propiedades):
+        self.geometrias = np.asarray(geometrias, dtype=object)
+        self.propiedades = [
+            {k: val for k, val in ((k, _valor_mvt(v)) for k, v in p.items()) if val is not None}
+            for p in propiedades
+        ]
+        self.arbol = shapely.STRtree(self.geometrias)
+
+    @classmethod
+    def desde_gdf(cls, gdf):
+        gdf = gdf.to_crs(epsg=3857)
+        return cls(gdf.geometry.values, gdf.drop(columns=gdf.geometry.name).to_dict("records"))
+
+    @classmethod
+    def desde_estaciones(cls, estaciones, campos=("clave", "nombre", "estado", "municipio", "situacion")):
+        lons, lats, props = [], [], []
+        for est in estaciones:
+            try:
+                lat, lon = float(est.get("lat")), float(est.get("lon"))
+            except (TypeError, ValueError):
+                continue
+            lats.append(lat)
+            lons.append(lon)
+            props.append({c: est.get(c) for c in campos})
+        # lon/lat -> Web Mercator
+        x = np.radians(lons) * (ORIGEN / math.pi)
+        y = np.log(np.tan(np.pi / 4 + np.radians(np.clip(lats, -85.0511, 85.0511)) / 2)) * (ORIGEN / math.pi)
+        return cls(shapely.points(x, y), props)
+
+
+class TeselasVectoriales:
+    def __init__(self, capas, max_teselas=SMN_TESELAS_MAX):
+        self.capas = dict(capas)
+        self.max_teselas = max_teselas
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._vuelos = VueloUnico()
+
+    def reemplazar_capa(self, nombre, capa):
+        """Cambia una capa (p. ej. al recargar estaciones) y descarta sus teselas."""
+        with self._lock:
+            self.capas[nombre] = capa
+            for llave in [k for k in self._cache if k[0] == nombre]:
+                del self._cache[llave]
+
+    def tesela(self, nombre, z, x, y):
+        """Bytes MVT de la tesela, b"" si no tiene features. KeyError si la capa no existe."""
+        capa = self.capas[nombre]
+        llave = (nombre, z, x, y)
+        with self._lock:
+            data = self._cache.get(llave)
+            if data is not None:
+                self._cache.move_to_end(llave)
+                return data
+
+        return self._vuelos.hacer(llave, lambda: self._generar_y_guardar(llave, capa))
+
+    def _generar_y_guardar(self, llave, capa):
+        nombre, z, x, y = llave
+        data = self._generar(nombre, capa, z, x, y)
+
+        with self._lock:
+            self._cache[llave] = data
+            while len(self._cache) > self.max_teselas:
+                self._cache.popitem(last=False)
+        return data
+
+    def _generar(self, nombre, capa, z, x, y):
+        minx, miny, maxx, maxy = limites = limites_tesela(z, x, y)
+        margen = (maxx - minx) * BUFFER / EXTENT
+        recorte = (minx - margen, miny - margen, maxx + margen, maxy + margen)
+
+        idx = capa.arbol.query(box(*recorte), predicate="intersects")
+        if len(idx) == 0:
+            return b""
+        idx.sort()
+
+        geoms = shapely.clip_by_rect(capa.geometrias[idx], *recorte)
+        # Un píxel de la tesela como tolerancia de simplificación
+        geoms = shapely.simplify(geoms, (maxx - minx) / EXTENT, preserve_topology=True)
+
+        features = [
+            {"geometry": g, "properties": capa.propiedades[i]}
+            for g, i in zip(geoms, idx)
+            if not g.is_empty
+        ]
+        if not features:
+            return b""
+        return mapbox_vector_tile.encode(
+            [{"name": nombre, "features": features}],
+            default_options={"quantize_bounds": limites, "extents": EXTENT},
+        )
@@ -0,0 +1,127 @@
+"""
+Simplificación de una cobertura de polígonos (estados, municipios) por arcos
+compartidos, como TopoJSON.
+
+Simplificar cada polígono por separado mueve distinto la frontera que comparten
+dos vecinos y en zooms alejados aparecen huecos y traslapes. Aquí los anillos
+de toda la capa se parten en arcos en los puntos donde cambian los vecinos
+(uniones); cada frontera compartida queda como un solo arco que se simplifica
+una vez (Douglas-Peucker, que conserva los extremos) y se usa en ambos lados.
+
+shapely.coverage_simplify hace lo mismo pero pide shapely >= 2.1 (GEOS 3.12).
+"""
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon
+
+
+def _anillos(geometria):
+    """Polígonos de una geometría, cada uno como lista de anillos (exterior primero) sin el punto de cierre."""
+    if geometria is None or geometria.is_empty:
+        return []
+    poligonos = geometria.geoms if geometria.geom_type == "MultiPolygon" else [geometria]
+    return [
+        [np.asarray(anillo.coords)[:-1] for anillo in (p.exterior, *p.interiors)]
+        for p in poligonos if p.geom_type == "Polygon" and not p.is_empty
+    ]
+
+
+class Topologia:
+    """Los anillos de una capa partidos en arcos; cada frontera compartida es un solo arco."""
+
+    def __init__(self, geometrias):
+        estructura = [_anillos(g) for g in geometrias]
+        anillos = [a for poligonos in estructura for p in poligonos for a in p]
+        largos = np.array([len(a) for a in anillos], dtype=np.int64)
+
+        # Cada punto distinto recibe un id (en orden lexicográfico de coordenadas)
+        if len(anillos):
+            puntos, ids = np.unique(np.concatenate(anillos), axis=0, return_inverse=True)
+            ids = ids.ravel()
+        else:
+            puntos, ids = np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+        self.puntos = puntos
+        inicios = np.concatenate(([0], np.cumsum(largos)[:-1])) if len(largos) else largos
+
+        # Vecinos de cada aparición de un punto; es unión si aparece con vecinos distintos
+        posicion = np.arange(len(ids))
+        ring = np.repeat(np.arange(len(largos)), largos)
+        previo = ids[np.where(posicion == inicios[ring], posicion + largos[ring] - 1, posicion - 1)]
+        siguiente = ids[np.where(posicion == inicios[ring] + largos[ring] - 1, inicios[ring], posicion + 1)]
+        par = np.minimum(previo, siguiente) * len(puntos) + np.maximum(previo, siguiente)
+        distintos = np.unique(np.stack([ids, par], axis=1), axis=0)[:, 0]
+        es_union = np.zeros(len(puntos), dtype=bool)
+        es_union[distintos[1:][distintos[1:] == distintos[:-1]]] = True
+
+        self.arcos = []  # ids de punto de cada arco, en orientación canónica
+        indice = {}
+        partes = iter(np.split(ids, inicios[1:]) if len(ids) else [])
+        self.geometrias = []  # geometría -> polígonos -> anillos -> [(arco, invertido)]
+        for poligonos in estructura:
+            geometria = []
+            for p in poligonos:
+                poligono = []
+                for _ in p:
+                    anillo = []
+                    for arco in self._partir(next(partes), es_union):
+                        # Un mismo arco se recorre al revés desde el otro lado de la frontera
+                        invertido = (arco[-1], arco[-2]) < (arco[0], arco[1])
+                        canonico = arco[::-1] if invertido else arco
+                        clave = canonico.tobytes()
+                        if clave not in indice:
+                            indice[clave] = len(self.arcos)
+                            self.arcos.append(canonico)
+                        anillo.append((indice[clave], invertido))
+                    poligono.append(anillo)
+                geometria.append(poligono)
+            self.geometrias.append(geometria)
+
+    def _partir(self, anillo, es_union):
+        """Arcos de un anillo (ids de punto), cortado en sus uniones."""
+        cortes = np.flatnonzero(es_union[anillo])
+        if len(cortes) < 2:
+            # Sin uniones (isla o enclave): cortes que no dependen de dónde empieza ni de la orientación
+            primero = int(np.argmin(anillo))
+            distancias = np.hypot(*(self.puntos[anillo] - self.puntos[anillo[primero]]).T)
+            lejanos = np.flatnonzero(distancias == distancias.max())
+            segundo = int(lejanos[np.argmin(anillo[lejanos])])
+            cortes = np.unique(np.r_[cortes, primero, segundo])
+            if len(cortes) < 2:
+                return [np.r_[anillo, anillo[:1]]]
+        girado = np.r_[anillo[cortes[0]:], anillo[:cortes[0]], anillo[cortes[0]]]
+        cortes = np.r_[cortes - cortes[0], len(anillo)]
+        return [girado[a:b + 1] for a, b in zip(cortes[:-1], cortes[1:])]
+
+    def simplificar(self, tolerancia):
+        """Lista de geometrías simplificadas (en el orden original), sin huecos ni traslapes entre vecinos."""
+        if not self.arcos:
+            return [None] * len(self.geometrias)
+        indices = np.repeat(np.arange(len(self.arcos)), [len(a) for a in self.arcos])
+        lineas = shapely.linestrings(self.puntos[np.concatenate(self.arcos)], indices=indices)
+        arcos = [shapely.get_coordinates(g) for g in shapely.simplify(lineas, tolerancia, preserve_topology=False)]
+
+        resultado = []
+        for geometria in self.geometrias:
+            poligonos = []
+            for poligono in geometria:
+                anillos = []
+                for anillo in poligono:
+                    coords = self._unir(arcos, anillo)
+                    if len(coords) < 4:
+                        # Anillo más chico que la tolerancia: va sin simplificar, igual que su
+                        # contraparte (el hueco y el enclave que lo llena colapsan juntos)
+                        coords = self._unir([self.puntos[a] for a in self.arcos], anillo)
+                    anillos.append(coords)
+                poligonos.append(Polygon(anillos[0], anillos[1:]))
+            if not poligonos:
+                resultado.append(None)
+            elif len(poligonos) == 1:
+                resultado.append(poligonos[0])
+            else:
+                resultado.append(MultiPolygon(poligonos))
+        return resultado
+
+    @staticmethod
+    def _unir(arcos, anillo):
+        tramos = [arcos[i][::-1] if invertido else arcos[i] for i, invertido in anillo]
+        return np.concatenate([tramos[0]] + [t[1:] for t in tramos[1:]])
@@ -0,0 +1,52 @@
+"""
+Coalescencia de trabajo idéntico en curso ("single-flight").
+
+Si varias peticiones piden a la vez lo mismo (la misma URL del SMN, el mismo
+archivo parseado, el mismo subconjunto GeoJSON), solo la primera lo calcula;
+las demás esperan y reciben su resultado, o su excepción. Nada se guarda
+después de terminar: eso le toca a las cachés.
+"""
+import threading
+
+
+class _Vuelo:
+    __slots__ = ("listo", "resultado", "error")
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class VueloUnico:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_vuelo = {}
+        self.compartidas = 0  # llamadas que recibieron el resultado de otra
+
+    def hacer(self, llave, fn):
+        """fn() una sola vez por llave entre las llamadas simultáneas."""
+        with self._lock:
+            vuelo = self._en_vuelo.get(llave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._en_vuelo[llave] = _Vuelo()
+            else:
+                self.compartidas += 1
+
+        if not lider:
+            vuelo.listo.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+
+        try:
+            vuelo.resultado = fn()
+        except BaseException as ex:
+            vuelo.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._en_vuelo[llave]
+            vuelo.listo.set()
+        return vuelo.resultado
@@ -0,0 +1,46 @@
+"""
+ZIP escrito en flujo: cada archivo se comprime y se entrega en cuanto está listo.
+
+zipfile acepta destinos sin seek(); en ese caso escribe los tamaños en un
+"data descriptor" después de cada archivo, así que no necesita retroceder y
+el ZIP puede enviarse al cliente mientras se genera. La memoria usada queda
+acotada por el archivo más grande, no por el ZIP completo.
+"""
+import contextlib
+import zipfile
+
+
+class _SalidaZip:
+    """Destino de escritura sin seek/tell que acumula bytes hasta vaciar()."""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, data):
+        self._partes.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        data = b"".join(self._partes)
+        self._partes.clear()
+        return data
+
+
+def zip_en_flujo(archivos, compresion=zipfile.ZIP_DEFLATED, medir=contextlib.nullcontext):
+    """
+    Genera los bytes de un ZIP a partir de un iterable de (nombre, bytes).
+    medir() da el context manager con que se mide la compresión de cada archivo.
+    """
+    salida = _SalidaZip()
+    with zipfile.ZipFile(salida, "w", compresion) as zf:
+        for nombre, contenido in archivos:
+            with medir():
+                zf.writestr(nombre, contenido)
+            chunk = salida.vaciar()
+            if chunk:
+                yield chunk
+    # Directorio central
+    yield salida.vaciar()